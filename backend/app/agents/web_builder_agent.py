@@ -3,12 +3,25 @@ from app.dto.web_plan_dto import WebPlanDTO
 from app.dto.result_dto import GeneratedPageDTO
 import asyncio
 from app.services.page_generator import PageGenerator
+from app.services.scheduler import scheduler, PRIORITY_API
+
+# Palabras que indican que el mensaje modifica la última página en vez de pedir una nueva
+EDIT_KEYWORDS = (
+    "cambia", "modifica", "edita", "añade", "agrega", "quita", "elimina", "sustituye",
+    "change", "modify", "edit", "add ", "remove", "replace", "update",
+)
+
 
 class WebBuilderAgent:
 
     def __init__(self):
         self.generator = PageGenerator()
 
+    def is_edit(self, prompt: str) -> bool:
+        """True si el prompt pide cambiar la página anterior (ver EDIT_KEYWORDS)."""
+        prompt_lower = prompt.lower()
+        return any(word in prompt_lower for word in EDIT_KEYWORDS)
+
     def analyze_prompt(self, prompt: str, images: list | None = None, docs: list | None = None) -> WebPlanDTO:
 
         prompt_lower = prompt.lower()
@@ -40,12 +53,33 @@ class WebBuilderAgent:
             docs=docs,
         )
         
-    async def run(self, prompt_dto: PromptDTO) -> GeneratedPageDTO:
+    async def run(
+        self,
+        prompt_dto: PromptDTO,
+        session_id: str = "anonymous",
+        priority: str = PRIORITY_API,
+        on_progress=None,
+    ) -> GeneratedPageDTO:
 
         plan = self.analyze_prompt(prompt_dto.prompt, images=getattr(prompt_dto, 'images', None), docs=getattr(prompt_dto, 'docs', None))
 
-        html = await self.generator.generate(plan)
+        return await self.generate_plan(plan, session_id=session_id, priority=priority, on_progress=on_progress)
+
+    async def generate_plan(
+        self,
+        plan: WebPlanDTO,
+        session_id: str = "anonymous",
+        priority: str = PRIORITY_API,
+        rate_limited: bool = True,
+        on_progress=None,
+    ) -> GeneratedPageDTO:
+
+        # Turno justo entre sesiones (puede lanzar RateLimitExceeded)
+        async with scheduler.slot(session_id, priority, rate_limited):
+            html = await self.generator.generate(plan, on_progress=on_progress)
 
+        # Salida del modelo: se valida (para un str es comprobar el tipo, no recorre el HTML);
+        # lo que se evita es volver a validarla al responder (ver services/responses.py)
         return GeneratedPageDTO(
             html=html,
             framework="html"
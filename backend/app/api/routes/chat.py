@@ -1,12 +1,16 @@
-from fastapi import APIRouter, Depends
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, Request, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from app.agents.web_builder_agent import WebBuilderAgent
-from app.dto.prompt_dto import PromptDTO
-from app.db.database import get_db
+from app.db.database import get_db, SessionLocal
 from app.db import repository
 from app.services.file_storage import save_page
+from app.services import executors, static_assets, metrics, speculation, conversation_context, responses
+from app.services.scheduler import scheduler, RateLimitExceeded, PRIORITY_INTERACTIVE, PRIORITY_SPECULATIVE
+from starlette.websockets import WebSocketState
+import os
+import time
 import asyncio
 import logging
 
@@ -14,6 +18,11 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 agent = WebBuilderAgent()
 
+WS_HEARTBEAT_S = float(os.getenv("WS_HEARTBEAT_S", 20))
+WS_MAX_GENERATIONS = int(os.getenv("WS_MAX_GENERATIONS", 3))
+_active_sockets: set = set()
+_context_refreshes: set = set()   # referencias a las tareas sueltas para que no las recoja el GC
+
 
 class ChatMessage(BaseModel):
     message: str
@@ -21,393 +30,126 @@ class ChatMessage(BaseModel):
 
 
 @router.get("/chat", response_class=HTMLResponse)
-async def chat_page():
-    return """
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>ADK Agent Chat</title>
-        <style>
-            * { margin: 0; padding: 0; box-sizing: border-box; }
-
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                min-height: 100vh;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                padding: 20px;
-            }
-
-            .container {
-                width: 100%;
-                max-width: 900px;
-                height: 700px;
-                background: white;
-                border-radius: 12px;
-                box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-                display: flex;
-                flex-direction: column;
-                overflow: hidden;
-            }
-
-            .header {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                padding: 20px;
-                text-align: center;
-            }
-
-            .header h1 { font-size: 24px; margin-bottom: 5px; }
-            .header p { font-size: 12px; opacity: 0.9; }
-
-            .chat-messages {
-                flex: 1;
-                overflow-y: auto;
-                padding: 20px;
-                display: flex;
-                flex-direction: column;
-                gap: 15px;
-                background: #f8f9fa;
-            }
-
-            .message { display: flex; gap: 10px; animation: slideIn 0.3s ease-out; }
-
-            @keyframes slideIn {
-                from { opacity: 0; transform: translateY(10px); }
-                to { opacity: 1; transform: translateY(0); }
-            }
-
-            .message.user { justify-content: flex-end; }
-
-            .message-content {
-                max-width: 600px;
-                padding: 12px 16px;
-                border-radius: 10px;
-                font-size: 14px;
-                line-height: 1.4;
-                word-wrap: break-word;
-            }
-
-            .message.user .message-content {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                border-bottom-right-radius: 2px;
-            }
-
-            .message.agent .message-content {
-                background: white;
-                color: #333;
-                border: 1px solid #e0e0e0;
-                border-bottom-left-radius: 2px;
-            }
-
-            .message.agent iframe {
-                width: 100%;
-                min-width: 600px;
-                height: 400px;
-                border: none;
-                border-radius: 8px;
-                box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-            }
-
-            .file-badge {
-                display: inline-flex;
-                align-items: center;
-                gap: 6px;
-                margin-top: 8px;
-                padding: 5px 10px;
-                background: #f0f4ff;
-                border: 1px solid #c7d2fe;
-                border-radius: 20px;
-                font-size: 11px;
-                color: #4f46e5;
-                font-family: monospace;
-            }
-
-            .file-badge a {
-                color: #4f46e5;
-                text-decoration: none;
-                font-weight: 600;
-            }
-
-            .file-badge a:hover { text-decoration: underline; }
-
-            .input-area {
-                padding: 20px;
-                border-top: 1px solid #e0e0e0;
-                display: flex;
-                gap: 10px;
-                background: white;
-                align-items: center;
-            }
-
-            input[type="text"] {
-                flex: 1;
-                padding: 12px 16px;
-                border: 2px solid #e0e0e0;
-                border-radius: 25px;
-                font-size: 14px;
-                outline: none;
-                transition: border-color 0.2s;
-            }
-
-            input[type="text"]:focus { border-color: #667eea; }
-
-            button {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                border: none;
-                padding: 12px 24px;
-                border-radius: 25px;
-                cursor: pointer;
-                font-size: 14px;
-                font-weight: 600;
-                transition: transform 0.2s, box-shadow 0.2s;
-            }
-
-            button:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 5px 20px rgba(102, 126, 234, 0.4);
-            }
-
-            button:disabled { opacity: 0.6; cursor: not-allowed; transform: none; }
-
-            #fileBtn {
-                padding: 12px;
-                border-radius: 50%;
-                width: 45px;
-                height: 45px;
-                background: #e0e0e0;
-                color: #333;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                font-size: 18px;
-            }
-
-            #fileBtn:hover {
-                background: #d0d0d0;
-                box-shadow: none;
-                transform: none;
-            }
-
-            .typing-indicator { display: flex; gap: 5px; padding: 12px 16px; }
-            .typing-indicator span {
-                width: 8px; height: 8px;
-                background: #999;
-                border-radius: 50%;
-                animation: typing 1.4s infinite;
-            }
-            .typing-indicator span:nth-child(2) { animation-delay: 0.2s; }
-            .typing-indicator span:nth-child(3) { animation-delay: 0.4s; }
-
-            @keyframes typing {
-                0%, 60%, 100% { transform: translateY(0); }
-                30% { transform: translateY(-10px); }
-            }
-
-            .chat-messages::-webkit-scrollbar { width: 8px; }
-            .chat-messages::-webkit-scrollbar-track { background: #f1f1f1; }
-            .chat-messages::-webkit-scrollbar-thumb { background: #888; border-radius: 4px; }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🤖 AI Web Builder</h1>
-                <p>Describe la página web que quieres y la generaré para ti</p>
-            </div>
-
-            <div class="chat-messages" id="messages">
-                <div class="message agent">
-                    <div class="message-content">
-                        ¡Hola! Soy tu asistente de diseño web. Dime qué página quieres crear:<br/><br/>
-                        • <b>Tienda online</b> → "quiero una tienda de ropa"<br/>
-                        • <b>Portfolio</b> → "crea mi portfolio de diseñador"<br/>
-                        • <b>Landing page</b> → "landing para mi startup de IA"<br/><br/>
-                        Puedes adjuntar imágenes o documentos con el botón 📎
-                    </div>
-                </div>
-            </div>
-
-            <div class="input-area">
-                <input
-                    type="text"
-                    id="messageInput"
-                    placeholder="Describe tu página web..."
-                    autocomplete="off"
-                />
-                <input type="file" id="fileInput" multiple accept="image/*,.pdf,.doc,.docx"
-                    style="display:none" onchange="updateFileLabel()"/>
-                <button onclick="document.getElementById('fileInput').click()"
-                    id="fileBtn">
-                    📎
-                </button>
-                <button id="sendBtn" onclick="sendMessage()">Generar</button>
-            </div>
-        </div>
-
-        <script>
-            function getSessionId() {
-                let sid = localStorage.getItem('session_id');
-                if (!sid) {
-                    sid = crypto.randomUUID();
-                    localStorage.setItem('session_id', sid);
-                }
-                return sid;
-            }
-
-            const SESSION_ID = getSessionId();
-            const messageInput = document.getElementById('messageInput');
-            const sendBtn = document.getElementById('sendBtn');
-            const messagesDiv = document.getElementById('messages');
-
-            messageInput.addEventListener('keypress', (e) => {
-                if (e.key === 'Enter' && !e.shiftKey) {
-                    e.preventDefault();
-                    sendMessage();
-                }
-            });
-
-            function updateFileLabel() {
-                const files = document.getElementById('fileInput').files;
-                const fileBtn = document.getElementById('fileBtn');
-                if (files.length > 0) {
-                    fileBtn.textContent = `📎 ${files.length}`;
-                    fileBtn.style.background = '#667eea';
-                    fileBtn.style.color = 'white';
-                } else {
-                    fileBtn.textContent = '📎';
-                    fileBtn.style.background = '#e0e0e0';
-                    fileBtn.style.color = '#333';
-                }
-            }
-
-            async function sendMessage() {
-                const message = messageInput.value.trim();
-                const files = document.getElementById('fileInput').files;
-                if (!message) return;
-
-                addUserMessage(message);
-                messageInput.value = '';
-                sendBtn.disabled = true;
-
-                const loadingDiv = document.createElement('div');
-                loadingDiv.className = 'message agent';
-                loadingDiv.innerHTML = '<div class="message-content typing-indicator"><span></span><span></span><span></span></div>';
-                messagesDiv.appendChild(loadingDiv);
-                scrollToBottom();
-
-                try {
-                    let response;
-
-                    if (files.length > 0) {
-                        const formData = new FormData();
-                        formData.append('prompt', message);
-                        for (const file of files) {
-                            if (file.type.startsWith('image/')) {
-                                formData.append('images', file);
-                            } else {
-                                formData.append('docs', file);
-                            }
-                        }
-                        response = await fetch('/generate/upload', {
-                            method: 'POST',
-                            body: formData
-                        });
-                        document.getElementById('fileInput').value = '';
-                        updateFileLabel();
-                    } else {
-                        response = await fetch('/api/chat/message', {
-                            method: 'POST',
-                            headers: { 'Content-Type': 'application/json' },
-                            body: JSON.stringify({ message, session_id: SESSION_ID })
-                        });
-                    }
-
-                    loadingDiv.remove();
-                    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-
-                    const data = await response.json();
-                    addAgentMessage(
-                        data.html || data.response,
-                        data.html_file,
-                        data.json_file,
-                        data.page_id
-                    );
-
-                } catch (error) {
-                    loadingDiv.remove();
-                    addTextMessage(`Error: ${error.message}`);
-                } finally {
-                    sendBtn.disabled = false;
-                    messageInput.focus();
-                }
-            }
-
-            function addUserMessage(text) {
-                const div = document.createElement('div');
-                div.className = 'message user';
-                div.innerHTML = `<div class="message-content">${escapeHtml(text)}</div>`;
-                messagesDiv.appendChild(div);
-                scrollToBottom();
-            }
-
-            function addAgentMessage(html, htmlFile, jsonFile, pageId) {
-                const div = document.createElement('div');
-                div.className = 'message agent';
-
-                let content = '';
-
-                if (html && (html.trim().startsWith('<!DOCTYPE') || html.trim().startsWith('<html'))) {
-                    const encoded = html.replace(/"/g, '&quot;');
-                    content += `<iframe srcdoc="${encoded}"></iframe>`;
-                } else if (html) {
-                    content += `<div class="message-content">${escapeHtml(html)}</div>`;
-                }
-
-                if (htmlFile || jsonFile) {
-                    content += `<div style="display:flex; gap:8px; flex-wrap:wrap; margin-top:8px;">`;
-                    if (htmlFile) {
-                        content += `<span class="file-badge">📄 <a href="/uploads/${htmlFile}" target="_blank">${htmlFile}</a></span>`;
-                    }
-                    if (jsonFile) {
-                        content += `<span class="file-badge">🗂️ <a href="/uploads/${jsonFile}" target="_blank">${jsonFile}</a></span>`;
-                    }
-                    content += `</div>`;
-                }
-
-                div.innerHTML = content;
-                messagesDiv.appendChild(div);
-                scrollToBottom();
-            }
-
-            function addTextMessage(text) {
-                const div = document.createElement('div');
-                div.className = 'message agent';
-                div.innerHTML = `<div class="message-content">${escapeHtml(text)}</div>`;
-                messagesDiv.appendChild(div);
-                scrollToBottom();
-            }
-
-            function scrollToBottom() {
-                messagesDiv.scrollTop = messagesDiv.scrollHeight;
-            }
-
-            function escapeHtml(text) {
-                const map = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#039;' };
-                return text.replace(/[&<>"']/g, m => map[m]);
-            }
-
-            messageInput.focus();
-        </script>
-    </body>
-    </html>
+async def chat_page(request: Request):
+    return static_assets.index_response(request)
+
+
+@router.get("/static/chat/{filename}", include_in_schema=False)
+async def chat_asset(filename: str, request: Request):
+    response = static_assets.asset_response(filename, request)
+    if response is None:
+        raise HTTPException(status_code=404)
+    return response
+
+
+def _plan(session_id: str, message: str, context: str):
     """
+    Plan de un mensaje del chat con su contexto. Si el mensaje pide cambios (agent.is_edit)
+    y hay una página anterior, es una edición de esa página (base_page_id).
+    """
+    plan = agent.analyze_prompt(message)
+    plan.context = context or None
+    if agent.is_edit(message):
+        plan.base_page_id = conversation_context.last_page_id(session_id)
+    return plan
+
+
+async def _speculate(session_id: str, draft: str) -> bool:
+    """Pasa un borrador del prompt al especulador. True si hay generación especulativa para él."""
+    draft = draft.strip()
+    if len(draft) < speculation.SPECULATION_MIN_CHARS:
+        return False
+
+    async def generate(plan, on_progress):
+        return await agent.generate_plan(
+            plan, session_id=session_id, priority=PRIORITY_SPECULATIVE, rate_limited=False, on_progress=on_progress
+        )
+
+    def plan_draft():
+        # Mismo contexto que tendrá el envío si no llegan turnos nuevos (si no, el plan no coincide)
+        return _plan(session_id, draft, conversation_context.cached_context(session_id))
+
+    # cached_context/last_page_id leen shared_state (SQLite): fuera del loop, como el análisis
+    plan = await executors.run_in_thread(plan_draft)
+    return await speculation.speculator.on_draft(session_id, plan, generate)
+
+
+async def _generate(session_id: str, plan, on_progress=None):
+    """Reutiliza la generación especulativa si el plan coincide; si no, genera con prioridad interactiva."""
+    task = speculation.speculator.claim(session_id, plan)
+    if task is not None:
+        try:
+            # La reutilización cuenta para la cuota de la sesión igual que una generación normal
+            await scheduler.check_rate(session_id)
+        except RateLimitExceeded:
+            task.cancel()
+            metrics.incr("speculation.wasted")
+            raise
+        if on_progress is not None:
+            await on_progress("speculative_hit", {})
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.cancel()   # nos cancelan a nosotros: la especulación ya no la quiere nadie
+            raise
+        except Exception as e:
+            logger.warning(f"La generación especulativa falló ({e}); se genera de nuevo")
+    return await agent.generate_plan(plan, session_id=session_id, priority=PRIORITY_INTERACTIVE, on_progress=on_progress)
+
+
+async def _process_message(db: Session, session_id: str, user_message: str, on_progress=None) -> dict:
+    """Genera la página de un mensaje del chat y lo persiste (BD + disco)."""
+    user = repository.get_or_create_user(db, session_id)
+    # Antes de guardar el mensaje actual: el contexto son solo los turnos anteriores
+    context = await executors.run_in_thread(conversation_context.build_context, db, session_id)
+    repository.save_message(db, user.id, "user", user_message)
+    logger.info(f"Mensaje recibido de sesión {session_id}: {user_message[:50]}")
+
+    plan = _plan(session_id, user_message, context)
+    result = await _generate(session_id, plan, on_progress=on_progress)
+    site_type = plan.site_type
+
+    await executors.run_in_thread(repository.save_generated_page, db, user.id, user_message, site_type, result.html)
+    repository.save_message(db, user.id, "agent", result.html)
+    logger.info(f"Página generada ({site_type}) para sesión {session_id}")
+
+    file_meta = await executors.run_in_thread(
+        save_page,
+        html=result.html,
+        prompt=user_message,
+        site_type=site_type,
+        session_id=session_id,
+    )
+    logger.info(f"Archivos guardados en disco: {file_meta['page_id']}")
+
+    response = {
+        "response": result.html,
+        "page_id": file_meta["page_id"],
+        "html_file": file_meta["html_file"],
+        "json_file": file_meta["json_file"],
+    }
+    # Con este turno ya guardado: los borradores del siguiente (cached_context/last_page_id)
+    # verán el mismo contexto que tendrá su envío y la especulación podrá coincidir.
+    # La respuesta no lo necesita: se recalcula en segundo plano
+    task = asyncio.create_task(executors.run_in_thread(_refresh_context, session_id))
+    _context_refreshes.add(task)
+    task.add_done_callback(_context_refreshed)
+    return response
+
+
+def _refresh_context(session_id: str):
+    """Recalcula el contexto de la sesión con su propia sesión de BD (la de la petición ya se habrá cerrado)."""
+    db = SessionLocal()
+    try:
+        conversation_context.build_context(db, session_id)
+    finally:
+        db.close()
+
+
+def _context_refreshed(task: asyncio.Task):
+    _context_refreshes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"No se pudo actualizar el contexto de la conversación: {task.exception()}")
 
 
 @router.post("/api/chat/message")
@@ -418,35 +160,157 @@ async def chat_message(request: ChatMessage, db: Session = Depends(get_db)):
         return {"response": "Por favor envía un mensaje."}
 
     try:
-        user = repository.get_or_create_user(db, request.session_id)
-        repository.save_message(db, user.id, "user", user_message)
-        logger.info(f"Mensaje recibido de sesión {request.session_id}: {user_message[:50]}")
+        return responses.FastJSONResponse(await _process_message(db, request.session_id, user_message))
+
+    except RateLimitExceeded as e:
+        logger.warning(f"Sesión {request.session_id} limitada: {e}")
+        return JSONResponse(
+            {"response": f"Vas demasiado rápido. Inténtalo de nuevo en {max(1, int(e.retry_after))} s."},
+            status_code=429,
+            headers={"Retry-After": str(max(1, int(e.retry_after)))},
+        )
 
-        prompt_dto = PromptDTO(prompt=user_message)
-        result = await agent.run(prompt_dto)
+    except Exception as e:
+        logger.error(f"Error procesando mensaje: {str(e)}", exc_info=True)
+        return {"response": f"Error al procesar tu mensaje: {str(e)}"}
 
-        plan = agent.analyze_prompt(user_message)
-        site_type = plan.site_type
 
-        repository.save_generated_page(db, user.id, user_message, site_type, result.html)
-        repository.save_message(db, user.id, "agent", result.html)
-        logger.info(f"Página generada ({site_type}) para sesión {request.session_id}")
+@router.post("/api/chat/draft")
+async def chat_draft(request: ChatMessage):
+    """Borrador del prompt mientras se escribe (alternativa HTTP al mensaje "draft" del WebSocket)."""
+    return {"speculating": await _speculate(request.session_id, request.message)}
 
-        file_meta = save_page(
-            html=result.html,
-            prompt=user_message,
-            site_type=site_type,
-            session_id=request.session_id,
-        )
-        logger.info(f"Archivos guardados en disco: {file_meta['page_id']}")
 
-        return {
-            "response": result.html,
-            "page_id": file_meta["page_id"],
-            "html_file": file_meta["html_file"],
-            "json_file": file_meta["json_file"],
-        }
+class _ChatSocket:
+    """
+    Una conexión WebSocket del chat (una por pestaña). Protocolo JSON:
+
+    cliente → {"type": "message", "id": "<id>", "message": "..."}
+              {"type": "cancel", "id": "<id>"}
+              {"type": "draft", "message": "..."}   borrador con debounce (ver speculation.py)
+              {"type": "ping"}
+    servidor → {"type": "progress", "id", "stage", ...}   planning / tool_call / ... / speculative_hit
+               {"type": "result", "id", "response", "page_id", "html_file", "json_file"}
+               {"type": "error", "id", "message", ["retry_after"]}
+               {"type": "cancelled", "id"}
+               {"type": "heartbeat"} cada WS_HEARTBEAT_S, {"type": "pong"}
+    """
 
+    def __init__(self, websocket: WebSocket, session_id: str):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.tasks: dict = {}              # id de la petición → asyncio.Task
+        self._send_lock = asyncio.Lock()   # los envíos de varias generaciones no pueden intercalarse
+
+    async def send(self, payload: dict):
+        data = responses.dumps(payload).decode("utf-8")
+        async with self._send_lock:
+            await self.websocket.send_text(data)
+
+    async def heartbeat(self):
+        """
+        Latido cada WS_HEARTBEAT_S. Si el envío falla la conexión está muerta aunque
+        receive_json aún no se haya enterado: se cierra el socket, lo que despierta al
+        bucle de recepción y limpia la conexión (la excepción no queda sin recoger).
+        """
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_S)
+            try:
+                await self.send({"type": "heartbeat", "active": len(self.tasks)})
+            except Exception as e:
+                metrics.incr("ws.heartbeat_failed")
+                logger.info(f"Latido fallido en la sesión {self.session_id} ({e}); se cierra el WebSocket")
+                try:
+                    await self.websocket.close(code=1011)
+                except Exception:
+                    pass
+                return
+
+    async def generate(self, request_id: str, user_message: str):
+        async def on_progress(stage: str, data: dict):
+            await self.send({"type": "progress", "id": request_id, "stage": stage, **data})
+
+        db = SessionLocal()
+        start = time.perf_counter()
+        try:
+            result = await _process_message(db, self.session_id, user_message, on_progress=on_progress)
+            metrics.observe("ws.generation_s", time.perf_counter() - start)
+            await self.send({"type": "result", "id": request_id, **result})
+        except asyncio.CancelledError:
+            metrics.incr("ws.cancelled")
+            logger.info(f"Generación {request_id} cancelada (sesión {self.session_id})")
+            if self.websocket.client_state == WebSocketState.CONNECTED:
+                await asyncio.shield(self.send({"type": "cancelled", "id": request_id}))
+            raise
+        except RateLimitExceeded as e:
+            await self.send({
+                "type": "error", "id": request_id, "retry_after": e.retry_after,
+                "message": f"Vas demasiado rápido. Inténtalo de nuevo en {max(1, int(e.retry_after))} s.",
+            })
+        except Exception as e:
+            logger.error(f"Error procesando mensaje por WebSocket: {str(e)}", exc_info=True)
+            await self.send({"type": "error", "id": request_id, "message": f"Error al procesar tu mensaje: {str(e)}"})
+        finally:
+            db.close()
+            self.tasks.pop(request_id, None)
+
+    async def handle(self, data: dict):
+        kind = data.get("type")
+        request_id = str(data.get("id") or "")
+
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "draft":
+            await _speculate(self.session_id, str(data.get("message") or ""))
+        elif kind == "cancel":
+            task = self.tasks.get(request_id)
+            if task is not None:
+                task.cancel()
+        elif kind == "message":
+            user_message = str(data.get("message") or "").strip()
+            if not request_id or not user_message:
+                await self.send({"type": "error", "id": request_id, "message": "Por favor envía un mensaje."})
+            elif request_id in self.tasks:
+                await self.send({"type": "error", "id": request_id, "message": "Id de petición duplicado."})
+            elif len(self.tasks) >= WS_MAX_GENERATIONS:
+                await self.send({
+                    "type": "error", "id": request_id,
+                    "message": f"Máximo {WS_MAX_GENERATIONS} generaciones simultáneas por conexión.",
+                })
+            else:
+                metrics.incr("ws.generations")
+                self.tasks[request_id] = asyncio.create_task(self.generate(request_id, user_message))
+        else:
+            await self.send({"type": "error", "id": request_id, "message": f"Tipo de mensaje desconocido: {kind}"})
+
+    async def close(self):
+        """Al desconectarse la pestaña se cancelan sus generaciones en curso."""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router.websocket("/ws/chat/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: str):
+    await websocket.accept()
+    conn = _ChatSocket(websocket, session_id)
+    heartbeat = asyncio.create_task(conn.heartbeat())
+    _active_sockets.add(conn)
+    metrics.set_gauge("ws.connections", len(_active_sockets))
+    try:
+        while True:
+            data = await websocket.receive_json()
+            if isinstance(data, dict):
+                await conn.handle(data)
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        logger.error(f"Error procesando mensaje: {str(e)}", exc_info=True)
-        return {"response": f"Error al procesar tu mensaje: {str(e)}"}
\ No newline at end of file
+        logger.warning(f"WebSocket del chat cerrado por error (sesión {session_id}): {e}")
+    finally:
+        heartbeat.cancel()
+        await conn.close()
+        _active_sockets.discard(conn)
+        if not any(s.session_id == session_id for s in _active_sockets):
+            speculation.speculator.cancel_session(session_id)
+        metrics.set_gauge("ws.connections", len(_active_sockets))
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response
+from app.services import export, executors, metrics
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/export", tags=["export"])
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str | None, size: int) -> tuple | None:
+    """(inicio, fin inclusive o None) de un Range de un solo tramo; None si no hay o no se entiende."""
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        return max(0, size - int(last)), size - 1   # sufijo: los últimos N bytes
+    return int(first), int(last) if last else None
+
+
+@router.get("")
+async def export_pages(
+    request: Request,
+    session_id: str = None,
+    since: str = Query(None, description="Fecha/hora ISO (incluida), sobre created_at"),
+    until: str = Query(None, description="Fecha/hora ISO (excluida)"),
+    format: str = Query("tar", pattern="^(tar|zip)$"),
+):
+    """
+    Descarga en streaming las páginas de una sesión o de un rango de fechas, con sus ficheros
+    subidos y un manifest.jsonl. En tar admite Range/If-Range para reanudar descargas cortadas.
+    """
+    if not (session_id or since or until):
+        raise HTTPException(status_code=422, detail="Indica session_id y/o un rango since/until")
+    try:
+        plan = await executors.run_in_thread(export.plan_export, session_id, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not plan.pages:
+        raise HTTPException(status_code=404, detail="No hay páginas que exportar")
+
+    metrics.incr(f"export.requests.{format}")
+    headers = {"Content-Disposition": f'attachment; filename="{plan.root}.{format}"'}
+    if format == "zip":
+        # Sin tamaño conocido de antemano no hay rangos: para descargas reanudables, format=tar
+        headers["Accept-Ranges"] = "none"
+        return StreamingResponse(
+            export.measured(export.iter_zip(plan), plan.root), media_type=export.FORMATS[format], headers=headers,
+        )
+
+    etag = f'"{plan.etag}"'
+    segments = export.tar_segments(plan)
+    size = export.tar_size(segments)
+    headers.update({"ETag": etag, "Accept-Ranges": "bytes"})
+
+    requested = _parse_range(request.headers.get("range"), size)
+    if_range = request.headers.get("if-range")
+    if requested is not None and if_range and if_range != etag:
+        requested = None   # el archivo ha cambiado desde la primera descarga: se envía completo
+    if requested is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            export.measured(export.iter_tar(segments), plan.root), media_type=export.FORMATS[format], headers=headers,
+        )
+
+    start, end = requested
+    end = size - 1 if end is None else min(end, size - 1)
+    if start >= size or start > end:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    metrics.incr("export.resumed")
+    logger.info(f"Exportación {plan.root} reanudada desde el byte {start}")
+    return StreamingResponse(
+        export.measured(export.iter_tar(segments, start, end), plan.root),
+        status_code=206, media_type=export.FORMATS[format], headers=headers,
+    )
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends
+from fastapi import APIRouter, UploadFile, File, Form, Depends, Request, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List
 from sqlalchemy.orm import Session
-from app.dto.prompt_dto import PromptDTO
+from app.dto.prompt_dto import PromptDTO, BatchPromptDTO
 from app.dto.result_dto import GeneratedPageDTO
 from app.agents.web_builder_agent import WebBuilderAgent
-from app.db.database import get_db
+from app.db.database import get_db, SessionLocal
 from app.db import repository
+from app.services import file_storage, metrics, executors, storage, responses, doc_ingestion
+from app.services.scheduler import scheduler, RateLimitExceeded, PRIORITY_API, PRIORITY_BATCH
+from app.services.output_guard import OutputRejected
 import os
+import json
+import time
 import asyncio
 import uuid
 import logging
@@ -15,62 +21,246 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 agent = WebBuilderAgent()
 
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 3))
+# Cada cuántas páginas terminadas se vuelcan a la BD en bloque
+BATCH_DB_FLUSH_EVERY = int(os.getenv("BATCH_DB_FLUSH_EVERY", 10))
+
+
+def _check_attachments(prompt_dto: PromptDTO):
+    """
+    images/docs solo pueden nombrar ficheros subidos con /generate/upload (claves de storage):
+    una ruta del servidor acabaría leída y copiada en el prompt del modelo. 422 si no lo son,
+    415 si un documento no tiene un formato legible.
+    """
+    for key in prompt_dto.images + prompt_dto.docs:
+        try:
+            storage.check_upload_key(key)
+        except storage.InvalidKey:
+            raise HTTPException(status_code=422, detail=f"{key!r} no es un fichero subido con /generate/upload")
+    for key in prompt_dto.docs:
+        try:
+            doc_ingestion.check_supported(key)
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=f"{key}: {e}")
+
+
+async def _run_scheduled(prompt_dto: PromptDTO, client_key: str) -> GeneratedPageDTO:
+    """
+    Ejecuta el agente con prioridad de API; traduce el rate limit a HTTP 429 y una
+    respuesta del modelo descartada por el output guard (agotados los reintentos) a 502.
+    """
+    try:
+        return await agent.run(prompt_dto, session_id=client_key, priority=PRIORITY_API)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, int(e.retry_after)))},
+        )
+    except OutputRejected as e:
+        metrics.incr(f"generate.rejected.{e.reason}")
+        raise HTTPException(
+            status_code=502,
+            detail={"error": "output_rejected", "reason": e.reason, "message": str(e)},
+        )
+
 
 @router.post("/generate", response_model=GeneratedPageDTO)
-async def generate_page(data: PromptDTO, db: Session = Depends(get_db)):
-    result = await agent.run(data)
+async def generate_page(data: PromptDTO, request: Request, db: Session = Depends(get_db)):
+    _check_attachments(data)
+    result = await _run_scheduled(data, f"ip:{request.client.host}")
 
     # Guardar en BD usando session_id genérico para requests sin sesión de usuario
     session_id = f"api_{uuid.uuid4().hex}"
     user = repository.get_or_create_user(db, session_id)
     plan = agent.analyze_prompt(data.prompt)
-    repository.save_generated_page(db, user.id, data.prompt, plan.site_type, result.html)
+    await executors.run_in_thread(
+        repository.save_generated_page, db, user.id, data.prompt, plan.site_type, result.html, revision=False,
+    )
     repository.save_message(db, user.id, "user", data.prompt)
     repository.save_message(db, user.id, "agent", result.html)
     logger.info(f"Página generada vía /generate (tipo: {plan.site_type})")
 
-    return result
+    # Respuesta ya serializada: FastAPI no vuelve a validar el DTO con response_model
+    return responses.page_response(request, result)
 
 
 @router.post("/generate/upload", response_model=GeneratedPageDTO)
 async def generate_with_upload(
+    request: Request,
     prompt: str = Form(...),
     images: List[UploadFile] = File(default=[]),
     docs: List[UploadFile] = File(default=[]),
     session_id: str = Form(default=None),
     db: Session = Depends(get_db),
 ):
-    """Acepta archivos (imágenes y docs), los guarda en backend/uploads y llama al agente."""
-    upload_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
-    upload_dir = os.path.abspath(upload_dir)
-    os.makedirs(upload_dir, exist_ok=True)
-
-    image_paths = []
-    for f in images:
-        filename = f"{uuid.uuid4().hex}_{f.filename}"
-        dest = os.path.join(upload_dir, filename)
-        with open(dest, "wb") as out:
-            out.write(await f.read())
-        image_paths.append(dest)
-
-    doc_paths = []
+    """Acepta archivos (imágenes y docs), los guarda en el almacenamiento y llama al agente."""
+    backend = storage.backend()
+
+    # Antes de guardar nada: un documento que no se podrá leer es un error del cliente, no un prompt sin contexto
     for f in docs:
-        filename = f"{uuid.uuid4().hex}_{f.filename}"
-        dest = os.path.join(upload_dir, filename)
-        with open(dest, "wb") as out:
-            out.write(await f.read())
-        doc_paths.append(dest)
+        try:
+            doc_ingestion.check_supported(f.filename or "")
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=f"{f.filename}: {e}")
 
-    prompt_dto = PromptDTO(prompt=prompt, images=image_paths, docs=doc_paths)
-    result = await agent.run(prompt_dto)
+    asset_keys = []
+
+    async def _store(f: UploadFile) -> str:
+        key = storage.upload_key(f.filename)
+        data = await f.read()
+        await executors.run_in_thread(backend.put, key, data, f.content_type)
+        asset_keys.append(key)
+        return key
+
+    image_keys = [await _store(f) for f in images]
+    doc_keys = [await _store(f) for f in docs]
+
+    # El generador resuelve las claves a través del almacenamiento (ver _check_attachments)
+    prompt_dto = PromptDTO(prompt=prompt, images=image_keys, docs=doc_keys)
+    result = await _run_scheduled(prompt_dto, session_id or f"ip:{request.client.host}")
 
     # Guardar en BD
     effective_session_id = session_id if session_id else f"upload_{uuid.uuid4().hex}"
     user = repository.get_or_create_user(db, effective_session_id)
     plan = agent.analyze_prompt(prompt)
-    repository.save_generated_page(db, user.id, prompt, plan.site_type, result.html)
+    await executors.run_in_thread(
+        repository.save_generated_page, db, user.id, prompt, plan.site_type, result.html, revision=session_id is not None,
+    )
     repository.save_message(db, user.id, "user", prompt)
     repository.save_message(db, user.id, "agent", result.html)
-    logger.info(f"Página generada vía /generate/upload (tipo: {plan.site_type}, archivos: {len(image_paths)} imgs, {len(doc_paths)} docs)")
+    # En el file store con sus ficheros subidos, para que la exportación de la sesión los incluya
+    await executors.run_in_thread(
+        file_storage.save_page,
+        html=result.html, prompt=prompt, site_type=plan.site_type,
+        session_id=effective_session_id, assets=asset_keys,
+    )
+    logger.info(f"Página generada vía /generate/upload (tipo: {plan.site_type}, archivos: {len(image_keys)} imgs, {len(doc_keys)} docs)")
+
+    return responses.page_response(request, result)
+
+
+def _ndjson(obj: dict) -> bytes:
+    return responses.dumps(obj) + b"\n"
+
+
+@router.post("/generate/batch")
+async def generate_batch(data: BatchPromptDTO, request: Request):
+    """
+    Genera muchas páginas a la vez. Planifica todos los prompts, agrupa los planes idénticos
+    (se generan una sola vez), genera con concurrencia acotada y devuelve cada resultado como
+    una línea NDJSON en cuanto termina. Un error en un elemento no hace fallar el batch.
+    Cuesta un token de la cuota de la sesión por plan único: 429 si no los hay, 413 si el
+    batch no cabría ni con el bucket lleno (SESSION_BURST).
+    """
+    if not data.prompts:
+        raise HTTPException(status_code=422, detail="El batch está vacío")
+    if len(data.prompts) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_ITEMS} prompts por batch")
+
+    for item in data.prompts:
+        _check_attachments(item)
+
+    client_key = data.session_id or f"ip:{request.client.host}"
+    session_id = data.session_id or f"batch_{uuid.uuid4().hex}"
+
+    # Planificación + deduplicación de planes idénticos
+    groups: dict = {}
+    for index, item in enumerate(data.prompts):
+        plan = agent.analyze_prompt(item.prompt, images=item.images or None, docs=item.docs or None)
+        # El prompt normalizado entra en la clave: las ramas tienda/portfolio de analyze_prompt no
+        # lo guardan en el plan y dos peticiones distintas acabarían con el mismo HTML
+        prompt = " ".join(item.prompt.split()).casefold()
+        key = json.dumps({"plan": plan.model_dump(), "prompt": prompt}, sort_keys=True)
+        groups.setdefault(key, {"plan": plan, "indexes": []})["indexes"].append(index)
+
+    # Un token de la sesión por plan único (los duplicados no generan), cobrado antes de empezar;
+    # sus elementos van después con prioridad baja y sin volver a pasar por la cuota
+    if scheduler.rate > 0 and len(groups) > scheduler.burst:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El batch tiene {len(groups)} planes distintos; la cuota de la sesión admite {int(scheduler.burst)}",
+        )
+    try:
+        await scheduler.check_rate(client_key, cost=len(groups))
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(max(1, int(e.retry_after)))})
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    logger.info(f"Batch de {len(data.prompts)} prompts → {len(groups)} planes únicos (sesión {session_id})")
+    metrics.incr("batch.items", len(data.prompts))
+    metrics.incr("batch.deduplicated", len(data.prompts) - len(groups))
+
+    async def generate_group(group: dict):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await agent.generate_plan(
+                    group["plan"], session_id=client_key, priority=PRIORITY_BATCH, rate_limited=False
+                )
+                return group, result, None, time.perf_counter() - start
+            except Exception as e:
+                logger.error(f"Error generando elemento del batch: {e}", exc_info=True)
+                return group, None, e, time.perf_counter() - start
+
+    async def stream():
+        tasks = [asyncio.create_task(generate_group(g)) for g in groups.values()]
+        db = SessionLocal()
+        pending_rows = []
+        user = None
+
+        def flush():
+            nonlocal user
+            if not pending_rows:
+                return
+            try:
+                if user is None:
+                    user = repository.get_or_create_user(db, session_id)
+                repository.save_generated_pages_bulk(db, user.id, pending_rows, revision=data.session_id is not None)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error guardando páginas del batch en BD: {e}")
+            pending_rows.clear()
+
+        try:
+            for finished in asyncio.as_completed(tasks):
+                group, result, error, seconds = await finished
+                plan = group["plan"]
+                for n, index in enumerate(group["indexes"]):
+                    prompt = data.prompts[index].prompt
+                    if error is not None:
+                        metrics.incr("batch.errors")
+                        yield _ndjson({"index": index, "status": "error", "error": str(error)})
+                        continue
+                    try:
+                        meta = await executors.run_in_thread(
+                            file_storage.save_page,
+                            html=result.html, prompt=prompt, site_type=plan.site_type, session_id=session_id,
+                        )
+                    except Exception as e:
+                        yield _ndjson({"index": index, "status": "error", "error": f"Error guardando: {e}"})
+                        continue
+                    pending_rows.append({"prompt": prompt, "site_type": plan.site_type, "html": result.html})
+                    yield _ndjson({
+                        "index": index,
+                        "status": "ok",
+                        "page_id": meta["page_id"],
+                        "html_file": meta["html_file"],
+                        "json_file": meta["json_file"],
+                        "site_type": plan.site_type,
+                        "deduplicated": n > 0,
+                        "seconds": round(seconds, 3),
+                        "html": result.html,
+                        "framework": result.framework,
+                    })
+                if len(pending_rows) >= BATCH_DB_FLUSH_EVERY:
+                    await executors.run_in_thread(flush)
+            await executors.run_in_thread(flush)
+        finally:
+            # Cliente desconectado o error: no seguimos gastando generaciones
+            for task in tasks:
+                task.cancel()
+            db.close()
 
-    return result
\ No newline at end of file
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from sqlalchemy.orm import Session
+from app.db.database import get_db
+from app.db import repository
+from app.services import revisions, metrics
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/sessions", tags=["revisions"])
+
+
+def _revision_html(db: Session, session_id: str, revision: int) -> str:
+    with metrics.timer("revisions.reconstruct_s"):
+        html = repository.get_revision_html(db, session_id, revision)
+    if html is None:
+        raise HTTPException(status_code=404, detail=f"Revisión {revision} no encontrada")
+    return html
+
+
+@router.get("/{session_id}/revisions")
+async def list_revisions(session_id: str, db: Session = Depends(get_db)):
+    """Historial de páginas de la sesión (sin contenido)."""
+    rows = repository.list_revisions(db, session_id)
+    return {
+        "session_id": session_id,
+        "total": len(rows),
+        "revisions": [
+            {
+                "revision": row.revision,
+                "page_id": str(row.generated_page_id) if row.generated_page_id else None,
+                "kind": row.kind,
+                "base_revision": row.base_revision,
+                "sha256": row.html_sha256,
+                "size": row.size,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+            }
+            for row in rows
+        ],
+    }
+
+
+@router.get("/{session_id}/revisions/{revision}", response_class=HTMLResponse)
+async def get_revision(session_id: str, revision: int, db: Session = Depends(get_db)):
+    """HTML de una revisión, reconstruido desde su snapshot base."""
+    return HTMLResponse(_revision_html(db, session_id, revision))
+
+
+@router.get("/{session_id}/revisions/{a}/diff/{b}", response_class=PlainTextResponse)
+async def diff_revisions(session_id: str, a: int, b: int, db: Session = Depends(get_db)):
+    """Diff unificado entre dos revisiones de la sesión."""
+    old, new = _revision_html(db, session_id, a), _revision_html(db, session_id, b)
+    return PlainTextResponse(revisions.unified_diff(old, new, f"revision-{a}", f"revision-{b}"))
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from app.db.database import get_db
+from app.db import repository
+from app.services import search, metrics
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+# Rutas síncronas: FastAPI las ejecuta en su pool de hilos (consultas bloqueantes a la BD / SQLite)
+@router.get("/pages")
+def search_db_pages(
+    q: str = Query(..., min_length=1),
+    session_id: str = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    """Búsqueda ordenada por relevancia en las páginas guardadas en BD (generated_pages)."""
+    with metrics.timer("search.db_s"):
+        total, rows = repository.search_pages(db, q, limit=limit, offset=offset, session_id=session_id)
+    return {
+        "query": q,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "results": [
+            {
+                "id": str(page.id),
+                "prompt": page.prompt,
+                "site_type": page.site_type,
+                "created_at": page.created_at.isoformat() if page.created_at else None,
+                "score": rank,
+            }
+            for page, rank in rows
+        ],
+    }
+
+
+@router.get("/files")
+def search_file_pages(
+    q: str = Query(..., min_length=1),
+    session_id: str = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """Búsqueda ordenada por relevancia en las páginas guardadas en disco (uploads/)."""
+    with metrics.timer("search.files_s"):
+        found = search.search_files(q, session_id=session_id, limit=limit, offset=offset)
+    return {"query": q, "limit": limit, "offset": offset, **found}
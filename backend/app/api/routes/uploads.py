@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Request, HTTPException
+from app.services import storage, executors
+
+router = APIRouter()
+
+
+@router.get("/uploads/{key:path}", include_in_schema=False)
+async def get_upload(key: str, request: Request):
+    """Sirve un fichero del almacenamiento (local: el propio fichero; S3: redirección a URL firmada)."""
+    try:
+        response = await executors.run_in_thread(storage.backend().response, key, request)
+    except storage.InvalidKey:
+        raise HTTPException(status_code=404)
+    if response is None:
+        raise HTTPException(status_code=404)
+    return response
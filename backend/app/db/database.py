@@ -1,9 +1,14 @@
 import os
+import time
+import asyncio
 import logging
-from sqlalchemy import create_engine, text
+import threading
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
+from app.services import metrics
 
 # Carga las variables de entorno desde .env
 load_dotenv()
@@ -17,6 +22,20 @@ db_name = os.getenv("DATABASE_NAME", "boilerplate_db")
 db_search_path = os.getenv("DATABASE_SEARCH_PATH", "public")
 db_pool_size = int(os.getenv("DATABASE_POOL_SIZE", 5))
 db_pool_size_overflow = int(os.getenv("DATABASE_POOL_SIZE_OVERFLOW", 10))
+db_pool_timeout = float(os.getenv("DATABASE_POOL_TIMEOUT_S", 30))
+# Detrás de PgBouncer en modo transaction: sin parámetros de arranque (search_path con
+# SET LOCAL en cada transacción) y comprobación de salud en segundo plano por defecto
+db_pgbouncer = os.getenv("DATABASE_PGBOUNCER", "false").lower() == "true"
+# Comprobación de las conexiones del pool:
+#   pre_ping   → SELECT 1 en cada checkout (un viaje extra a la BD por checkout)
+#   background → SELECT 1 periódico (DATABASE_HEALTH_CHECK_S); si falla se descarta el pool
+#   off        → ninguna (las desconexiones se detectan al fallar la consulta)
+db_health_check = os.getenv("DATABASE_HEALTH_CHECK", "background" if db_pgbouncer else "pre_ping")
+db_health_check_s = float(os.getenv("DATABASE_HEALTH_CHECK_S", 30))
+# Sin pre_ping conviene reciclar las conexiones antes de que el servidor cierre las ociosas
+db_pool_recycle = int(os.getenv("DATABASE_POOL_RECYCLE_S", -1 if db_health_check == "pre_ping" else 1800))
+# Esquema particionado por meses en created_at para chat_messages y generated_pages (solo PostgreSQL)
+db_partitioned = os.getenv("DATABASE_PARTITIONED", "false").lower() == "true"
 
 # Logging básico
 logging.basicConfig(level=logging.INFO)
@@ -30,20 +49,111 @@ if not DATABASE_URL:
         f"@{db_host}:{db_port}/{db_name}"
     )
 
-# Configuración de engine con pool y search_path
-connect_args = {"options": f"-c search_path={db_search_path}"}
+# Réplica de solo lectura opcional (p. ej. postgresql+psycopg2://...@replica:5432/app_db)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=db_pool_size,
-    max_overflow=db_pool_size_overflow,
-    echo=False,
-    connect_args=connect_args
-)
+
+_checkout_state = threading.local()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide la espera por una conexión libre (o por abrir una nueva)."""
+
+    label = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.incr(f"db.{self.label}.pool_timeouts")
+            raise
+        finally:
+            _checkout_state.got_at = time.perf_counter()
+            metrics.observe(f"db.{self.label}.checkout_wait_s", _checkout_state.got_at - start)
+
+    def recreate(self):
+        # dispose() crea un pool nuevo: conserva la etiqueta de las métricas
+        pool = super().recreate()
+        pool.label = self.label
+        return pool
+
+
+def _instrument(eng, label: str, pre_ping: bool):
+    """Métricas db.<label>.*: checkouts, pre-ping, conexiones abiertas/cerradas e invalidaciones."""
+    eng.pool.label = label
+    metrics.register_buckets(f"db.{label}.checkout_wait_s", (0.001, 0.01, 0.1, 1, 5))
+
+    @event.listens_for(eng, "checkout")
+    def on_checkout(dbapi_conn, record, proxy):
+        metrics.incr(f"db.{label}.checkouts")
+        got_at = getattr(_checkout_state, "got_at", None)
+        if got_at is not None and pre_ping:
+            # Entre _do_get y el evento checkout solo está el pre-ping
+            metrics.observe(f"db.{label}.pre_ping_s", time.perf_counter() - got_at)
+        _checkout_state.got_at = None
+
+    @event.listens_for(eng, "connect")
+    def on_connect(dbapi_conn, record):
+        metrics.incr(f"db.{label}.connects")
+
+    @event.listens_for(eng, "close")
+    def on_close(dbapi_conn, record):
+        metrics.incr(f"db.{label}.closes")
+
+    @event.listens_for(eng, "invalidate")
+    def on_invalidate(dbapi_conn, record, exception):
+        metrics.incr(f"db.{label}.invalidations")
+
+    @event.listens_for(eng, "soft_invalidate")
+    def on_soft_invalidate(dbapi_conn, record, exception):
+        metrics.incr(f"db.{label}.soft_invalidations")
+
+
+def _make_engine(url: str, label: str = "primary", health_check: str = None, pool_size: int = None,
+                 max_overflow: int = None):
+    """Engine con pool instrumentado y search_path (el search_path solo aplica a PostgreSQL)."""
+    health_check = health_check or db_health_check
+    connect_args = {}
+    if url.startswith("postgresql") and not db_pgbouncer:
+        connect_args = {"options": f"-c search_path={db_search_path}"}
+    eng = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_pre_ping=health_check == "pre_ping",
+        pool_size=db_pool_size if pool_size is None else pool_size,
+        max_overflow=db_pool_size_overflow if max_overflow is None else max_overflow,
+        pool_timeout=db_pool_timeout,
+        pool_recycle=db_pool_recycle,
+        echo=False,
+        connect_args=connect_args
+    )
+    _instrument(eng, label, pre_ping=health_check == "pre_ping")
+    if url.startswith("postgresql") and db_pgbouncer and db_search_path != "public":
+        # PgBouncer (transaction) rechaza "options" al conectar y no conserva los SET de sesión
+        set_search_path_sql = _set_search_path_sql(eng.dialect, db_search_path)
+
+        @event.listens_for(eng, "begin")
+        def set_search_path(conn):
+            conn.exec_driver_sql(set_search_path_sql)
+    return eng
+
+
+def _set_search_path_sql(dialect, search_path: str) -> str:
+    """SET LOCAL search_path con cada esquema de la lista citado por el preparer del dialecto."""
+    preparer = dialect.identifier_preparer
+    schemas = ", ".join(preparer.quote(schema.strip()) for schema in search_path.split(",") if schema.strip())
+    return f"SET LOCAL search_path TO {schemas}"
+
+
+engine = _make_engine(DATABASE_URL)
+replica_engine = _make_engine(DATABASE_REPLICA_URL, label="replica") if DATABASE_REPLICA_URL else None
 
 # Session maker y Base declarativa
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReplicaSessionLocal = (
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else None
+)
 Base = declarative_base()
 
 # Función para obtener sesión de DB en endpoints
@@ -54,6 +164,95 @@ def get_db():
     finally:
         db.close()
 
+# Estado de los pools de conexiones de cada engine
+def pool_stats() -> dict:
+    engines = {"primary": engine}
+    if replica_engine is not None:
+        engines["replica"] = replica_engine
+    stats = {}
+    for name, eng in engines.items():
+        pool = eng.pool
+        stats[name] = {
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "health_check": db_health_check,
+            "checkout_wait_p95_s": metrics.percentile(f"db.{name}.checkout_wait_s", 95),
+            "pre_ping_p95_s": metrics.percentile(f"db.{name}.pre_ping_s", 95),
+        }
+        if stats[name]["checked_out"] is not None:
+            metrics.set_gauge(f"db.{name}.in_use", stats[name]["checked_out"])
+            metrics.set_gauge(f"db.{name}.overflow", max(0, stats[name]["overflow"] or 0))
+    return stats
+
+
+def _ping_idle(eng) -> tuple:
+    """
+    SELECT 1 en cada conexión ociosa del pool: las saca todas a la vez para no comprobar
+    dos veces la misma, e invalida las que fallan. Devuelve (comprobadas, fallidas).
+    Con el pool vacío comprueba una (nueva) para saber si la BD responde.
+    """
+    conns, failed = [], 0
+    try:
+        for _ in range(max(1, eng.pool.checkedin())):
+            try:
+                conn = eng.connect()
+            except Exception:
+                return len(conns) + 1, failed + 1   # no se puede ni conectar
+            conns.append(conn)
+            try:
+                conn.execute(text("SELECT 1"))
+            except Exception as e:
+                failed += 1
+                logger.info(f"Conexión del pool descartada por el health check: {e}")
+                conn.invalidate()
+    finally:
+        for conn in conns:
+            conn.close()
+    return len(conns), failed
+
+
+def check_pool_health(engines: dict = None) -> dict:
+    """
+    SELECT 1 en cada conexión ociosa de cada pool; las que fallan se invalidan. Si fallan
+    todas (BD reiniciada, red caída), se descarta el pool entero (dispose) para que los
+    siguientes checkouts abran conexiones nuevas.
+    `engines`: {etiqueta: engine}; por defecto el primario y la réplica.
+    """
+    if engines is None:
+        engines = {"primary": engine}
+        if replica_engine is not None:
+            engines["replica"] = replica_engine
+    result = {}
+    for name, eng in engines.items():
+        start = time.perf_counter()
+        checked, failed = _ping_idle(eng)
+        result[name] = failed == 0
+        metrics.incr(f"db.{name}.health_check_connections", checked)
+        if failed:
+            metrics.incr(f"db.{name}.health_check_failures", failed)
+        if failed and failed == checked:
+            logger.warning(f"Health check del pool {name} fallido, se descartan sus conexiones")
+            eng.dispose()
+        elif failed:
+            logger.warning(f"Health check del pool {name}: {failed} de {checked} conexiones descartadas")
+        metrics.observe(f"db.{name}.health_check_s", time.perf_counter() - start)
+        metrics.set_gauge(f"db.{name}.healthy", 1 if result[name] else 0)
+    return result
+
+
+async def pool_health_loop():
+    """Comprobación periódica de los pools (DATABASE_HEALTH_CHECK=background)."""
+    from app.services import executors
+
+    while True:
+        await asyncio.sleep(db_health_check_s)
+        try:
+            await executors.run_in_thread(check_pool_health)
+        except Exception as e:
+            logger.error(f"Error en el health check de la BD: {e}")
+
 # Función para probar la conexión a la base de datos
 def test_connection():
     try:
@@ -0,0 +1,20 @@
+"""
+Identificadores ordenados por tiempo (estilo UUIDv7, RFC 9562).
+
+Los 48 bits altos son milisegundos desde epoch, así que los IDs nuevos caen al final
+del índice de la clave primaria en vez de repartirse al azar como con uuid4.
+"""
+import os
+import time
+import uuid
+
+
+def uuid7() -> uuid.UUID:
+    unix_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (unix_ms & ((1 << 48) - 1)) << 80      # unix_ts_ms
+    value |= 0x7 << 76                              # versión 7
+    value |= ((rand >> 62) & 0xFFF) << 64           # rand_a (12 bits)
+    value |= 0b10 << 62                             # variante RFC
+    value |= rand & ((1 << 62) - 1)                 # rand_b (62 bits)
+    return uuid.UUID(int=value)
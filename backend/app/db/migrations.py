@@ -0,0 +1,138 @@
+"""
+Migraciones ligeras e idempotentes para bases de datos ya existentes
+(create_all no añade columnas a tablas que ya existen).
+
+La columna search_vector de generated_pages no se añade al arrancar si la tabla tiene
+datos: ADD COLUMN ... GENERATED STORED reescribe la tabla entera bajo ACCESS EXCLUSIVE.
+Es un paso explícito que no bloquea la tabla más que un instante:
+
+    python -m app.db.migrations search-vector
+
+1. ADD COLUMN search_vector tsvector (sin DEFAULT: solo toca el catálogo) y un trigger
+   que la calcula en cada INSERT/UPDATE
+2. Relleno de las filas existentes por lotes, cada uno en su transacción
+3. Índice GIN con CREATE INDEX CONCURRENTLY (en tablas particionadas no existe: normal)
+"""
+import os
+import sys
+import json
+import time
+import logging
+from sqlalchemy import text
+from app.db.models import SEARCH_VECTOR_SQL, search_vector_sql
+
+logger = logging.getLogger(__name__)
+
+SEARCH_VECTOR_BATCH = int(os.getenv("SEARCH_VECTOR_BATCH", 2000))
+SEARCH_VECTOR_PAUSE_S = float(os.getenv("SEARCH_VECTOR_PAUSE_S", 0.05))
+
+
+def search_vector_state(conn) -> str | None:
+    """None si no existe la columna; "generated" (versiones anteriores) o "trigger"."""
+    row = conn.execute(text(
+        "SELECT is_generated FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'generated_pages' "
+        "AND column_name = 'search_vector'"
+    )).first()
+    if row is None:
+        return None
+    return "generated" if row[0] == "ALWAYS" else "trigger"
+
+
+def add_search_vector_column(conn):
+    """
+    Columna search_vector + trigger que la mantiene (dentro de la transacción de `conn`).
+    Las filas que ya existían quedan a NULL hasta backfill_search_vector.
+    """
+    if search_vector_state(conn) == "generated":
+        return  # columna generada de versiones anteriores: ya se mantiene sola
+    conn.execute(text("ALTER TABLE generated_pages ADD COLUMN IF NOT EXISTS search_vector tsvector"))
+    conn.execute(text(
+        "CREATE OR REPLACE FUNCTION generated_pages_search_vector() RETURNS trigger AS $$ "
+        f"BEGIN NEW.search_vector := {search_vector_sql('NEW.')}; RETURN NEW; END "
+        "$$ LANGUAGE plpgsql"
+    ))
+    conn.execute(text("DROP TRIGGER IF EXISTS generated_pages_search_vector ON generated_pages"))
+    conn.execute(text(
+        "CREATE TRIGGER generated_pages_search_vector "
+        "BEFORE INSERT OR UPDATE OF prompt, site_type, html ON generated_pages "
+        "FOR EACH ROW EXECUTE FUNCTION generated_pages_search_vector()"
+    ))
+
+
+def backfill_search_vector(engine, batch: int = SEARCH_VECTOR_BATCH, pause_s: float = SEARCH_VECTOR_PAUSE_S) -> int:
+    """Calcula search_vector de las filas que no lo tienen, por lotes. Devuelve cuántas."""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            n = conn.execute(text(
+                f"UPDATE generated_pages SET search_vector = {SEARCH_VECTOR_SQL} WHERE id IN ("
+                "SELECT id FROM generated_pages WHERE search_vector IS NULL LIMIT :n FOR UPDATE SKIP LOCKED)"
+            ), {"n": batch}).rowcount
+        total += n
+        if n < batch:
+            return total
+        logger.info(f"search_vector: {total} filas rellenadas")
+        time.sleep(pause_s)
+
+
+def create_search_index(engine):
+    """Índice GIN sobre search_vector, sin bloquear escrituras si la tabla no está particionada."""
+    from app.db.partitioning import is_partitioned
+
+    with engine.connect() as conn:
+        partitioned = is_partitioned(conn, "generated_pages")
+    concurrently = "" if partitioned else "CONCURRENTLY "
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(
+            f"CREATE INDEX {concurrently}IF NOT EXISTS ix_generated_pages_search_vector "
+            "ON generated_pages USING gin (search_vector)"
+        ))
+
+
+def migrate_search_vector(engine) -> dict:
+    """Los tres pasos de la migración (idempotente)."""
+    if engine.dialect.name != "postgresql":
+        return {"status": "skipped"}
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        add_search_vector_column(conn)
+    rows = backfill_search_vector(engine)
+    create_search_index(engine)
+    report = {"status": "migrated", "backfilled": rows, "seconds": time.perf_counter() - start}
+    logger.info(f"Columna search_vector e índice GIN listos ({rows} filas rellenadas)")
+    return report
+
+
+def check_search_vector(engine) -> bool:
+    """
+    Comprobación del arranque. Si falta la columna y generated_pages está vacía, la
+    migración es instantánea y se hace aquí; con datos solo se avisa. True si existe.
+    """
+    from app.services import metrics
+
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as conn:
+        state = search_vector_state(conn)
+        empty = state is None and conn.execute(text("SELECT 1 FROM generated_pages LIMIT 1")).first() is None
+    if state is None and empty:
+        migrate_search_vector(engine)
+        state = "trigger"
+    metrics.set_gauge("search.vector_missing", 0 if state else 1)
+    if state is None:
+        logger.warning(
+            "generated_pages no tiene search_vector: /search/pages fallará hasta ejecutar "
+            "`python -m app.db.migrations search-vector`"
+        )
+    return state is not None
+
+
+if __name__ == "__main__":
+    from app.db.database import engine
+
+    if len(sys.argv) < 2 or sys.argv[1] != "search-vector":
+        print("Uso: python -m app.db.migrations search-vector")
+        sys.exit(1)
+    print(json.dumps(migrate_search_vector(engine), indent=2))
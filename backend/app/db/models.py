@@ -1,9 +1,36 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
-from app.db.database import Base
+from app.db.database import Base, db_partitioned
+from app.db.ids import uuid7
+
+# tsvector de búsqueda: prompt (peso A), site_type (B) y texto del HTML sin etiquetas (C).
+# Solo existe en PostgreSQL: la añade `python -m app.db.migrations search-vector` (columna
+# mantenida por un trigger), por eso no está declarada en el modelo (las tablas siguen
+# funcionando en SQLite).
+def search_vector_sql(row: str = "") -> str:
+    """Expresión del tsvector; `row` = "NEW." dentro del trigger."""
+    return (
+        f"setweight(to_tsvector('simple', coalesce({row}prompt, '')), 'A') || "
+        f"setweight(to_tsvector('simple', coalesce({row}site_type, '')), 'B') || "
+        f"setweight(to_tsvector('simple', left(regexp_replace({row}html, '<[^>]*>', ' ', 'g'), 100000)), 'C')"
+    )
+
+
+SEARCH_VECTOR_SQL = search_vector_sql()
+
+# Con DATABASE_PARTITIONED=true, chat_messages y generated_pages se particionan por rango
+# mensual de created_at (ver partitioning.py). PostgreSQL exige que la clave primaria
+# incluya la columna de partición, así que pasa a ser (id, created_at).
+_PARTITION_ARGS = {"postgresql_partition_by": "RANGE (created_at)"} if db_partitioned else {}
+
+
+def _created_at_column():
+    if db_partitioned:
+        return Column(DateTime, primary_key=True, nullable=False, default=datetime.utcnow)
+    return Column(DateTime, default=datetime.utcnow)
 
 
 class User(Base):
@@ -15,28 +42,54 @@ class User(Base):
 
     messages = relationship("ChatMessage", back_populates="user", cascade="all, delete-orphan")
     pages = relationship("GeneratedPage", back_populates="user", cascade="all, delete-orphan")
+    revisions = relationship("PageRevision", back_populates="user", cascade="all, delete-orphan")
 
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = _PARTITION_ARGS
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     role = Column(String(10), nullable=False)   # "user" | "agent"
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = _created_at_column()
 
     user = relationship("User", back_populates="messages")
 
 
 class GeneratedPage(Base):
     __tablename__ = "generated_pages"
+    __table_args__ = _PARTITION_ARGS
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     prompt = Column(Text, nullable=False)
     site_type = Column(String(50), nullable=True)
     html = Column(Text, nullable=False)
+    created_at = _created_at_column()
+
+    user = relationship("User", back_populates="pages")
+
+
+class PageRevision(Base):
+    """
+    Historial de páginas de una sesión: revisión 1, 2, ... guardada como snapshot (HTML
+    completo) o como delta respecto a la anterior (ver services/revisions.py).
+    generated_page_id no es FK porque generated_pages puede estar particionada (PK compuesta).
+    """
+    __tablename__ = "page_revisions"
+    __table_args__ = (UniqueConstraint("user_id", "revision", name="uq_page_revisions_user_revision"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
+    revision = Column(Integer, nullable=False)
+    generated_page_id = Column(UUID(as_uuid=True), nullable=True)
+    kind = Column(String(10), nullable=False)      # "snapshot" | "delta"
+    base_revision = Column(Integer, nullable=False)   # snapshot desde el que se reconstruye
+    content = Column(Text, nullable=False)
+    html_sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)            # bytes del HTML reconstruido
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    user = relationship("User", back_populates="pages")
\ No newline at end of file
+    user = relationship("User", back_populates="revisions")
@@ -0,0 +1,376 @@
+"""
+Particionado mensual por created_at de chat_messages y generated_pages (solo PostgreSQL).
+
+- ensure_partitions(): crea las particiones del mes actual y de los PARTITION_MONTHS_AHEAD
+  siguientes (idempotente; se llama al arrancar y en partition_maintenance_loop), más una
+  partición DEFAULT ({tabla}_pdefault) para que un INSERT fuera de rango (reloj desviado,
+  mantenimiento parado) no falle. Si la DEFAULT tiene filas de un mes que se crea después,
+  se mueven a la partición nueva.
+- drop_partitions_before(): la retención suelta meses completos con DETACH, archivo y DROP
+  (cada paso en su transacción) en vez de borrar fila a fila
+- migrate_to_partitioned(): pasa unas tablas existentes (creadas desde models.py sin
+  particionar) al esquema particionado copiando los datos mes a mes
+
+Uso:
+    python -m app.db.partitioning migrate [--drop-legacy]
+    python -m app.db.partitioning ensure
+    python -m app.db.partitioning bench [--rows N]   (sobre las tablas particionadas reales, con ROLLBACK)
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import text
+from app.db.ids import uuid7
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("chat_messages", "generated_pages")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+PARTITION_MAINTENANCE_HOURS = float(os.getenv("PARTITION_MAINTENANCE_HOURS", 24))
+
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    index = dt.year * 12 + dt.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :t AND pg_table_is_visible(c.oid)"
+    ), {"t": table}).scalar())
+
+
+def list_partitions(conn, table: str) -> list:
+    """[(nombre, inicio del mes)] de las particiones de `table`, ordenadas."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :t AND pg_table_is_visible(p.oid)"
+    ), {"t": table}).scalars().all()
+    prefix = f"{table}_p"
+    partitions = []
+    for name in rows:
+        suffix = name[len(prefix):] if name.startswith(prefix) else ""
+        if len(suffix) == 6 and suffix.isdigit():
+            partitions.append((name, datetime(int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_pdefault"
+
+
+def _ensure_default_partition(conn, table: str):
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {default_partition_name(table)} PARTITION OF {table} DEFAULT"))
+
+
+def _create_partition(conn, table: str, month: datetime):
+    """
+    Crea la partición de `month` si no existe. Si la DEFAULT ya tiene filas de ese mes,
+    PostgreSQL no deja crearla: se suelta la DEFAULT, se crea la partición, se mueven las
+    filas y se vuelve a enganchar (todo en la transacción de `conn`).
+    """
+    name = partition_name(table, month)
+    if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar() is not None:
+        return
+    start, end = f"{month:%Y-%m-%d}", f"{_add_months(month, 1):%Y-%m-%d}"
+    default = default_partition_name(table)
+    in_range = f"created_at >= '{start}' AND created_at < '{end}'"
+    has_default = conn.execute(text("SELECT to_regclass(:n)"), {"n": default}).scalar() is not None
+    stray = has_default and conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})")).scalar()
+    if stray:
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    if stray:
+        moved = conn.execute(text(f"INSERT INTO {name} SELECT * FROM {default} WHERE {in_range}")).rowcount
+        conn.execute(text(f"DELETE FROM {default} WHERE {in_range}"))
+        conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+        logger.warning(f"{moved} filas de {table} movidas de la partición DEFAULT a {name}")
+
+
+def ensure_partitions(engine, months_ahead: int = PARTITION_MONTHS_AHEAD, since: datetime | None = None) -> int:
+    """
+    Crea las particiones mensuales que falten desde `since` (por defecto, el mes actual)
+    hasta months_ahead meses en el futuro. Devuelve cuántas se han comprobado.
+    """
+    if engine.dialect.name != "postgresql":
+        return 0
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    first = _month_start(since or now)
+    last = _add_months(_month_start(now), months_ahead)
+    checked = 0
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table):
+                logger.warning(
+                    f"{table} no está particionada: ejecuta `python -m app.db.partitioning migrate`"
+                )
+                continue
+            _ensure_default_partition(conn, table)
+            month = first
+            while month <= last:
+                _create_partition(conn, table, month)
+                month = _add_months(month, 1)
+                checked += 1
+            # Filas que no caen en ningún mes creado: hay que revisarlas (o ampliar `since`)
+            stray = conn.execute(text(f"SELECT count(*) FROM {default_partition_name(table)}")).scalar()
+            metrics.set_gauge(f"db.partitions.default_rows.{table}", stray)
+            if stray:
+                logger.warning(f"{table}: {stray} filas en la partición DEFAULT")
+    logger.info(f"Particiones mensuales verificadas hasta {last:%Y-%m}")
+    return checked
+
+
+def count_expired_partitions(engine, table: str, cutoff: datetime) -> int:
+    """Nº de filas en particiones cuyo mes completo es anterior a `cutoff`."""
+    with engine.connect() as conn:
+        total = 0
+        for name, month in list_partitions(conn, table):
+            if _add_months(month, 1) <= cutoff:
+                total += conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+        return total
+
+
+def _detached_partitions(conn, table: str) -> list:
+    """
+    [(nombre, mes)] de tablas {table}_pAAAAMM que ya no están enganchadas a `table`: las
+    deja drop_partitions_before si el proceso se corta entre el DETACH y el DROP.
+    """
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_class c WHERE c.relname LIKE :p AND c.relkind = 'r' "
+        "AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid) AND pg_table_is_visible(c.oid)"
+    ), {"p": f"{table}\\_p%"}).scalars().all()
+    prefix = f"{table}_p"
+    found = []
+    for name in names:
+        suffix = name[len(prefix):]
+        if len(suffix) == 6 and suffix.isdigit():
+            found.append((name, datetime(int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(found, key=lambda p: p[1])
+
+
+def drop_partitions_before(engine, table: str, cutoff: datetime, archive=None) -> dict:
+    """
+    Elimina las particiones de `table` que quedan enteras antes de `cutoff`.
+    Las filas del mes de corte las sigue borrando la retención por lotes.
+    `archive(filas)`: recibe las filas de cada partición (por lotes) antes del DROP.
+
+    Por partición, tres pasos para no retener el lock de la tabla padre mientras se archiva:
+    1. DETACH en su propia transacción (ACCESS EXCLUSIVE sobre `table` solo durante el DETACH;
+       no se usa CONCURRENTLY porque no se admite con partición DEFAULT)
+    2. lectura y archivo de la tabla ya independiente, por otra conexión
+    3. DROP TABLE
+    Si el archivo falla, la partición se vuelve a enganchar y no se borra nada. Las tablas
+    que quedaron sueltas por un corte entre 1 y 3 se archivan y eliminan en la siguiente pasada.
+    """
+    dropped = {"partitions": 0, "rows": 0}
+    with engine.connect() as conn:
+        expired = [(name, month, True) for name, month in list_partitions(conn, table)
+                   if _add_months(month, 1) <= cutoff]
+        expired += [(name, month, False) for name, month in _detached_partitions(conn, table)
+                    if _add_months(month, 1) <= cutoff]
+    for name, month, attached in expired:
+        if attached:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        else:
+            logger.warning(f"{name} quedó fuera de {table} en una pasada anterior; se archiva y elimina")
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+                if archive is not None:
+                    result = conn.execution_options(stream_results=True).execute(text(f"SELECT * FROM {name}"))
+                    for chunk in result.mappings().partitions(1000):
+                        archive(chunk)
+        except Exception:
+            start, end = f"{month:%Y-%m-%d}", f"{_add_months(month, 1):%Y-%m-%d}"
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+                ))
+            logger.error(f"No se pudo archivar {name}; la partición se ha vuelto a enganchar")
+            raise
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {name}"))
+        dropped["partitions"] += 1
+        dropped["rows"] += rows
+        logger.info(f"Partición {name} eliminada ({rows} filas)")
+    return dropped
+
+
+def migrate_to_partitioned(engine, drop_legacy: bool = False) -> dict:
+    """
+    Convierte chat_messages y generated_pages (tablas normales creadas por create_all)
+    en tablas particionadas. Requiere DATABASE_PARTITIONED=true para que models.py
+    declare el esquema nuevo.
+
+    Por tabla, en una transacción: renombra la tabla a {tabla}_legacy, crea la
+    particionada, sus particiones desde el mes más antiguo, copia los datos mes a mes
+    y comprueba que el nº de filas coincide. La tabla legacy se conserva salvo drop_legacy.
+    """
+    from app.db import models, migrations
+
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("El particionado solo está soportado en PostgreSQL")
+    if not models.ChatMessage.__table__.dialect_options["postgresql"].get("partition_by"):
+        raise RuntimeError("Activa DATABASE_PARTITIONED=true antes de migrar")
+
+    report = {}
+    for table in PARTITIONED_TABLES:
+        legacy = f"{table}_legacy"
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            if is_partitioned(conn, table):
+                report[table] = {"status": "already_partitioned"}
+                continue
+
+            conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+            # Los nombres de constraints e índices son globales en el esquema: se liberan
+            conn.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey"))
+            conn.execute(text(f"ALTER INDEX IF EXISTS ix_{table}_search_vector RENAME TO ix_{legacy}_search_vector"))
+
+            models.Base.metadata.tables[table].create(conn)
+            if table == "generated_pages":
+                # Antes de copiar: el trigger calcula search_vector de cada fila copiada
+                migrations.add_search_vector_column(conn)
+            # created_at es parte de la clave primaria: las filas antiguas sin fecha toman la del
+            # usuario (o la actual) antes de copiar, para que --drop-legacy no se lleve ninguna
+            backfilled = conn.execute(text(
+                f"UPDATE {legacy} t SET created_at = COALESCE("
+                f"(SELECT u.created_at FROM users u WHERE u.id = t.user_id), now() AT TIME ZONE 'utc') "
+                f"WHERE t.created_at IS NULL"
+            )).rowcount
+            if backfilled:
+                logger.warning(f"{table}: {backfilled} filas sin created_at, se les asigna la fecha del usuario")
+
+            oldest = conn.execute(text(f"SELECT min(created_at) FROM {legacy}")).scalar()
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            month = _month_start(oldest or now)
+            last = _add_months(_month_start(now), PARTITION_MONTHS_AHEAD)
+            while month <= last:
+                _create_partition(conn, table, month)
+                month = _add_months(month, 1)
+            _ensure_default_partition(conn, table)
+
+            columns = ", ".join(c.name for c in models.Base.metadata.tables[table].columns)
+            copied = conn.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy}")).rowcount
+            expected = conn.execute(text(f"SELECT count(*) FROM {legacy}")).scalar()
+            if copied != expected:
+                raise RuntimeError(f"{table}: copiadas {copied} filas de {expected}, se deshace la migración")
+            if drop_legacy:
+                conn.execute(text(f"DROP TABLE {legacy}"))
+
+        report[table] = {
+            "status": "migrated", "rows": copied, "backfilled_created_at": backfilled,
+            "seconds": time.perf_counter() - start,
+        }
+        logger.info(f"{table} particionada: {copied} filas en {report[table]['seconds']:.1f}s")
+
+    migrations.create_search_index(engine)
+    return report
+
+
+async def partition_maintenance_loop():
+    """Crea periódicamente las particiones futuras (un worker por host en cada intervalo)."""
+    from app.db.database import engine
+    from app.services import shared_state
+
+    interval = PARTITION_MAINTENANCE_HOURS * 3600
+    while True:
+        try:
+            if shared_state.inflight_register("partition_maintenance", ttl=interval):
+                await asyncio.to_thread(ensure_partitions, engine)
+        except Exception as e:
+            logger.error(f"Error creando particiones: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+def _bench_inserts(engine, rows: int = 200_000, batch: int = 5_000) -> dict:
+    """
+    Inserciones por lotes en las tablas particionadas reales (generated_pages y
+    chat_messages, con sus índices, el trigger de search_vector y las FKs), con PK
+    uuid4 frente a uuid7. Cada pasada va en una transacción que se deshace al final:
+    no queda nada en la BD. Con uuid7 las inserciones van al final del índice de la
+    partición del mes y las páginas calientes caben en caché.
+    """
+    from app.db.models import GeneratedPage, ChatMessage
+
+    with engine.connect() as conn:
+        missing = [t for t in PARTITIONED_TABLES if not is_partitioned(conn, t)]
+    if missing:
+        raise RuntimeError(f"Tablas sin particionar ({', '.join(missing)}): ejecuta `partitioning migrate`")
+    ensure_partitions(engine)
+
+    tables = {
+        "generated_pages": (GeneratedPage.__table__, lambda gen, user_id, now: {
+            "id": gen(), "user_id": user_id, "prompt": "landing con hero y precios",
+            "site_type": "landing", "html": "<html>" + "x" * 2000 + "</html>", "created_at": now,
+        }),
+        "chat_messages": (ChatMessage.__table__, lambda gen, user_id, now: {
+            "id": gen(), "user_id": user_id, "role": "user", "content": "x" * 200, "created_at": now,
+        }),
+    }
+    results = {}
+    for table, (model_table, make_row) in tables.items():
+        results[table] = {}
+        for name, gen in (("uuid4", uuid.uuid4), ("uuid7", uuid7)):
+            conn = engine.connect()
+            tx = conn.begin()
+            try:
+                user_id = uuid.uuid4()
+                conn.execute(
+                    text("INSERT INTO users (id, session_id, created_at) VALUES (:id, :s, now())"),
+                    {"id": user_id, "s": f"bench_{user_id.hex}"},
+                )
+                pk_before = _pk_index_bytes(conn, table)
+                start = time.perf_counter()
+                for _ in range(0, rows, batch):
+                    now = datetime.now(timezone.utc).replace(tzinfo=None)
+                    conn.execute(model_table.insert(), [make_row(gen, user_id, now) for _ in range(batch)])
+                elapsed = time.perf_counter() - start
+                pk_growth = _pk_index_bytes(conn, table) - pk_before
+            finally:
+                tx.rollback()
+                conn.close()
+            results[table][name] = {
+                "rows": rows, "seconds": elapsed, "rows_per_s": rows / elapsed, "pk_index_growth_bytes": pk_growth,
+            }
+    return results
+
+
+def _pk_index_bytes(conn, table: str) -> int:
+    """Tamaño de los índices de clave primaria de todas las particiones de `table`."""
+    return conn.execute(text(
+        "SELECT COALESCE(sum(pg_relation_size(i.indexrelid)), 0) FROM pg_inherits inh "
+        "JOIN pg_index i ON i.indrelid = inh.inhrelid "
+        "WHERE inh.inhparent = CAST(:t AS regclass) AND i.indisprimary"
+    ), {"t": table}).scalar()
+
+
+if __name__ == "__main__":
+    from app.db.database import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "ensure"
+    if command == "migrate":
+        result = migrate_to_partitioned(engine, drop_legacy="--drop-legacy" in sys.argv)
+    elif command == "bench":
+        n = int(sys.argv[sys.argv.index("--rows") + 1]) if "--rows" in sys.argv else 200_000
+        result = _bench_inserts(engine, rows=n)
+    else:
+        result = {"partitions_checked": ensure_partitions(engine)}
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
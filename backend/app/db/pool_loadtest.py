@@ -0,0 +1,137 @@
+"""
+pool_loadtest.py
+Prueba de carga del pool de conexiones: N hilos concurrentes que hacen checkout, una
+consulta que retiene la conexión `hold_ms` milisegundos y checkin, para N creciente.
+
+Por cada nivel de concurrencia y modo de health check informa del throughput, la espera
+por conexión (p50/p95/max), el coste del pre-ping, conexiones abiertas (churn), máximo de
+conexiones en uso/overflow y timeouts del pool. Usa DATABASE_URL (o --url).
+
+En modo background un hilo llama a database.check_pool_health sobre el engine del nivel
+cada --health-check-s segundos (1 por defecto: un nivel dura pocos segundos y con los 30 s
+de DATABASE_HEALTH_CHECK_S no llegaría a ejecutarse ninguno), compitiendo por las
+conexiones como en producción; se informa de cuántos se ejecutaron y de su p95.
+
+    python -m app.db.pool_loadtest --concurrency 1,2,4,8,16,32 --queries 400 --hold-ms 5
+    python -m app.db.pool_loadtest --modes pre_ping,background --pool-size 5 --overflow 10 --health-check-s 1
+"""
+
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from app.db import database
+from app.services import metrics
+
+
+def _arg(name: str, default: str) -> str:
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+def _health_checks(eng, label: str, interval: float, stop: threading.Event):
+    """Equivalente en hilo de database.pool_health_loop para el engine del nivel."""
+    while not stop.wait(interval):
+        database.check_pool_health({label: eng})
+
+
+def _run_level(url: str, mode: str, concurrency: int, queries: int, hold_ms: float,
+               pool_size: int, overflow: int, health_check_s: float = 1.0) -> dict:
+    label = f"loadtest_{mode}_c{concurrency}"
+    eng = database._make_engine(url, label=label, health_check=mode, pool_size=pool_size, max_overflow=overflow)
+    if eng.dialect.name == "postgresql":
+        query, params, sleep_in_python = text("SELECT pg_sleep(:s)"), {"s": hold_ms / 1000}, False
+    else:
+        query, params, sleep_in_python = text("SELECT 1"), {}, True
+
+    peak = {"in_use": 0, "overflow": 0}
+    lock = threading.Lock()
+    errors = []
+
+    def one():
+        try:
+            with eng.connect() as conn:
+                with lock:
+                    peak["in_use"] = max(peak["in_use"], eng.pool.checkedout())
+                    peak["overflow"] = max(peak["overflow"], eng.pool.overflow())
+                conn.execute(query, params)
+                if sleep_in_python:
+                    time.sleep(hold_ms / 1000)
+        except Exception as e:
+            errors.append(type(e).__name__)
+
+    # Calentamiento: abre las conexiones base para no medir solo el coste de conectar
+    with eng.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    stop = threading.Event()
+    checker = None
+    if mode == "background":
+        checker = threading.Thread(target=_health_checks, args=(eng, label, health_check_s, stop), daemon=True)
+        checker.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(queries):
+            pool.submit(one)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if checker is not None:
+        checker.join()
+
+    counters = metrics.snapshot()["counters"]
+
+    def ms(name, q):
+        value = metrics.percentile(f"db.{label}.{name}", q)
+        return round(value * 1000, 3) if value is not None else None
+
+    result = {
+        "mode": mode,
+        "concurrency": concurrency,
+        "queries_per_s": round(queries / elapsed, 1),
+        "checkout_wait_ms": {"p50": ms("checkout_wait_s", 50), "p95": ms("checkout_wait_s", 95),
+                             "max": ms("checkout_wait_s", 100)},
+        "pre_ping_ms_p95": ms("pre_ping_s", 95),
+        "health_checks": metrics.snapshot()["distributions"].get(f"db.{label}.health_check_s", {}).get("count", 0),
+        "health_check_ms_p95": ms("health_check_s", 95),
+        "health_check_failures": counters.get(f"db.{label}.health_check_failures", 0),
+        "connects": counters.get(f"db.{label}.connects", 0),
+        "peak_in_use": peak["in_use"],
+        "peak_overflow": max(0, peak["overflow"]),
+        "pool_timeouts": counters.get(f"db.{label}.pool_timeouts", 0),
+        "errors": len(errors),
+    }
+    eng.dispose()
+    return result
+
+
+def run(url: str, levels: list, modes: list, queries: int, hold_ms: float, pool_size: int, overflow: int,
+        health_check_s: float = 1.0) -> list:
+    results = []
+    for mode in modes:
+        for concurrency in levels:
+            results.append(_run_level(url, mode, concurrency, queries, hold_ms, pool_size, overflow, health_check_s))
+    return results
+
+
+def suggest_pool_size(results: list, wait_ms: float = 1.0) -> int | None:
+    """Menor pico de conexiones en uso a partir del cual la espera p95 supera `wait_ms`."""
+    saturated = [r for r in results if (r["checkout_wait_ms"]["p95"] or 0) > wait_ms]
+    if not saturated:
+        return None
+    return min(r["peak_in_use"] for r in saturated)
+
+
+if __name__ == "__main__":
+    results = run(
+        url=_arg("--url", database.DATABASE_URL),
+        levels=[int(n) for n in _arg("--concurrency", "1,2,4,8,16,32").split(",")],
+        modes=_arg("--modes", "pre_ping,background").split(","),
+        queries=int(_arg("--queries", "400")),
+        hold_ms=float(_arg("--hold-ms", "5")),
+        pool_size=int(_arg("--pool-size", str(database.db_pool_size))),
+        overflow=int(_arg("--overflow", str(database.db_pool_size_overflow))),
+        health_check_s=float(_arg("--health-check-s", "1")),
+    )
+    print(json.dumps({"levels": results, "saturates_at_in_use": suggest_pool_size(results)}, indent=2))
@@ -1,18 +1,107 @@
+import os
+import time
 import logging
-from sqlalchemy.orm import Session
-from app.db.models import User, ChatMessage, GeneratedPage
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlalchemy import func, literal_column, and_, or_, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, load_only, aliased
+from app.db.models import User, ChatMessage, GeneratedPage, PageRevision
+from app.db import database
+from app.services import metrics, revisions
 
 logger = logging.getLogger(__name__)
 
+# Tras una escritura, las lecturas de esa sesión/usuario van al primario durante esta ventana
+# (read-your-writes mientras la réplica se pone al día)
+READ_YOUR_WRITES_S = float(os.getenv("DATABASE_READ_YOUR_WRITES_S", 5))
+REVISIONS_ENABLED = os.getenv("REVISIONS_ENABLED", "true").lower() == "true"
+
+
+# Pins en memoria del proceso: clave → instante en que caduca. Todos tienen el mismo TTL, así
+# que el orden de inserción (re-pin = mover al final) es el de caducidad y se expulsan por
+# el principio. Sin escrituras a SQLite en cada escritura de BD; el precio es que el pin solo
+# lo ve el worker que escribió (el WebSocket del chat y sus lecturas van al mismo proceso, y
+# un usuario que la réplica aún no tiene se busca en el primario igualmente).
+_pins: OrderedDict = OrderedDict()
+_pins_lock = threading.Lock()
+
+
+def _evict_pins(now: float):
+    """Quita los pins caducados del principio. Requiere _pins_lock."""
+    while _pins:
+        key, expires = next(iter(_pins.items()))
+        if expires > now:
+            break
+        del _pins[key]
+
+
+def _pin(key: str):
+    if database.ReplicaSessionLocal is None:
+        return
+    now = time.monotonic()
+    with _pins_lock:
+        _pins.pop(key, None)
+        _pins[key] = now + READ_YOUR_WRITES_S
+        _evict_pins(now)
+
+
+def _is_pinned(key: str) -> bool:
+    now = time.monotonic()
+    with _pins_lock:
+        _evict_pins(now)
+        return key in _pins
+
+
+@contextmanager
+def _read_session(db: Session, session_id: str = None):
+    """
+    Sesión para consultas de solo lectura: la réplica si está configurada y la sesión
+    no ha escrito recientemente; si no, la propia sesión `db` (primario).
+    """
+    if database.ReplicaSessionLocal is None or (session_id and _is_pinned(f"s:{session_id}")):
+        metrics.incr("db.reads.primary")
+        yield db
+        return
+    replica = database.ReplicaSessionLocal()
+    try:
+        metrics.incr("db.reads.replica")
+        yield replica
+    finally:
+        replica.close()
+
+
+def _user_for_read(db: Session, rdb: Session, session_id: str) -> tuple:
+    """
+    Busca el usuario en la sesión de lectura. Si la réplica aún no lo tiene o el usuario
+    ha escrito hace poco, vuelve al primario. Devuelve (usuario o None, sesión a usar).
+    """
+    user = rdb.query(User).filter(User.session_id == session_id).first()
+    if rdb is db:
+        return user, db
+    if user is None or _is_pinned(f"u:{user.id}"):
+        metrics.incr("db.reads.fallback_primary")
+        return db.query(User).filter(User.session_id == session_id).first(), db
+    return user, rdb
+
 
 def get_or_create_user(db: Session, session_id: str) -> User:
     """Obtiene un usuario por session_id o lo crea si no existe."""
-    user = db.query(User).filter(User.session_id == session_id).first()
+    user = None
+    with _read_session(db, session_id) as rdb:
+        found = rdb.query(User).filter(User.session_id == session_id).first()
+        if found is not None:
+            user = found if rdb is db else db.merge(found, load=False)
+        elif rdb is not db:
+            # Puede que la réplica aún no tenga el usuario: confirmamos en el primario
+            user = db.query(User).filter(User.session_id == session_id).first()
     if not user:
         user = User(session_id=session_id)
         db.add(user)
         db.commit()
         db.refresh(user)
+        _pin(f"s:{session_id}")
         logger.info(f"Usuario creado: {user.id} (session: {session_id})")
     return user
 
@@ -23,11 +112,17 @@ def save_message(db: Session, user_id, role: str, content: str) -> ChatMessage:
     db.add(message)
     db.commit()
     db.refresh(message)
+    _pin(f"u:{user_id}")
     return message
 
 
-def save_generated_page(db: Session, user_id, prompt: str, site_type: str, html: str) -> GeneratedPage:
-    """Guarda una página generada."""
+def save_generated_page(db: Session, user_id, prompt: str, site_type: str, html: str, revision: bool = True) -> GeneratedPage:
+    """
+    Guarda una página generada y, con `revision`, la añade al historial de la sesión.
+    Las sesiones de un solo uso (api_*, batch_* y upload_* sin session_id) pasan
+    revision=False: nadie va a pedir sus revisiones. Calcular el delta es CPU
+    (SequenceMatcher): desde código async, llamar con executors.run_in_thread.
+    """
     page = GeneratedPage(
         user_id=user_id,
         prompt=prompt,
@@ -37,25 +132,293 @@ def save_generated_page(db: Session, user_id, prompt: str, site_type: str, html:
     db.add(page)
     db.commit()
     db.refresh(page)
+    _pin(f"u:{user_id}")
     logger.info(f"Página guardada: {page.id} (tipo: {site_type})")
+    if REVISIONS_ENABLED and revision:
+        try:
+            save_page_revision(db, user_id, html, page.id)
+        except Exception as e:
+            # El historial no debe hacer fallar la generación
+            db.rollback()
+            logger.warning(f"No se pudo guardar la revisión de la página {page.id}: {e}")
     return page
 
 
-def get_chat_history(db: Session, session_id: str) -> list:
-    """Obtiene el historial de mensajes de un usuario."""
-    user = db.query(User).filter(User.session_id == session_id).first()
-    if not user:
+def _revision_chain(db: Session, user_id, revision: int = None) -> list:
+    """
+    Filas necesarias para reconstruir `revision` (la última si es None): desde su snapshot
+    base hasta ella, en una sola consulta. Lista vacía si no existe.
+    """
+    q = db.query(PageRevision.revision, PageRevision.base_revision).filter(PageRevision.user_id == user_id)
+    target = q.filter(PageRevision.revision == revision).first() if revision is not None \
+        else q.order_by(PageRevision.revision.desc()).first()
+    if target is None:
         return []
-    return db.query(ChatMessage).filter(
-        ChatMessage.user_id == user.id
-    ).order_by(ChatMessage.created_at.asc()).all()
+    return db.query(PageRevision).filter(
+        PageRevision.user_id == user_id,
+        PageRevision.revision.between(target.base_revision, target.revision),
+    ).order_by(PageRevision.revision.asc()).all()
+
+
+def _reconstruct(chain: list) -> str:
+    html = revisions.reconstruct([(row.kind, row.content) for row in chain])
+    if revisions.html_hash(html) != chain[-1].html_sha256:
+        raise ValueError(f"La revisión {chain[-1].revision} no coincide con su hash")
+    return html
+
+
+def save_page_revision(db: Session, user_id, html: str, page_id=None, attempts: int = 3) -> PageRevision:
+    """
+    Añade la siguiente revisión del historial del usuario: snapshot o delta respecto a la
+    anterior según revisions.encode. Si otra petición de la misma sesión toma el mismo
+    número de revisión a la vez, la restricción única lo detecta y se reintenta.
+    """
+    for attempt in range(attempts):
+        chain = _revision_chain(db, user_id)
+        previous = _reconstruct(chain) if chain else None
+        number = chain[-1].revision + 1 if chain else 1
+        last_snapshot = chain[0].base_revision if chain else None
+        kind, content = revisions.encode(previous, html, number, last_snapshot)
+        row = PageRevision(
+            user_id=user_id,
+            revision=number,
+            generated_page_id=page_id,
+            kind=kind,
+            base_revision=number if kind == revisions.KIND_SNAPSHOT else last_snapshot,
+            content=content,
+            html_sha256=revisions.html_hash(html),
+            size=len(html.encode("utf-8")),
+        )
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            metrics.incr("revisions.conflicts")
+            if attempt == attempts - 1:
+                raise
+            continue
+        metrics.incr(f"revisions.{kind}")
+        metrics.observe("revisions.stored_bytes", len(content.encode("utf-8")))
+        return row
+
+
+def list_revisions(db: Session, session_id: str) -> list:
+    """Revisiones de una sesión (sin contenido), de la más antigua a la más reciente."""
+    with _read_session(db, session_id) as rdb:
+        user, rdb = _user_for_read(db, rdb, session_id)
+        if not user:
+            return []
+        return rdb.query(PageRevision).options(load_only(
+            PageRevision.revision, PageRevision.generated_page_id, PageRevision.kind,
+            PageRevision.base_revision, PageRevision.html_sha256, PageRevision.size, PageRevision.created_at,
+        )).filter(PageRevision.user_id == user.id).order_by(PageRevision.revision.asc()).all()
+
+
+def get_revision_html(db: Session, session_id: str, revision: int) -> str | None:
+    """HTML de una revisión de la sesión (snapshot base + deltas). None si no existe."""
+    with _read_session(db, session_id) as rdb:
+        user, rdb = _user_for_read(db, rdb, session_id)
+        if not user:
+            return None
+        chain = _revision_chain(rdb, user.id, revision)
+        return _reconstruct(chain) if chain else None
+
+
+def save_generated_pages_bulk(db: Session, user_id, pages: list, revision: bool = True) -> int:
+    """
+    Guarda varias páginas y sus mensajes (prompt del usuario + HTML del agente) en una sola transacción.
+    `pages`: lista de dicts con prompt, site_type y html. `revision` como en save_generated_page.
+    """
+    if not pages:
+        return 0
+    rows = []
+    for p in pages:
+        rows.append(GeneratedPage(user_id=user_id, prompt=p["prompt"], site_type=p["site_type"], html=p["html"]))
+        rows.append(ChatMessage(user_id=user_id, role="user", content=p["prompt"]))
+        rows.append(ChatMessage(user_id=user_id, role="agent", content=p["html"]))
+    db.add_all(rows)
+    db.commit()
+    _pin(f"u:{user_id}")
+    logger.info(f"{len(pages)} páginas guardadas en bloque")
+    if REVISIONS_ENABLED and revision:
+        try:
+            for page in rows[::3]:
+                save_page_revision(db, user_id, page.html, page.id)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudieron guardar las revisiones del lote: {e}")
+    return len(pages)
+
+
+def get_chat_history(db: Session, session_id: str, since=None, role: str = None) -> list:
+    """
+    Obtiene el historial de mensajes de un usuario (réplica si está disponible).
+    `since`: solo mensajes posteriores a esa fecha; `role`: solo "user" o "agent".
+    """
+    with _read_session(db, session_id) as rdb:
+        user, rdb = _user_for_read(db, rdb, session_id)
+        if not user:
+            return []
+        q = rdb.query(ChatMessage).filter(ChatMessage.user_id == user.id)
+        if since is not None:
+            q = q.filter(ChatMessage.created_at > since)
+        if role is not None:
+            q = q.filter(ChatMessage.role == role)
+        return q.order_by(ChatMessage.created_at.asc()).all()
 
 
 def get_user_pages(db: Session, session_id: str) -> list:
-    """Obtiene las páginas generadas por un usuario."""
-    user = db.query(User).filter(User.session_id == session_id).first()
-    if not user:
-        return []
-    return db.query(GeneratedPage).filter(
-        GeneratedPage.user_id == user.id
-    ).order_by(GeneratedPage.created_at.desc()).all()
\ No newline at end of file
+    """Obtiene las páginas generadas por un usuario (réplica si está disponible)."""
+    with _read_session(db, session_id) as rdb:
+        user, rdb = _user_for_read(db, rdb, session_id)
+        if not user:
+            return []
+        return rdb.query(GeneratedPage).filter(
+            GeneratedPage.user_id == user.id
+        ).order_by(GeneratedPage.created_at.desc()).all()
+
+
+def get_page_refs(db: Session, session_id: str, since=None) -> list:
+    """Páginas del usuario sin el HTML (id, prompt, site_type, created_at), de la más antigua a la más reciente."""
+    with _read_session(db, session_id) as rdb:
+        user, rdb = _user_for_read(db, rdb, session_id)
+        if not user:
+            return []
+        q = rdb.query(GeneratedPage).options(load_only(
+            GeneratedPage.id, GeneratedPage.prompt, GeneratedPage.site_type, GeneratedPage.created_at,
+        )).filter(GeneratedPage.user_id == user.id)
+        if since is not None:
+            q = q.filter(GeneratedPage.created_at > since)
+        return q.order_by(GeneratedPage.created_at.asc()).all()
+
+
+def search_pages(db: Session, query: str, limit: int = 20, offset: int = 0, session_id: str = None) -> tuple:
+    """
+    Búsqueda de texto completo sobre las páginas generadas (tsvector + índice GIN).
+    Devuelve (total, [(GeneratedPage, rank)]) ordenado por relevancia.
+    """
+    with _read_session(db, session_id) as rdb:
+        return _search_pages(rdb, query, limit, offset, session_id)
+
+
+def _search_pages(db: Session, query: str, limit: int, offset: int, session_id: str = None) -> tuple:
+    search_vector = literal_column("generated_pages.search_vector")
+    ts_query = func.websearch_to_tsquery("simple", query)
+    rank = func.ts_rank_cd(search_vector, ts_query).label("rank")
+
+    q = (
+        db.query(GeneratedPage, rank)
+        .options(load_only(GeneratedPage.id, GeneratedPage.prompt, GeneratedPage.site_type, GeneratedPage.created_at))
+        .filter(search_vector.op("@@")(ts_query))
+    )
+    if session_id:
+        q = q.join(User, GeneratedPage.user_id == User.id).filter(User.session_id == session_id)
+
+    total = q.count()
+    rows = q.order_by(rank.desc(), GeneratedPage.created_at.desc()).offset(offset).limit(limit).all()
+    return total, rows
+
+
+
+def _delete_batch(db: Session, model, filters: list, batch_size: int, archive=None) -> int:
+    """
+    Borra como mucho `batch_size` filas que cumplan `filters`, en su propia transacción.
+    SKIP LOCKED evita esperar por filas que están usando otras transacciones.
+    `archive(filas)`: se llama con las filas antes de borrarlas; si falla, no se borra nada.
+    """
+    ids = [
+        row.id for row in db.query(model.id)
+        .filter(*filters)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    ]
+    if not ids:
+        db.rollback()
+        return 0
+    if archive is not None:
+        try:
+            archive(db.query(model).filter(model.id.in_(ids)).all())
+        except Exception:
+            db.rollback()
+            raise
+    db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    return len(ids)
+
+
+def delete_messages_before(db: Session, cutoff, batch_size: int = 500) -> int:
+    """Borra un lote de mensajes anteriores a `cutoff`. Devuelve cuántos ha borrado."""
+    return _delete_batch(db, ChatMessage, [ChatMessage.created_at < cutoff], batch_size)
+
+
+def delete_pages_before(db: Session, cutoff, batch_size: int = 500, archive=None) -> int:
+    """Borra un lote de páginas generadas anteriores a `cutoff` (pasándolas antes a `archive`)."""
+    return _delete_batch(db, GeneratedPage, [GeneratedPage.created_at < cutoff], batch_size, archive)
+
+
+def _expired_revision_filters(cutoff) -> list:
+    """
+    Revisiones anteriores a `cutoff` que ya no hacen falta para reconstruir ninguna otra:
+    las que tienen un snapshot posterior también caducado, o todas las del usuario si su
+    historial entero ha caducado.
+    """
+    newer = aliased(PageRevision)
+    return [
+        PageRevision.created_at < cutoff,
+        or_(
+            exists().where(and_(
+                newer.user_id == PageRevision.user_id,
+                newer.kind == revisions.KIND_SNAPSHOT,
+                newer.revision > PageRevision.revision,
+                newer.created_at < cutoff,
+            )),
+            ~exists().where(and_(newer.user_id == PageRevision.user_id, newer.created_at >= cutoff)),
+        ),
+    ]
+
+
+def delete_revisions_before(db: Session, cutoff, batch_size: int = 500) -> int:
+    """Borra un lote de revisiones caducadas (ver _expired_revision_filters)."""
+    return _delete_batch(db, PageRevision, _expired_revision_filters(cutoff), batch_size)
+
+
+def _empty_user_filters(cutoff) -> list:
+    return [
+        User.created_at < cutoff,
+        ~User.messages.any(),
+        ~User.pages.any(),
+        ~User.revisions.any(),
+    ]
+
+
+def delete_empty_users_before(db: Session, cutoff, batch_size: int = 500) -> int:
+    """Borra un lote de usuarios sin mensajes ni páginas creados antes de `cutoff`."""
+    return _delete_batch(db, User, _empty_user_filters(cutoff), batch_size)
+
+
+def count_retention_candidates(db: Session, cutoffs: dict) -> dict:
+    """
+    Cuenta (sin borrar) las filas que caerían en cada política de retención.
+    `cutoffs` admite las claves "chat_messages", "generated_pages", "page_revisions" y "users".
+    """
+    counts = {}
+    if cutoffs.get("chat_messages"):
+        counts["chat_messages"] = db.query(func.count(ChatMessage.id)).filter(
+            ChatMessage.created_at < cutoffs["chat_messages"]).scalar()
+    if cutoffs.get("generated_pages"):
+        counts["generated_pages"] = db.query(func.count(GeneratedPage.id)).filter(
+            GeneratedPage.created_at < cutoffs["generated_pages"]).scalar()
+    if cutoffs.get("page_revisions"):
+        counts["page_revisions"] = db.query(func.count(PageRevision.id)).filter(
+            *_expired_revision_filters(cutoffs["page_revisions"])).scalar()
+    if cutoffs.get("users"):
+        counts["users"] = db.query(func.count(User.id)).filter(
+            *_empty_user_filters(cutoffs["users"])).scalar()
+    return counts
+
+
+def get_session_ids(db: Session) -> set:
+    """Conjunto de session_id de todos los usuarios."""
+    return {row.session_id for row in db.query(User.session_id).all()}
@@ -1,7 +1,12 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class PromptDTO(BaseModel):
     prompt: str
     images: List[str] = []
     docs: List[str] = []
+
+
+class BatchPromptDTO(BaseModel):
+    prompts: List[PromptDTO]
+    session_id: Optional[str] = None
@@ -8,3 +8,5 @@ class WebPlanDTO(BaseModel):
     prompt: Optional[str] = None  
     images: Optional[List[str]] = None
     docs: Optional[List[str]] = None
+    base_page_id: Optional[str] = None   # edición de una página ya generada (None = página nueva)
+    context: Optional[str] = None        # turnos anteriores del chat (ver conversation_context.py)
@@ -1,13 +1,22 @@
+import time
+
+_IMPORT_START = time.perf_counter()
+
+import asyncio
 import logging
 import os
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from app.api.routes.generate import router as generate_router
 from app.api.routes.chat import router as chat_router
-from app.db.database import engine, test_connection
-from app.db import models
+from app.api.routes.search import router as search_router
+from app.api.routes.uploads import router as uploads_router
+from app.api.routes.revisions import router as revisions_router
+from app.api.routes.export import router as export_router
+from app.db.database import pool_stats, db_partitioned, db_health_check, pool_health_loop
+from app.db import partitioning
+from app.services import shared_state, metrics, warmup, http_client, retention, executors, static_assets, model_router, adk_cache, responses, file_storage
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,7 +24,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AI Web Builder")
+# "background" (por defecto): acepta tráfico y calienta BD/ADK en segundo plano
+# "blocking": no termina el arranque hasta que el warm-up ha acabado
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+
+# Respuestas JSON con orjson si está instalado (ver services/responses.py)
+app = FastAPI(title="AI Web Builder", default_response_class=responses.FastJSONResponse)
 
 # Middlewares — siempre DESPUÉS de crear app
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
@@ -28,18 +42,66 @@ async def limit_upload_size(request, call_next):
             return JSONResponse({"error": "Archivo demasiado grande. Máximo 50MB."}, status_code=413)
     return await call_next(request)
 
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
-
 app.include_router(generate_router)
 app.include_router(chat_router)
+app.include_router(search_router)
+app.include_router(uploads_router)
+app.include_router(revisions_router)
+app.include_router(export_router)
+
+metrics.set_gauge("startup.import_s", time.perf_counter() - _IMPORT_START)
+
+_background_tasks = []
+
 
 @app.on_event("startup")
 async def startup():
-    if test_connection():
-        models.Base.metadata.create_all(bind=engine)
-        logger.info("Tablas creadas/verificadas correctamente")
+    logger.info(f"Módulos importados en {time.perf_counter() - _IMPORT_START:.2f}s (modo {STARTUP_MODE})")
+    executors.start()
+    static_assets.build()
+    if STARTUP_MODE == "blocking":
+        await warmup.warm_up(blocking=True)
     else:
-        logger.error("No se pudo conectar a la BD al iniciar")
\ No newline at end of file
+        _background_tasks.append(asyncio.create_task(warmup.warm_up()))
+    _background_tasks.append(asyncio.create_task(shared_state.purge_loop()))
+    if retention.RETENTION_ENABLED:
+        _background_tasks.append(asyncio.create_task(retention.retention_loop()))
+    if db_partitioned:
+        _background_tasks.append(asyncio.create_task(partitioning.partition_maintenance_loop()))
+    if adk_cache.ADK_CACHE_ENABLED:
+        _background_tasks.append(asyncio.create_task(adk_cache.refresh_loop()))
+    if db_health_check == "background":
+        _background_tasks.append(asyncio.create_task(pool_health_loop()))
+    metrics.set_gauge("startup.serviceable_s", time.perf_counter() - _IMPORT_START)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in _background_tasks:
+        if not task.done():
+            task.cancel()
+    await http_client.close()
+    executors.shutdown()
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: el proceso responde."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: BD verificada y ADK/MCP inicializados."""
+    body = {"ready": warmup.is_ready(), "steps": warmup.state["steps"]}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        **metrics.snapshot(),
+        "db_pools": pool_stats(),
+        "model_tiers": model_router.router.stats(),
+        "file_storage_caches": file_storage.cache_stats(),
+    }
@@ -0,0 +1,286 @@
+"""
+adk_cache.py
+Cache en disco de las tools descubiertas en el servidor MCP de Stitch y de la
+configuración de los agentes.
+
+Sin cache, cada proceso descubre las tools por red al arrancar, y McpToolset repite
+list_tools en cada generación. Con cache:
+
+1. Al arrancar, los esquemas se cargan de ADK_CACHE_PATH sin ir a la red, siempre que el
+   fichero tenga menos de ADK_CACHE_TTL_S y su huella coincida: versión del formato,
+   versión de google-adk, URL del MCP y configuración de los agentes (tiers, modelos,
+   instrucción). Si no, se descubren por red y se guardan.
+2. Cada ADK_CACHE_REFRESH_S se vuelve a descubrir en segundo plano. Si los esquemas han
+   cambiado, se sustituyen en memoria y en disco (métrica adk_cache.schema_changed).
+   Si otro worker ya lo ha hecho hace poco, basta con releer el fichero.
+3. Si el servidor rechaza una llamada a tool por esquema (tool desconocida o argumentos
+   inválidos, SCHEMA_ERROR_CODES), se vuelve a descubrir por red en ese momento.
+
+Métricas: adk_cache.hits / misses / invalidated.<motivo> / refreshes / schema_changed / refresh_errors,
+startup.tool_discovery_s y startup.first_generation_s (arranque en frío → primera
+generación correcta).
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from app.services import shared_state, metrics
+
+logger = logging.getLogger(__name__)
+
+ADK_CACHE_ENABLED = os.getenv("ADK_CACHE_ENABLED", "true").lower() == "true"
+ADK_CACHE_PATH = os.getenv("ADK_CACHE_PATH", os.path.join(shared_state.STATE_DIR, "adk_tools.json"))
+ADK_CACHE_TTL_S = float(os.getenv("ADK_CACHE_TTL_S", 24 * 3600))
+ADK_CACHE_REFRESH_S = float(os.getenv("ADK_CACHE_REFRESH_S", 3600))
+
+# Cambiar al modificar el formato del fichero
+CACHE_FORMAT_VERSION = 1
+
+
+def _adk_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("google-adk")
+    except Exception:
+        return "unknown"
+
+
+def fingerprint(mcp_url: str, tiers: list, instruction: str) -> str:
+    """Huella de todo lo que invalida la cache: formato, ADK, servidor MCP y agentes."""
+    config = {
+        "format": CACHE_FORMAT_VERSION,
+        "adk": _adk_version(),
+        "mcp_url": mcp_url,
+        "tiers": [[t.name, t.model, t.tools] for t in tiers],
+        "instruction": instruction,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def schema_hash(schemas: list) -> str:
+    return hashlib.sha256(json.dumps(schemas, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def read(expected_fingerprint: str, max_age_s: float = None, record: bool = True) -> dict | None:
+    """
+    Entrada de la cache si es válida ({"schemas", "schema_hash", "fetched_at"}); None si no.
+    `record`: contar el descarte en adk_cache.invalidated.<motivo>.
+    """
+    max_age_s = ADK_CACHE_TTL_S if max_age_s is None else max_age_s
+    try:
+        with open(ADK_CACHE_PATH, encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        metrics.incr("adk_cache.invalidated.corrupt")
+        logger.warning(f"Cache de tools ilegible ({e}); se ignora")
+        return None
+
+    if entry.get("format") != CACHE_FORMAT_VERSION or entry.get("fingerprint") != expected_fingerprint:
+        reason = "format" if entry.get("format") != CACHE_FORMAT_VERSION else "config"
+    elif schema_hash(entry.get("schemas") or []) != entry.get("schema_hash"):
+        reason = "schema_mismatch"
+    elif time.time() - entry.get("fetched_at", 0) > max_age_s:
+        reason = "expired"
+    else:
+        return entry
+    if record:
+        metrics.incr(f"adk_cache.invalidated.{reason}")
+        logger.info(f"Cache de tools descartada ({reason})")
+    return None
+
+
+def write(expected_fingerprint: str, schemas: list):
+    entry = {
+        "format": CACHE_FORMAT_VERSION,
+        "fingerprint": expected_fingerprint,
+        "fetched_at": time.time(),
+        "schema_hash": schema_hash(schemas),
+        "schemas": schemas,
+    }
+    os.makedirs(os.path.dirname(ADK_CACHE_PATH) or ".", exist_ok=True)
+    tmp = f"{ADK_CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp, ADK_CACHE_PATH)
+
+
+def invalidate():
+    try:
+        os.remove(ADK_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+
+
+# Errores JSON-RPC de una llamada a tool que indican esquemas desactualizados
+# (tool desconocida / argumentos inválidos para el esquema del servidor)
+SCHEMA_ERROR_CODES = (-32601, -32602)
+
+
+def is_schema_error(exc: Exception) -> bool:
+    """True si `exc` es un McpError con un código de SCHEMA_ERROR_CODES (sin importar mcp)."""
+    return getattr(getattr(exc, "error", None), "code", None) in SCHEMA_ERROR_CODES
+
+
+class ToolCache:
+    """
+    Lógica de la cache de CachedMcpToolset, sin dependencias de ADK. La clase que la usa
+    aporta `_mcp_session_manager`, `_build(schemas)` y, como fallback, `get_tools` de su base.
+    """
+
+    def _init_cache(self, cache_fingerprint: str):
+        self._cache_fingerprint = cache_fingerprint
+        self._cached_tools = None
+        self._schema_hash = None
+        self._refreshed_at = None   # time.monotonic() del último descubrimiento por red
+        self._refresh_lock = asyncio.Lock()
+
+    def _use(self, schemas: list, digest: str) -> bool:
+        """Sustituye las tools en memoria. False si ADK no acepta los esquemas."""
+        try:
+            self._cached_tools = self._build(schemas)
+        except Exception as e:
+            logger.warning(f"No se pudieron construir las tools desde la cache ({e})")
+            metrics.incr("adk_cache.invalidated.build_error")
+            return False
+        self._schema_hash = digest
+        return True
+
+    async def _discover(self) -> list:
+        """list_tools contra el servidor MCP (un viaje de red)."""
+        session = await self._mcp_session_manager.create_session()
+        result = await session.list_tools()
+        return [t.model_dump(mode="json", exclude_none=True) for t in result.tools]
+
+    async def refresh(self, force: bool = False, stale_before: float = None):
+        """
+        Vuelve a descubrir las tools. Sin `force`, si otro worker ya refrescó el fichero
+        hace menos de ADK_CACHE_REFRESH_S, se usa ese resultado sin ir a la red.
+        `stale_before` (time.monotonic()): no hacer nada si ya se descubrió después.
+        """
+        async with self._refresh_lock:
+            if stale_before is not None and self._refreshed_at is not None and self._refreshed_at >= stale_before:
+                return
+            entry = None if force else read(
+                self._cache_fingerprint, max_age_s=ADK_CACHE_REFRESH_S, record=False
+            )
+            if entry is not None:
+                if entry["schema_hash"] != self._schema_hash:
+                    self._use(entry["schemas"], entry["schema_hash"])
+                return
+            start = time.perf_counter()
+            schemas = await self._discover()
+            self._refreshed_at = time.monotonic()
+            digest = schema_hash(schemas)
+            metrics.incr("adk_cache.refreshes")
+            metrics.observe("adk_cache.discovery_s", time.perf_counter() - start)
+            if self._schema_hash is not None and digest != self._schema_hash:
+                metrics.incr("adk_cache.schema_changed")
+                logger.info("Los esquemas de las tools de Stitch han cambiado; cache actualizada")
+            if digest != self._schema_hash and not self._use(schemas, digest):
+                raise RuntimeError("ADK no acepta los esquemas descubiertos")
+            write(self._cache_fingerprint, schemas)
+
+    async def on_schema_error(self, exc: Exception, started_at: float):
+        """
+        Una llamada a tool empezada en `started_at` ha fallado por esquema: se descubre de
+        nuevo por red (una sola vez aunque fallen varias llamadas a la vez). Los errores del
+        refresco se registran; el de la llamada lo sigue propagando quien llama.
+        """
+        metrics.incr("adk_cache.invalidated.tool_error")
+        logger.warning(f"Error de esquema al llamar a una tool de Stitch ({exc}); se vuelven a descubrir")
+        try:
+            await self.refresh(force=True, stale_before=started_at)
+        except Exception as e:
+            metrics.incr("adk_cache.refresh_errors")
+            logger.warning(f"Refresco de la cache de tools fallido: {e}")
+
+    async def get_tools(self, readonly_context=None):
+        if self._cached_tools is None:
+            start = time.perf_counter()
+            entry = read(self._cache_fingerprint)
+            if entry is not None and self._use(entry["schemas"], entry["schema_hash"]):
+                metrics.incr("adk_cache.hits")
+            else:
+                metrics.incr("adk_cache.misses")
+                try:
+                    await self.refresh(force=True)
+                except Exception as e:
+                    logger.warning(f"Descubrimiento de tools con cache fallido ({e}); sin cache")
+                    return await super().get_tools(readonly_context)
+            metrics.set_gauge("startup.tool_discovery_s", time.perf_counter() - start)
+        return list(self._cached_tools)
+
+
+_toolset_class = None
+
+
+def toolset_class():
+    """
+    Subclase de McpToolset que sirve las tools desde la cache (se crea al primer uso
+    para no importar ADK al importar este módulo).
+    """
+    global _toolset_class
+    if _toolset_class is not None:
+        return _toolset_class
+
+    from google.adk.tools.mcp_tool import McpToolset
+    from google.adk.tools.mcp_tool.mcp_tool import MCPTool
+
+    class CachedMCPTool(MCPTool):
+        """MCPTool que avisa a su toolset cuando el servidor rechaza la llamada por esquema."""
+
+        async def run_async(self, **kwargs):
+            started_at = time.monotonic()
+            try:
+                return await super().run_async(**kwargs)
+            except Exception as e:
+                if is_schema_error(e):
+                    await self._cache_owner.on_schema_error(e, started_at)
+                raise
+
+    class CachedMcpToolset(ToolCache, McpToolset):
+
+        def __init__(self, *, cache_fingerprint: str, **kwargs):
+            super().__init__(**kwargs)
+            self._init_cache(cache_fingerprint)
+
+        def _build(self, schemas: list) -> list:
+            from mcp.types import Tool
+
+            tools = []
+            for schema in schemas:
+                tool = CachedMCPTool(
+                    mcp_tool=Tool.model_validate(schema),
+                    mcp_session_manager=self._mcp_session_manager,
+                    auth_scheme=getattr(self, "_auth_scheme", None),
+                    auth_credential=getattr(self, "_auth_credential", None),
+                )
+                tool._cache_owner = self
+                tools.append(tool)
+            return tools
+
+    _toolset_class = CachedMcpToolset
+    return _toolset_class
+
+
+async def refresh_loop():
+    """Refresco periódico de las tools en segundo plano (primera vez poco después de arrancar)."""
+    from app.services import stitch_adk_client
+
+    delay = min(30.0, ADK_CACHE_REFRESH_S)
+    while True:
+        await asyncio.sleep(delay)
+        delay = ADK_CACHE_REFRESH_S
+        toolset = stitch_adk_client._toolset
+        if toolset is None or not hasattr(toolset, "refresh"):
+            continue
+        try:
+            await toolset.refresh()
+        except Exception as e:
+            metrics.incr("adk_cache.refresh_errors")
+            logger.warning(f"Refresco de la cache de tools fallido: {e}")
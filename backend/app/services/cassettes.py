@@ -0,0 +1,298 @@
+"""
+cassettes.py
+Grabación y reproducción del stream de eventos de `_runner.run_async` para poder
+repetir una generación sin depender de Gemini/Stitch.
+
+- CASSETTE_MODE=record: cada run se guarda en CASSETTE_DIR/{clave}.jsonl.gz
+  (cabecera + un evento de ADK por línea con su instante relativo). Las imágenes del
+  mensaje van aparte, en CASSETTE_DIR/blobs/{sha256}.b64 (la cabecera solo lleva su
+  nombre), y el HTML que se descarga de la URL que devuelve Stitch se guarda en
+  CASSETTE_DIR/downloads/{hash de la URL}.gz
+- CASSETTE_MODE=replay: el runner se sustituye por ReplayRunner, que busca la cassette
+  por la clave del mensaje y devuelve los mismos eventos a velocidad grabada
+  (CASSETTE_SPEED=1), acelerada (>1) o sin esperas (0). La descarga también se sirve
+  desde la cassette: reproducir no hace ninguna petición HTTP
+
+La clave es el hash del mensaje de usuario (texto e imágenes), así que repetir la misma
+petición reproduce su cassette. La reproducción pasa por el mismo código que producción
+(output guard, descarga, post-procesado), lo que sirve para tests de regresión de rendimiento
+y para perfilar offline:
+
+    python -m app.services.cassettes list
+    python -m app.services.cassettes replay <cassette> [--speed 0] [--persist]
+    python -m app.services.cassettes bench <cassette> [--runs 50]
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from app.services import shared_state, metrics, executors, storage
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()      # off | record | replay
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", os.path.join(shared_state.STATE_DIR, "cassettes"))
+CASSETTE_SPEED = float(os.getenv("CASSETTE_SPEED", 1))
+CASSETTE_VERSION = 2
+_READABLE_VERSIONS = (1, 2)   # v1: imágenes en la cabecera y sin descargas grabadas
+
+
+class CassetteNotFound(LookupError):
+    """No hay cassette grabada para este mensaje."""
+
+
+def message_key(new_message) -> str:
+    """Clave estable de un types.Content (texto + imágenes en base64)."""
+    payload = new_message.model_dump_json(exclude_none=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _event_to_dict(event) -> dict:
+    return event.model_dump(mode="json", exclude_none=True, by_alias=True)
+
+
+def load(path: str) -> tuple:
+    """(cabecera, [(t, evento como dict)]) de una cassette."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") not in _READABLE_VERSIONS:
+            raise ValueError(f"Versión de cassette no soportada: {header.get('version')}")
+        entries = [json.loads(line) for line in f if line.strip()]
+    return header, [(e["t"], e["event"]) for e in entries]
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _externalize_blobs(message: dict, directory: str) -> dict:
+    """Copia del mensaje con los datos de inline_data en blobs/{sha256}.b64 (solo queda el nombre)."""
+    parts = []
+    for part in message.get("parts", []):
+        blob = part.get("inline_data")
+        if isinstance(blob, dict) and isinstance(blob.get("data"), str):
+            data = blob["data"].encode("ascii")
+            name = f"{hashlib.sha256(data).hexdigest()}.b64"
+            path = os.path.join(directory, "blobs", name)
+            if not os.path.exists(path):
+                _write_atomic(path, data)
+            part = {**part, "inline_data": {**{k: v for k, v in blob.items() if k != "data"}, "data_file": name}}
+        parts.append(part)
+    return {**message, "parts": parts}
+
+
+def restore_message(header: dict, directory: str) -> dict:
+    """El mensaje grabado con los datos de sus imágenes de vuelta (lee los blobs/)."""
+    message = header["message"]
+    parts = []
+    for part in message.get("parts", []):
+        blob = part.get("inline_data")
+        if isinstance(blob, dict) and "data_file" in blob:
+            with open(os.path.join(directory, "blobs", blob["data_file"]), "r", encoding="ascii") as f:
+                data = f.read()
+            part = {**part, "inline_data": {**{k: v for k, v in blob.items() if k != "data_file"}, "data": data}}
+        parts.append(part)
+    return {**message, "parts": parts}
+
+
+def _download_path(directory: str, url: str) -> str:
+    return os.path.join(directory, "downloads", f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]}.gz")
+
+
+def _save(path: str, header: dict, entries: list):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for t, event in entries:
+            f.write(json.dumps({"t": round(t, 4), "event": event}, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+class RecordingRunner:
+    """Envuelve un Runner de ADK y graba en disco el stream de cada run_async."""
+
+    def __init__(self, runner, directory: str = CASSETTE_DIR):
+        self.runner = runner
+        self.directory = directory
+
+    def __getattr__(self, name):
+        return getattr(self.runner, name)
+
+    async def run_async(self, *, new_message, **kwargs):
+        key = message_key(new_message)
+        entries, completed = [], False
+        start = time.perf_counter()
+        try:
+            async for event in self.runner.run_async(new_message=new_message, **kwargs):
+                entries.append((time.perf_counter() - start, _event_to_dict(event)))
+                yield event
+            completed = True
+        finally:
+            # Los runs abortados (guard, cancelación) también se graban: son los que interesa repetir
+            header = {
+                "version": CASSETTE_VERSION,
+                "key": key,
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+                "completed": completed,
+                "seconds": time.perf_counter() - start,
+                "events": len(entries),
+            }
+            try:
+                header["message"] = _externalize_blobs(
+                    new_message.model_dump(mode="json", exclude_none=True), self.directory
+                )
+                _save(os.path.join(self.directory, f"{key}.jsonl.gz"), header, entries)
+                metrics.incr("cassettes.recorded")
+            except OSError as e:
+                logger.warning(f"No se pudo grabar la cassette {key}: {e}")
+
+    async def download_html(self, url: str, **kwargs):
+        """Descarga real (ver http_client.download_to_storage) y graba el cuerpo para el replay."""
+        from app.services import http_client
+
+        result = await http_client.download_to_storage(url, **kwargs)
+        try:
+            await executors.run_in_thread(
+                _write_atomic, _download_path(self.directory, url), gzip.compress(result.data)
+            )
+            metrics.incr("cassettes.downloads_recorded")
+        except OSError as e:
+            logger.warning(f"No se pudo grabar la descarga de {url}: {e}")
+        return result
+
+
+class ReplayRunner:
+    """
+    Sustituto del Runner que reproduce cassettes. Con `path` reproduce siempre esa
+    cassette; si no, la busca por la clave del mensaje en `directory`.
+    """
+
+    def __init__(self, directory: str = CASSETTE_DIR, speed: float = CASSETTE_SPEED, path: str | None = None):
+        self.directory = directory
+        self.speed = speed
+        self.path = path
+
+    async def run_async(self, *, new_message, **kwargs):
+        from google.adk.events import Event
+
+        path = self.path or os.path.join(self.directory, f"{message_key(new_message)}.jsonl.gz")
+        if not os.path.exists(path):
+            metrics.incr("cassettes.misses")
+            raise CassetteNotFound(f"No hay cassette para este mensaje ({os.path.basename(path)})")
+        header, entries = load(path)
+        metrics.incr("cassettes.replayed")
+
+        start = time.perf_counter()
+        for t, data in entries:
+            if self.speed > 0:
+                delay = t / self.speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield Event.model_validate(data)
+
+    async def download_html(self, url: str, prefix: str = "", suffix: str = "", **kwargs):
+        """
+        La descarga grabada de `url`, escrita en el almacenamiento con la misma clave que
+        una descarga real. Sin grabación lanza CassetteNotFound (nunca va a la red).
+        """
+        from app.services import http_client
+
+        path = _download_path(self.directory, url)
+        start = time.perf_counter()
+        try:
+            with open(path, "rb") as f:
+                data = gzip.decompress(f.read())
+        except FileNotFoundError:
+            metrics.incr("cassettes.download_misses")
+            raise CassetteNotFound(f"No hay descarga grabada para {url}")
+        checksum = hashlib.sha256(data).hexdigest()
+        key = f"{prefix}{checksum}{suffix}"
+        await executors.run_in_thread(storage.backend().put, key, data, "text/html")
+        return http_client.DownloadResult(
+            key=key, size=len(data), sha256=checksum, seconds=time.perf_counter() - start, data=data,
+        )
+
+
+def wrap_runner(runner):
+    """Aplica CASSETTE_MODE al Runner recién creado."""
+    if CASSETTE_MODE == "record":
+        logger.info(f"Grabando cassettes de ADK en {CASSETTE_DIR}")
+        return RecordingRunner(runner)
+    if CASSETTE_MODE == "replay":
+        logger.info(f"Reproduciendo cassettes de ADK desde {CASSETTE_DIR} (velocidad {CASSETTE_SPEED})")
+        return ReplayRunner()
+    return runner
+
+
+def list_cassettes(directory: str = CASSETTE_DIR) -> list:
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".jsonl.gz"):
+            header, _ = load(os.path.join(directory, name))
+            header.pop("message", None)
+            result.append({"file": name, **header})
+    return result
+
+
+async def replay_once(path: str, speed: float = 0, persist: bool = False) -> dict:
+    """Reproduce una cassette por el camino real de generación (y, si persist, de guardado)."""
+    from google.adk.sessions import InMemorySessionService
+    from google.genai import types
+    from app.services import stitch_adk_client, file_storage
+    from app.services.output_guard import OutputGuard
+
+    header, _ = load(path)
+    stitch_adk_client._runner = ReplayRunner(directory=os.path.dirname(path), speed=speed, path=path)
+    if stitch_adk_client._session_service is None:
+        stitch_adk_client._session_service = InMemorySessionService()
+
+    content = types.Content.model_validate(restore_message(header, os.path.dirname(path)))
+    start = time.perf_counter()
+    html = await stitch_adk_client._run_attempt(content, OutputGuard())
+    generated = time.perf_counter() - start
+    report = {"recorded_s": header["seconds"], "replay_s": generated, "html_chars": len(html)}
+    if persist:
+        start = time.perf_counter()
+        meta = file_storage.save_page(html, prompt=f"cassette {header['key']}", site_type="replay", session_id="cassette")
+        report["persist_s"] = time.perf_counter() - start
+        report["page_id"] = meta["page_id"]
+    return report
+
+
+async def _bench(path: str, runs: int) -> dict:
+    timings = []
+    for _ in range(runs):
+        timings.append((await replay_once(path, speed=0))["replay_s"])
+    timings.sort()
+
+    def pct(q):
+        return timings[min(len(timings) - 1, int(round(q / 100 * (len(timings) - 1))))]
+
+    return {"runs": runs, "p50_s": pct(50), "p95_s": pct(95), "max_s": timings[-1]}
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "replay":
+        speed = float(sys.argv[sys.argv.index("--speed") + 1]) if "--speed" in sys.argv else 1.0
+        result = asyncio.run(replay_once(sys.argv[2], speed=speed, persist="--persist" in sys.argv))
+    elif command == "bench":
+        runs = int(sys.argv[sys.argv.index("--runs") + 1]) if "--runs" in sys.argv else 50
+        result = asyncio.run(_bench(sys.argv[2], runs))
+    else:
+        result = list_cassettes()
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
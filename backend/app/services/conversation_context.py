@@ -0,0 +1,188 @@
+"""
+conversation_context.py
+Contexto de la conversación para cada generación del chat, con presupuesto de tokens.
+
+Cada generación corre en una sesión nueva de ADK sin memoria del chat. Aquí se arma un
+resumen de los turnos anteriores de la sesión a partir de chat_messages:
+
+- los últimos CONTEXT_RECENT_TURNS turnos van casi literales (prompt recortado)
+- los anteriores se pliegan en un resumen acumulado de una línea por turno; si el resumen
+  pasa de CONTEXT_SUMMARY_TOKENS se descartan sus líneas más antiguas (se conserva siempre
+  la primera petición de la sesión, que suele fijar el tipo de web)
+- las páginas anteriores se citan por id (y site_type), nunca se incluye su HTML
+
+El estado se cachea por sesión en shared_state y solo se actualiza cuando hay turnos
+nuevos: cada petición hace una consulta de los mensajes posteriores al último procesado.
+Tokens estimados como caracteres / 4 (sin tokenizador).
+"""
+
+import os
+import logging
+from datetime import datetime
+from app.db import repository
+from app.services import shared_state, metrics
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_ENABLED = os.getenv("CONTEXT_ENABLED", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200))
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", 4))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 400))
+CONTEXT_PROMPT_CHARS = int(os.getenv("CONTEXT_PROMPT_CHARS", 600))
+CONTEXT_SUMMARY_LINE_CHARS = int(os.getenv("CONTEXT_SUMMARY_LINE_CHARS", 120))
+CONTEXT_CACHE_TTL_S = float(os.getenv("CONTEXT_CACHE_TTL_S", 24 * 3600))
+
+_STATE_VERSION = 1
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _page_ref(turn: dict) -> str:
+    if not turn.get("page_id"):
+        return "no page"
+    return f"page {turn['page_id']} ({turn.get('site_type') or '?'})"
+
+
+def _empty_state() -> dict:
+    return {
+        "version": _STATE_VERSION,
+        "message_cursor": None,   # created_at ISO del último mensaje procesado
+        "page_cursor": None,      # created_at ISO de la última página procesada
+        "first": None,            # primera petición de la sesión (línea de resumen)
+        "summary": [],            # líneas de los turnos antiguos
+        "omitted": 0,             # turnos descartados del resumen por presupuesto
+        "recent": [],             # [{"prompt", "page_id", "site_type"}]
+        "text": None,             # contexto ya renderizado
+        "budget": None,           # presupuesto con el que se renderizó
+    }
+
+
+def _fold(state: dict):
+    """Pasa al resumen los turnos que sobran de `recent` y recorta el resumen a su presupuesto."""
+    while len(state["recent"]) > CONTEXT_RECENT_TURNS:
+        turn = state["recent"].pop(0)
+        line = f"- \"{_clip(turn['prompt'], CONTEXT_SUMMARY_LINE_CHARS)}\" → {_page_ref(turn)}"
+        if state["first"] is None:
+            state["first"] = line
+        else:
+            state["summary"].append(line)
+    while state["summary"] and estimate_tokens("\n".join(state["summary"])) > CONTEXT_SUMMARY_TOKENS:
+        state["summary"].pop(0)
+        state["omitted"] += 1
+
+
+def _render(state: dict, budget: int) -> str:
+    """Texto del contexto; si no cabe en `budget` tokens se quitan primero líneas del resumen y luego turnos recientes."""
+    summary, recent, omitted = list(state["summary"]), list(state["recent"]), state["omitted"]
+    first = state["first"]
+
+    def build() -> str:
+        lines = []
+        if first or summary:
+            lines.append("Earlier in this conversation:")
+            if first:
+                lines.append(first)
+            if omitted:
+                lines.append(f"- ({omitted} more requests omitted)")
+            lines.extend(summary)
+        if recent:
+            lines.append("Most recent requests (oldest first):")
+            lines.extend(
+                f"- \"{_clip(turn['prompt'], CONTEXT_PROMPT_CHARS)}\" → {_page_ref(turn)}" for turn in recent
+            )
+        return "\n".join(lines)
+
+    text = build()
+    while estimate_tokens(text) > budget:
+        if summary:
+            summary.pop(0)
+        elif len(recent) > 1:
+            recent.pop(0)
+        elif first:
+            first = None
+        else:
+            return ""
+        omitted += 1
+        text = build()
+    return text
+
+
+def _update(state: dict, messages: list, pages: list) -> bool:
+    """Incorpora mensajes y páginas nuevos. Devuelve True si el estado ha cambiado."""
+    changed = False
+    new_turns = []
+    for message in messages:
+        new_turns.append({"prompt": message.content, "page_id": None, "site_type": None})
+        state["message_cursor"] = message.created_at.isoformat()
+        changed = True
+
+    pending = [t for t in state["recent"] + new_turns if not t["page_id"]]
+    for page in pages:
+        state["page_cursor"] = page.created_at.isoformat()
+        # Las páginas tienen el mismo prompt que el mensaje que las pidió
+        turn = next((t for t in pending if t["prompt"] == page.prompt), None)
+        if turn is not None:
+            turn["page_id"], turn["site_type"] = str(page.id), page.site_type
+            pending.remove(turn)
+            changed = True
+
+    state["recent"].extend(new_turns)
+    _fold(state)
+    return changed
+
+
+def build_context(db, session_id: str, budget: int = None) -> str:
+    """
+    Contexto de los turnos anteriores de `session_id` ("" si no hay). Llamar antes de guardar
+    el mensaje actual, para que no aparezca en su propio contexto.
+    """
+    if not CONTEXT_ENABLED:
+        return ""
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    key = f"ctx:{session_id}"
+    state = shared_state.cache_get(key)
+    if not state or state.get("version") != _STATE_VERSION:
+        state = _empty_state()
+        metrics.incr("context.rebuilds")
+
+    since_message = datetime.fromisoformat(state["message_cursor"]) if state["message_cursor"] else None
+    since_page = datetime.fromisoformat(state["page_cursor"]) if state["page_cursor"] else None
+    messages = repository.get_chat_history(db, session_id, since=since_message, role="user")
+    pages = repository.get_page_refs(db, session_id, since=since_page)
+
+    if _update(state, messages, pages) or state["text"] is None or state["budget"] != budget:
+        state["text"], state["budget"] = _render(state, budget), budget
+        shared_state.cache_set(key, state, ttl=CONTEXT_CACHE_TTL_S)
+        metrics.incr("context.updates")
+    else:
+        metrics.incr("context.cache_hits")
+    metrics.observe("context.tokens", estimate_tokens(state["text"]))
+    return state["text"]
+
+
+def cached_context(session_id: str) -> str:
+    """Último contexto calculado para la sesión, sin consultar la BD (para los borradores especulativos)."""
+    if not CONTEXT_ENABLED:
+        return ""
+    state = shared_state.cache_get(f"ctx:{session_id}")
+    return (state or {}).get("text") or ""
+
+
+def last_page_id(session_id: str) -> str | None:
+    """Id de la página del turno más reciente según el estado cacheado (None si no hay)."""
+    if not CONTEXT_ENABLED:
+        return None
+    state = shared_state.cache_get(f"ctx:{session_id}") or {}
+    turn = next((t for t in reversed(state.get("recent") or []) if t.get("page_id")), None)
+    return turn["page_id"] if turn else None
+
+
+def invalidate(session_id: str):
+    shared_state.cache_delete(f"ctx:{session_id}")
@@ -0,0 +1,246 @@
+"""
+doc_ingestion.py
+Ingesta de los documentos adjuntos (PromptDTO.docs) para que el modelo vea su contenido
+y no solo su nombre.
+
+Los documentos se nombran por su clave de almacenamiento de /generate/upload
+(storage.check_upload_key), nunca por ruta: una ruta del cliente ("/etc/passwd",
+"../.env") se rechaza antes de abrir nada, y cada clave pasa por check_supported.
+
+1. Extrae el texto de PDF / DOCX / TXT en el pool de procesos compartido (executors)
+2. Lo trocea en chunks
+3. Cachea la extracción por hash del contenido (.state/doc_cache/{sha256}.json)
+4. Selecciona los chunks más relevantes para el prompt sin pasar de un presupuesto de tokens
+
+PDF requiere `pypdf` (en requirements.txt; si falta, la subida de un PDF se rechaza con
+check_supported en vez de llegar al modelo sin contenido). DOCX se lee con la stdlib
+(es un zip con XML).
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import zipfile
+from xml.etree import ElementTree
+from app.services import shared_state, metrics, executors, storage
+
+logger = logging.getLogger(__name__)
+
+DOC_CACHE_DIR = os.path.join(shared_state.STATE_DIR, "doc_cache")
+DOC_CHUNK_CHARS = int(os.getenv("DOC_CHUNK_CHARS", 1200))
+# Presupuesto de tokens de documentos por prompt (≈ 4 caracteres por token)
+DOC_TOKEN_BUDGET = int(os.getenv("DOC_TOKEN_BUDGET", 2000))
+CHARS_PER_TOKEN = 4
+
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".json", ".html", ".htm"}
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_TOKEN_RE = re.compile(r"\w{3,}", re.UNICODE)
+
+# ---------------------------------------------------------------------------
+# Extracción (se ejecuta en los procesos del pool: solo funciones de módulo)
+# ---------------------------------------------------------------------------
+
+def _extract_docx(path: str) -> str:
+    with zipfile.ZipFile(path) as z:
+        root = ElementTree.fromstring(z.read("word/document.xml"))
+    paragraphs = []
+    for p in root.iter(f"{_WORD_NS}p"):
+        text = "".join(t.text or "" for t in p.iter(f"{_WORD_NS}t"))
+        if text.strip():
+            paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+
+def _extract_pdf(path: str) -> str:
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return "\n\n".join((page.extract_text() or "") for page in reader.pages)
+
+
+def extract_text(path: str) -> str:
+    """Texto plano de un documento según su extensión. Lanza ValueError si no está soportado."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".docx":
+        return _extract_docx(path)
+    if ext == ".pdf":
+        return _extract_pdf(path)
+    if ext in TEXT_EXTENSIONS:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    raise ValueError(f"Formato no soportado: {ext}")
+
+
+def check_supported(filename: str):
+    """
+    Comprueba al subir un documento que se podrá extraer su texto.
+    Lanza ValueError si el formato no está soportado o falta la dependencia (pypdf).
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".pdf":
+        try:
+            import pypdf  # noqa: F401
+        except ImportError:
+            raise ValueError("No se pueden leer PDF: falta el paquete pypdf en el servidor")
+    elif ext != ".docx" and ext not in TEXT_EXTENSIONS:
+        raise ValueError(f"Formato no soportado: {ext or filename}")
+
+
+def chunk_text(text: str, max_chars: int = DOC_CHUNK_CHARS) -> list:
+    """Agrupa párrafos en chunks de como mucho max_chars (los párrafos largos se cortan)."""
+    chunks, current = [], ""
+    for para in re.split(r"\n\s*\n", text):
+        para = " ".join(para.split())
+        if not para:
+            continue
+        while len(para) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:max_chars])
+            para = para[max_chars:]
+        if current and len(current) + len(para) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _extract_and_chunk(path: str) -> list:
+    return chunk_text(extract_text(path))
+
+
+# ---------------------------------------------------------------------------
+# Cache por hash de contenido
+# ---------------------------------------------------------------------------
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_load(content_hash: str) -> list | None:
+    try:
+        with open(os.path.join(DOC_CACHE_DIR, f"{content_hash}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)["chunks"]
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+def _cache_store(content_hash: str, chunks: list):
+    os.makedirs(DOC_CACHE_DIR, exist_ok=True)
+    path = os.path.join(DOC_CACHE_DIR, f"{content_hash}.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"chunks": chunks}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+async def load_chunks(key: str) -> tuple:
+    """
+    Chunks de un documento subido, desde cache si ya se extrajo. Devuelve (chunks, cache_hit).
+    Lanza ValueError (también storage.InvalidKey) si la clave o el formato no valen y
+    FileNotFoundError si el objeto no existe.
+    """
+    check_supported(key)
+    path = await executors.run_in_thread(storage.upload_local_path, key)
+    if path is None:
+        raise FileNotFoundError(key)
+    content_hash = await executors.run_in_thread(_file_hash, path)
+    cached = await executors.run_in_thread(_cache_load, content_hash)
+    if cached is not None:
+        metrics.incr("docs.cache_hits")
+        return cached, True
+
+    metrics.incr("docs.cache_misses")
+    with metrics.timer("docs.extract_s"):
+        chunks = await executors.run_in_process(_extract_and_chunk, path)
+    await executors.run_in_thread(_cache_store, content_hash, chunks)
+    return chunks, False
+
+
+# ---------------------------------------------------------------------------
+# Selección bajo presupuesto de tokens
+# ---------------------------------------------------------------------------
+
+def _tokens(text: str) -> set:
+    return {t.lower() for t in _TOKEN_RE.findall(text)}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def select_chunks(chunks: list, query: str, token_budget: int = DOC_TOKEN_BUDGET) -> list:
+    """
+    Elige los chunks con más términos en común con el prompt sin superar el presupuesto.
+    A igualdad de puntuación gana el que aparece antes; se devuelven en el orden original.
+    `chunks`: lista de (doc_name, position, text).
+    """
+    query_terms = _tokens(query)
+    scores = [len(query_terms & _tokens(c[2])) for c in chunks]
+    # Los chunks sin ningún término en común solo entran si no hay ninguno relevante
+    candidates = [i for i in range(len(chunks)) if scores[i] > 0] or list(range(len(chunks)))
+    candidates.sort(key=lambda i: (-scores[i], i))
+    chosen, used = [], 0
+    for i in candidates:
+        cost = estimate_tokens(chunks[i][2])
+        if used + cost > token_budget:
+            continue
+        chosen.append(i)
+        used += cost
+    return [chunks[i] for i in sorted(chosen)]
+
+
+async def build_document_context(keys: list, query: str, token_budget: int = DOC_TOKEN_BUDGET) -> tuple:
+    """
+    Texto de contexto con los fragmentos relevantes de los documentos subidos (`keys`,
+    claves de storage) para `query`. Devuelve (contexto, informe) con tiempos y ahorro
+    de tamaño de prompt. Las claves que no valen cuentan como fallidas.
+    """
+    start = time.perf_counter()
+    all_chunks, cache_hits, failed = [], 0, []
+
+    results = await asyncio.gather(*(load_chunks(k) for k in keys), return_exceptions=True)
+    for key, result in zip(keys, results):
+        # Sin el prefijo uuid de la clave
+        name = key.split("_", 1)[1] if storage.UPLOAD_KEY_RE.match(str(key)) else "documento"
+        if isinstance(result, Exception):
+            logger.warning(f"No se pudo extraer texto de {name}: {result}")
+            failed.append(name)
+            continue
+        chunks, hit = result
+        cache_hits += int(hit)
+        all_chunks.extend((name, i, c) for i, c in enumerate(chunks))
+
+    selected = select_chunks(all_chunks, query, token_budget)
+    context = "\n\n".join(f"[{name} #{pos + 1}]\n{text}" for name, pos, text in selected)
+
+    total_tokens = sum(estimate_tokens(c[2]) for c in all_chunks)
+    selected_tokens = sum(estimate_tokens(c[2]) for c in selected)
+    report = {
+        "documents": len(keys),
+        "failed": failed,
+        "cache_hits": cache_hits,
+        "chunks_total": len(all_chunks),
+        "chunks_selected": len(selected),
+        "tokens_total": total_tokens,
+        "tokens_selected": selected_tokens,
+        "tokens_saved": total_tokens - selected_tokens,
+        "seconds": time.perf_counter() - start,
+    }
+    metrics.observe("docs.ingest_s", report["seconds"])
+    metrics.observe("docs.tokens_saved", report["tokens_saved"])
+    logger.info(
+        f"Documentos procesados: {len(selected)}/{len(all_chunks)} chunks, "
+        f"{selected_tokens}/{total_tokens} tokens en {report['seconds']:.2f}s"
+    )
+    return context, report
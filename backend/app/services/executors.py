@@ -0,0 +1,137 @@
+"""
+executors.py
+Pools compartidos para sacar trabajo CPU-bound o bloqueante del event loop,
+y monitor de lag del loop.
+
+- run_in_thread(): E/S bloqueante y trabajo que libera el GIL (ficheros, base64, json.dump)
+- run_in_process(): trabajo puro de CPU en Python (extracción de documentos, procesado de HTML)
+- LoopMonitor: mide cuánto se retrasa el loop respecto a lo esperado (histograma loop.lag_s)
+  y, si una callback lo bloquea más de SLOW_CALLBACK_THRESHOLD_S, registra la pila del
+  hilo del loop en ese momento para saber quién lo está bloqueando.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_THREADS = int(os.getenv("EXECUTOR_THREADS", 16))
+EXECUTOR_PROCESSES = int(os.getenv("EXECUTOR_PROCESSES", 2))
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_LAG_INTERVAL_S = float(os.getenv("LOOP_LAG_INTERVAL_S", 0.5))
+SLOW_CALLBACK_THRESHOLD_S = float(os.getenv("SLOW_CALLBACK_THRESHOLD_S", 0.2))
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+metrics.register_buckets("loop.lag_s", LAG_BUCKETS)
+
+_thread_pool = None
+_process_pool = None
+_monitor = None
+
+
+def thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix="app-io")
+    return _thread_pool
+
+
+def process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=EXECUTOR_PROCESSES)
+    return _process_pool
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Ejecuta func en el pool de hilos compartido."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(thread_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def run_in_process(func, *args):
+    """Ejecuta func (función de módulo, argumentos serializables) en el pool de procesos."""
+    loop = asyncio.get_running_loop()
+    with metrics.timer(f"executor.process_s.{func.__name__}"):
+        return await loop.run_in_executor(process_pool(), func, *args)
+
+
+class LoopMonitor:
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_S, threshold: float = SLOW_CALLBACK_THRESHOLD_S):
+        self.interval = interval
+        self.threshold = threshold
+        self._heartbeat = time.perf_counter()
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    async def _tick(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            metrics.observe("loop.lag_s", lag)
+
+    def _watch(self):
+        """Hilo vigilante: si el loop no late en `threshold`, vuelca la pila del hilo del loop."""
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            stalled = time.perf_counter() - self._heartbeat - self.interval
+            if stalled < self.threshold:
+                reported = None
+                continue
+            if reported == self._heartbeat:
+                continue  # ya informado este bloqueo
+            reported = self._heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(pila no disponible)"
+            metrics.incr("loop.slow_callbacks")
+            logger.warning(f"Event loop bloqueado más de {stalled:.3f}s. Pila del loop:\n{stack}")
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Monitor del event loop activo (umbral {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+
+def start():
+    """Arranque de la app: pool de hilos por defecto del loop y monitor de lag."""
+    global _monitor
+    asyncio.get_running_loop().set_default_executor(thread_pool())
+    if LOOP_MONITOR_ENABLED and _monitor is None:
+        _monitor = LoopMonitor()
+        _monitor.start()
+
+
+def shutdown():
+    """Parada de la app: detiene el monitor y los pools."""
+    global _monitor, _thread_pool, _process_pool
+    if _monitor is not None:
+        _monitor.stop()
+        _monitor = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
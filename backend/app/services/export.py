@@ -0,0 +1,306 @@
+"""
+export.py
+Exportación en bloque de las páginas de una sesión (o de un rango de fechas) como
+archivo tar o zip, generado en streaming directamente desde el almacenamiento.
+
+Contenido del archivo (bajo una carpeta raíz export-<filtro>/):
+    pages/<page_id>.html    HTML de la página
+    pages/<page_id>.json    metadatos + HTML, tal y como están guardados
+    assets/<clave>          ficheros subidos con el prompt (metadata["assets"])
+    manifest.jsonl          una línea por página (al final: su tamaño se calcula sin leer nada)
+
+Memoria constante: los objetos se leen en trozos (StorageBackend.iter_chunks) y solo se
+mantienen en memoria los metadatos del índice.
+
+Rangos (descargas reanudables, solo tar): el tar es determinista para un mismo estado
+del almacenamiento (cabeceras construidas a partir de stat) y su tamaño se conoce de
+antemano, así que un Range salta directamente al segmento y al offset del objeto donde
+empieza, sin leer lo anterior. El ETag resume nombres, tamaños y versiones de los objetos:
+si algo cambia entre dos peticiones, If-Range no coincide y se sirve el archivo completo.
+El zip (stored + zip64 + data descriptors) se genera en streaming sin seek, pero su tamaño
+depende de lo que escribe zipfile, así que no admite rangos.
+"""
+
+import os
+import io
+import json
+import time
+import tarfile
+import zipfile
+import hashlib
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from app.services import file_storage, storage, metrics
+
+logger = logging.getLogger(__name__)
+
+EXPORT_MAX_PAGES = int(os.getenv("EXPORT_MAX_PAGES", 100_000))
+
+FORMATS = {"tar": "application/x-tar", "zip": "application/zip"}
+_BLOCK = tarfile.BLOCKSIZE
+
+
+@dataclass(frozen=True)
+class ExportEntry:
+    name: str           # ruta dentro del archivo
+    key: str            # clave en el almacenamiento
+    size: int
+    mtime: float
+    version: str
+
+
+class Export:
+    """Plan de una exportación: páginas seleccionadas y objetos (con su stat) a incluir."""
+
+    def __init__(self, pages: list, entries: list, label: str, filters: dict):
+        self.pages = pages
+        self.entries = entries
+        self.root = f"export-{label}"
+        self.filters = filters
+        digest = hashlib.sha256()
+        for entry in entries:
+            digest.update(f"{entry.name}\0{entry.size}\0{entry.version}\n".encode("utf-8"))
+        digest.update(json.dumps(filters, sort_keys=True).encode("utf-8"))
+        self.etag = digest.hexdigest()[:32]
+        self.manifest_size = sum(len(line) for line in self.manifest_lines())
+        self.mtime = max((e.mtime for e in entries), default=0.0)
+
+    def manifest_lines(self):
+        """Líneas (bytes) del manifest.jsonl; deterministas, se regeneran en vez de guardarlas."""
+        yield _json_line({"type": "export", "filters": self.filters, "pages": len(self.pages),
+                          "objects": len(self.entries), "bytes": sum(e.size for e in self.entries)})
+        for page in self.pages:
+            page_id = page["page_id"]
+            yield _json_line({
+                "type": "page",
+                "page_id": page_id,
+                "session_id": page.get("session_id"),
+                "site_type": page.get("site_type"),
+                "prompt": page.get("prompt"),
+                "created_at": page.get("created_at"),
+                "files": [f"pages/{page_id}.html", f"pages/{page_id}.json"],
+                "assets": [f"assets/{key}" for key in page.get("assets", [])],
+            })
+
+
+def _json_line(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, sort_keys=True) + "\n").encode("utf-8")
+
+
+def _parse_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def plan_export(session_id: str | None = None, since: str | None = None, until: str | None = None) -> Export:
+    """
+    Selecciona las páginas del índice (por sesión y/o created_at en [since, until)) y hace
+    stat de sus objetos. Los objetos que ya no existen se omiten.
+    """
+    start, end = _parse_date(since), _parse_date(until)
+    pages = []
+    for page in file_storage.list_pages(session_id):
+        created = _parse_date(page.get("created_at"))
+        if (start and (created is None or created < start)) or (end and (created is None or created >= end)):
+            continue
+        pages.append(page)
+    if len(pages) > EXPORT_MAX_PAGES:
+        raise ValueError(f"La exportación tiene {len(pages)} páginas (máximo {EXPORT_MAX_PAGES}); acota el rango")
+    pages.sort(key=lambda p: (p.get("created_at") or "", p["page_id"]))
+
+    backend = storage.backend()
+    entries, seen_assets = [], set()
+
+    def add(name: str, key: str):
+        try:
+            stat = backend.stat(key)
+        except storage.InvalidKey:
+            stat = None
+        if stat is None:
+            metrics.incr("export.missing_objects")
+            logger.warning(f"Exportación: el objeto {key} no existe; se omite")
+            return
+        entries.append(ExportEntry(name, key, stat.size, stat.mtime, str(stat.version)))
+
+    for page in pages:
+        add(f"pages/{page['page_id']}.html", page.get("html_file") or f"{page['page_id']}.html")
+        add(f"pages/{page['page_id']}.json", page.get("json_file") or f"{page['page_id']}.json")
+        for key in page.get("assets", []):
+            if key not in seen_assets:
+                seen_assets.add(key)
+                add(f"assets/{key}", key)
+
+    filters = {"session_id": session_id, "since": since, "until": until}
+    label = session_id or "-".join(v[:10] for v in (since, until) if v) or "all"
+    label = "".join(c for c in label if c.isalnum() or c in "-_") or "export"
+    return Export(pages, entries, label, filters)
+
+
+def _object_chunks(entry: ExportEntry, offset: int = 0):
+    """
+    Contenido de un objeto ajustado al tamaño planificado: si ha encogido o se ha borrado
+    desde plan_export, se rellena con ceros para que el archivo siga siendo válido.
+    """
+    remaining = entry.size - offset
+    deleted = False
+    try:
+        for chunk in storage.backend().iter_chunks(entry.key, offset):
+            if remaining <= 0:
+                break
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+    except FileNotFoundError:
+        deleted = True
+        metrics.incr("export.deleted_objects")
+        logger.warning(f"Exportación: {entry.key} se ha borrado durante la descarga")
+    if remaining > 0 and not deleted:
+        metrics.incr("export.size_mismatch")
+        logger.warning(f"Exportación: {entry.key} ha cambiado de tamaño durante la descarga")
+    while remaining > 0:
+        padding = min(remaining, storage.STREAM_CHUNK_BYTES)
+        remaining -= padding
+        yield bytes(padding)
+
+
+# ---------------------------------------------------------------------------
+# tar (ustar/pax): tamaño conocido de antemano y saltos directos en los rangos
+# ---------------------------------------------------------------------------
+
+def _tar_header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def _padding(size: int) -> int:
+    return -size % _BLOCK
+
+
+def _skip_bytes(chunks, offset: int):
+    """Descarta los primeros `offset` bytes de un iterador de trozos."""
+    for chunk in chunks:
+        if offset >= len(chunk):
+            offset -= len(chunk)
+            continue
+        yield chunk[offset:] if offset else chunk
+        offset = 0
+
+
+def tar_segments(export: Export) -> list:
+    """[(longitud, productor(offset) → trozos)] en orden; la suma de longitudes es el tamaño del tar."""
+    segments = []
+
+    def constant(data: bytes):
+        segments.append((len(data), lambda offset, data=data: iter((data[offset:],))))
+
+    def content(size: int, producer):
+        segments.append((size, producer))
+        if _padding(size):
+            constant(bytes(_padding(size)))
+
+    for entry in export.entries:
+        constant(_tar_header(f"{export.root}/{entry.name}", entry.size, entry.mtime))
+        content(entry.size, lambda offset, entry=entry: _object_chunks(entry, offset))
+    constant(_tar_header(f"{export.root}/manifest.jsonl", export.manifest_size, export.mtime))
+    content(export.manifest_size, lambda offset: _skip_bytes(export.manifest_lines(), offset))
+    constant(bytes(2 * _BLOCK))
+    return segments
+
+
+def tar_size(segments: list) -> int:
+    return sum(length for length, _ in segments)
+
+
+def iter_tar(segments: list, start: int = 0, end: int | None = None):
+    """Bytes [start, end] (inclusive) del tar, leyendo solo los segmentos que los cubren."""
+    end = tar_size(segments) - 1 if end is None else end
+    position = 0
+    for length, producer in segments:
+        seg_start, seg_end = position, position + length - 1
+        position += length
+        if seg_end < start or length == 0:
+            continue
+        if seg_start > end:
+            return
+        offset = max(0, start - seg_start)
+        remaining = min(seg_end, end) - (seg_start + offset) + 1
+        for chunk in producer(offset):
+            if remaining <= 0:
+                break
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+
+
+# ---------------------------------------------------------------------------
+# zip (stored, zip64, data descriptors): streaming sin seek
+# ---------------------------------------------------------------------------
+
+class _Sink(io.RawIOBase):
+    """Destino no posicionable para zipfile: acumula lo escrito hasta que se recoge."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _zip_info(name: str, mtime: float, size: int) -> zipfile.ZipInfo:
+    stamp = datetime.fromtimestamp(max(mtime, 315532800), tz=timezone.utc)   # zip no admite < 1980
+    info = zipfile.ZipInfo(name, date_time=stamp.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    info.file_size = size
+    return info
+
+
+def iter_zip(export: Export):
+    """Bytes del zip, a medida que zipfile los escribe."""
+
+    def generate():
+        sink = _Sink()
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+            files = [(e.name, e.mtime, e.size, lambda e=e: _object_chunks(e)) for e in export.entries]
+            files.append(("manifest.jsonl", export.mtime, export.manifest_size, export.manifest_lines))
+            for name, mtime, size, chunks in files:
+                with zf.open(_zip_info(f"{export.root}/{name}", mtime, size), "w", force_zip64=True) as out:
+                    for chunk in chunks():
+                        out.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                yield sink.drain()
+        yield sink.drain()
+
+    yield from (chunk for chunk in generate() if chunk)
+
+
+def measured(chunks, label: str):
+    """Envuelve el stream para registrar bytes, duración y throughput (también si el cliente corta)."""
+    sent, start = 0, time.perf_counter()
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        metrics.incr("export.bytes", sent)
+        metrics.observe("export.seconds", elapsed)
+        metrics.observe("export.mb_per_s", sent / elapsed / 1e6)
+        logger.info(f"Exportación {label}: {sent / 1e6:.1f} MB en {elapsed:.1f}s ({sent / elapsed / 1e6:.1f} MB/s)")
@@ -5,12 +5,28 @@ Guarda cada página como .html y .json, y mantiene un índice global index.json.
 
 Identificador único: {fecha}_{tipo-sitio}_{session_corta}
 Ejemplo: 2026-02-19_landing_a3f2b1
+
+Seguro con varios workers: los page_id se reservan en shared_state y la
+actualización de index.json se hace bajo un lock entre procesos.
+
+Los .html/.json se guardan a través del backend de almacenamiento (storage.py:
+local con fan-out o S3); index.json sigue en disco local. El HTML descargado de Stitch
+ya está en el almacenamiento (stitch/{sha256}.html): save_page lo reutiliza como .html
+de la página en vez de escribir otra copia.
+
+Lecturas con cache en memoria: el índice (con un índice secundario por sesión)
+se invalida cuando cambia index.json (inodo/mtime/tamaño, así que también ve las
+escrituras de otros workers) y las páginas .json se guardan en un LRU acotado por bytes.
 """
 
 import os
 import json
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime, timezone
+from app.services import shared_state, search, metrics, storage
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +34,24 @@ logger = logging.getLogger(__name__)
 # Sube dos niveles desde app/services/ hasta la raíz, luego /uploads
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'uploads'))
 INDEX_FILE = os.path.join(BASE_DIR, 'index.json')
+# Versiones anteriores descargaban a disco aquí (solo lo limpia la retención)
+DOWNLOADS_DIR = os.path.join(BASE_DIR, 'downloads')
+# HTML descargado desde Stitch en el backend de almacenamiento: {prefijo}{sha256}.html
+DOWNLOADS_PREFIX = "stitch/"
+
+
+def download_key(html_bytes: bytes) -> str:
+    """Clave con la que http_client guarda una descarga con este contenido."""
+    return f"{DOWNLOADS_PREFIX}{hashlib.sha256(html_bytes).hexdigest()}.html"
+
+# Límites del LRU de páginas completas (metadatos + HTML)
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+PAGE_CACHE_MAX_ENTRIES = int(os.getenv("PAGE_CACHE_MAX_ENTRIES", 512))
+
+_cache_lock = threading.Lock()
+_index_cache = {"key": None, "entries": [], "by_id": {}, "by_session": {}}
+_page_cache: OrderedDict = OrderedDict()   # page_id → (file_key, data, nbytes)
+_page_cache_bytes = 0
 
 
 def _ensure_dirs():
@@ -40,19 +74,11 @@ def _build_page_id(site_type: str, session_id: str) -> str:
 
 def _make_unique_id(page_id: str) -> str:
     """
-    Si el page_id ya existe en el índice, añade un sufijo numérico.
+    Si el page_id ya existe (en el índice o reservado por otro worker), añade un sufijo numérico.
     Ejemplo: 2026-02-19_landing_a3f2b1 → 2026-02-19_landing_a3f2b1_2
     """
-    index = _load_index()
-    existing_ids = {entry["page_id"] for entry in index}
-
-    if page_id not in existing_ids:
-        return page_id
-
-    counter = 2
-    while f"{page_id}_{counter}" in existing_ids:
-        counter += 1
-    return f"{page_id}_{counter}"
+    existing_ids = set(_cached_index()["by_id"])
+    return shared_state.allocate_id("page_id", page_id, taken=existing_ids)
 
 
 def _load_index() -> list:
@@ -68,23 +94,39 @@ def _load_index() -> list:
 
 
 def _save_index(index: list):
-    """Guarda el índice global en index.json."""
+    """
+    Guarda el índice global en index.json.
+    Escribe a un fichero temporal y lo renombra para que ningún lector vea un JSON a medias.
+    """
+    tmp_file = f"{INDEX_FILE}.{os.getpid()}.tmp"
     try:
-        with open(INDEX_FILE, "w", encoding="utf-8") as f:
+        with open(tmp_file, "w", encoding="utf-8") as f:
             json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, INDEX_FILE)
     except IOError as e:
         logger.error(f"Error escribiendo index.json: {e}")
 
 
+def _append_to_index(metadata: dict) -> int:
+    """Añade una entrada al índice bajo lock entre procesos. Devuelve el total de páginas."""
+    with shared_state.file_lock("index"):
+        index = _load_index()
+        index.append(metadata)
+        _save_index(index)
+    return len(index)
+
+
 def save_page(
     html: str,
     prompt: str,
     site_type: str,
     session_id: str,
+    assets: list | None = None,
 ) -> dict:
     """
-    Guarda la página generada como .html y .json en uploads/.
+    Guarda la página generada como .html y .json en el backend de almacenamiento.
     Actualiza el índice global index.json.
+    `assets`: claves del almacenamiento de los ficheros subidos con el prompt (se exportan con la página).
 
     Devuelve un dict con los metadatos del archivo guardado.
     """
@@ -94,11 +136,14 @@ def save_page(
     base_id = _build_page_id(site_type, session_id)
     page_id = _make_unique_id(base_id)
 
-    # Rutas de archivo
+    # Claves en el backend de almacenamiento
     html_filename = f"{page_id}.html"
     json_filename = f"{page_id}.json"
-    html_path = os.path.join(BASE_DIR, html_filename)
-    json_path = os.path.join(BASE_DIR, json_filename)
+    backend = storage.backend()
+    html_bytes = html.encode("utf-8")
+    downloaded = download_key(html_bytes)
+    if backend.stat(downloaded) is not None:
+        html_filename = downloaded   # descargado de Stitch: ya está en el almacenamiento
 
     # Metadatos
     now = datetime.now(timezone.utc).isoformat()
@@ -111,57 +156,189 @@ def save_page(
         "html_file": html_filename,
         "json_file": json_filename,
     }
+    if assets:
+        metadata["assets"] = list(assets)
 
     # Guardar .html
-    try:
-        with open(html_path, "w", encoding="utf-8") as f:
-            f.write(html)
-        logger.info(f"HTML guardado: {html_filename}")
-    except IOError as e:
-        logger.error(f"Error guardando HTML: {e}")
-        raise
+    if html_filename != downloaded:
+        try:
+            backend.put(html_filename, html_bytes, content_type="text/html; charset=utf-8")
+            logger.info(f"HTML guardado: {html_filename}")
+        except Exception as e:
+            logger.error(f"Error guardando HTML: {e}")
+            raise
 
     # Guardar .json (metadatos + html embebido)
     json_data = {**metadata, "html": html}
     try:
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
+        backend.put(
+            json_filename,
+            json.dumps(json_data, ensure_ascii=False, indent=2).encode("utf-8"),
+            content_type="application/json",
+        )
         logger.info(f"JSON guardado: {json_filename}")
-    except IOError as e:
+    except Exception as e:
         logger.error(f"Error guardando JSON: {e}")
         raise
 
     # Actualizar índice global
-    index = _load_index()
-    index.append(metadata)
-    _save_index(index)
-    logger.info(f"Índice actualizado: {len(index)} páginas registradas")
+    total = _append_to_index(metadata)
+    logger.info(f"Índice actualizado: {total} páginas registradas")
+
+    # Indexado incremental para búsqueda de texto completo
+    search.index_page(metadata, html)
 
     return metadata
 
 
+def _file_key(path: str):
+    """Identifica una versión de un fichero; cambia con cada reescritura (os.replace cambia el inodo)."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _cached_index() -> dict:
+    """Índice en memoria (+ índices secundarios por page_id y session_id), recargado si index.json cambió."""
+    key = _file_key(INDEX_FILE)
+    with _cache_lock:
+        if key is not None and key == _index_cache["key"]:
+            metrics.incr("file_storage.index_cache.hits")
+            return _index_cache
+
+    metrics.incr("file_storage.index_cache.misses")
+    entries = _load_index()
+    by_id, by_session = {}, {}
+    for entry in entries:
+        by_id[entry["page_id"]] = entry
+        by_session.setdefault(entry.get("session_id"), []).append(entry)
+
+    with _cache_lock:
+        _index_cache.update(key=key, entries=entries, by_id=by_id, by_session=by_session)
+        return _index_cache
+
+
+def _copy_entry(entry: dict) -> dict:
+    """Copia de una entrada cacheada: quien la modifique no toca la cache (ni sus listas)."""
+    return {k: list(v) if isinstance(v, list) else v for k, v in entry.items()}
+
+
 def list_pages(session_id: str = None) -> list:
     """
     Lista todas las páginas del índice.
     Si se pasa session_id, filtra por esa sesión.
     """
-    index = _load_index()
-    if session_id:
-        return [p for p in index if p.get("session_id") == session_id]
-    return index
+    cache = _cached_index()
+    entries = cache["by_session"].get(session_id, []) if session_id else cache["entries"]
+    return [_copy_entry(entry) for entry in entries]
+
+
+def get_page_meta(page_id: str) -> dict | None:
+    """Metadatos de una página sin leer su HTML (solo índice en memoria)."""
+    entry = _cached_index()["by_id"].get(page_id)
+    return _copy_entry(entry) if entry is not None else None
+
+
+def _evict_pages():
+    """Expulsa las páginas menos usadas hasta cumplir los límites. Requiere _cache_lock."""
+    global _page_cache_bytes
+    while _page_cache and (
+        _page_cache_bytes > PAGE_CACHE_MAX_BYTES or len(_page_cache) > PAGE_CACHE_MAX_ENTRIES
+    ):
+        _, (_, _, nbytes) = _page_cache.popitem(last=False)
+        _page_cache_bytes -= nbytes
+        metrics.incr("file_storage.page_cache.evictions")
 
 
 def get_page(page_id: str) -> dict | None:
     """
     Devuelve los metadatos + HTML de una página por su page_id.
-    Lee el .json correspondiente.
+    Lee el .json correspondiente (o lo sirve del LRU si no ha cambiado en el almacenamiento).
     """
-    json_path = os.path.join(BASE_DIR, f"{page_id}.json")
-    if not os.path.exists(json_path):
+    global _page_cache_bytes
+    backend = storage.backend()
+    with _cache_lock:
+        cached = _page_cache.get(page_id)
+
+    # Una sola operación: valida la versión cacheada y, si ha cambiado, trae el contenido
+    try:
+        stat, raw = backend.get_if_changed(f"{page_id}.json", cached[0] if cached else None)
+    except IOError as e:
+        logger.error(f"Error leyendo {page_id}.json: {e}")
         return None
+    if stat is None:
+        return None
+    if raw is None:
+        with _cache_lock:
+            if page_id in _page_cache:
+                _page_cache.move_to_end(page_id)
+        metrics.incr("file_storage.page_cache.hits")
+        return _copy_entry(cached[1])
+
+    metrics.incr("file_storage.page_cache.misses")
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
         logger.error(f"Error leyendo {page_id}.json: {e}")
         return None
+
+    key = stat.version
+    nbytes = len(raw)
+    if nbytes <= PAGE_CACHE_MAX_BYTES:
+        with _cache_lock:
+            previous = _page_cache.pop(page_id, None)
+            if previous is not None:
+                _page_cache_bytes -= previous[2]
+            _page_cache[page_id] = (key, data, nbytes)
+            _page_cache_bytes += nbytes
+            _evict_pages()
+            metrics.set_gauge("file_storage.page_cache.bytes", _page_cache_bytes)
+    return _copy_entry(data)
+
+
+def cache_stats() -> dict:
+    """Aciertos/fallos y ocupación de las caches del file store."""
+    counters = metrics.snapshot()["counters"]
+    stats = {}
+    for name in ("index_cache", "page_cache"):
+        hits = counters.get(f"file_storage.{name}.hits", 0)
+        misses = counters.get(f"file_storage.{name}.misses", 0)
+        stats[name] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+        }
+    with _cache_lock:
+        stats["page_cache"].update(entries=len(_page_cache), bytes=_page_cache_bytes)
+    return stats
+
+
+
+def remove_pages(page_ids: list) -> int:
+    """
+    Elimina páginas del índice, del índice de búsqueda y sus .html/.json.
+    Devuelve el número de entradas eliminadas del índice.
+    """
+    ids = set(page_ids)
+    if not ids:
+        return 0
+
+    with shared_state.file_lock("index"):
+        index = _load_index()
+        removed = [p for p in index if p["page_id"] in ids]
+        kept = [p for p in index if p["page_id"] not in ids]
+        _save_index(kept)
+    # Una descarga de Stitch puede ser el .html de varias páginas con el mismo contenido
+    still_used = {p.get("html_file") for p in kept}
+
+    backend = storage.backend()
+    for meta in removed:
+        for filename in (meta.get("html_file"), meta.get("json_file")):
+            if filename and filename not in still_used:
+                backend.delete(filename)
+        search.remove_page(meta["page_id"])
+
+    logger.info(f"Páginas eliminadas del almacenamiento: {len(removed)}")
+    return len(removed)
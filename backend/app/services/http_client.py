@@ -0,0 +1,119 @@
+"""
+http_client.py
+Cliente HTTP compartido por el proceso (pool de conexiones + keep-alive, HTTP/2 si
+está instalado `h2`) para descargar los artefactos que devuelve Stitch.
+
+Las descargas se leen por trozos (el límite de tamaño se aplica mientras llegan) y se
+acumulan en memoria: quien descarga necesita el HTML como texto y DOWNLOAD_MAX_BYTES acota
+lo que se retiene. Después se guardan en el backend de almacenamiento (una sola copia, con
+clave {prefijo}{sha256}{sufijo}) con una única escritura en el pool de hilos. El cliente
+se cierra en el shutdown de la app.
+"""
+
+import os
+import time
+import hashlib
+import logging
+from dataclasses import dataclass
+from app.services import metrics, storage, executors
+
+logger = logging.getLogger(__name__)
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", 20 * 1024 * 1024))
+
+_client = None
+
+
+class DownloadTooLarge(Exception):
+    """La respuesta supera DOWNLOAD_MAX_BYTES."""
+
+
+@dataclass
+class DownloadResult:
+    key: str           # clave en el backend de almacenamiento
+    size: int
+    sha256: str
+    seconds: float
+    data: bytes        # contenido (quien descarga el HTML lo necesita como texto)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client():
+    """Devuelve el AsyncClient compartido, creándolo en el primer uso."""
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx
+        http2 = _http2_available()
+        _client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            follow_redirects=True,
+        )
+        logger.info(f"Cliente HTTP compartido creado (http2={http2})")
+    return _client
+
+
+async def close():
+    """Cierra el cliente compartido (shutdown de la app)."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+async def download_to_storage(url: str, prefix: str = "", suffix: str = "", max_bytes: int = DOWNLOAD_MAX_BYTES) -> DownloadResult:
+    """
+    Descarga `url` y la guarda en el backend de almacenamiento con clave {prefix}{sha256}{suffix}
+    (descargas idénticas comparten objeto). El contenido se devuelve en el resultado, así que
+    no vuelve a leerse del almacenamiento. Si la descarga falla no se escribe nada.
+    Lanza DownloadTooLarge si se supera max_bytes y httpx.HTTPStatusError si la respuesta no es 2xx.
+    """
+    digest = hashlib.sha256()
+    data = bytearray()
+    start = time.perf_counter()
+
+    try:
+        async with get_client().stream("GET", url) as response:
+            response.raise_for_status()
+            declared = response.headers.get("content-length")
+            if declared and int(declared) > max_bytes:
+                raise DownloadTooLarge(f"{declared} bytes > {max_bytes}")
+            async for chunk in response.aiter_bytes():
+                if len(data) + len(chunk) > max_bytes:
+                    raise DownloadTooLarge(f"más de {max_bytes} bytes")
+                digest.update(chunk)
+                data += chunk
+        checksum = digest.hexdigest()
+        key = f"{prefix}{checksum}{suffix}"
+        data = bytes(data)
+        await executors.run_in_thread(storage.backend().put, key, data, response.headers.get("content-type"))
+    except DownloadTooLarge:
+        metrics.incr("http.download.too_large")
+        raise
+    except Exception:
+        metrics.incr("http.download.errors")
+        raise
+
+    elapsed = time.perf_counter() - start
+    size = len(data)
+    metrics.observe("http.download_s", elapsed)
+    metrics.observe("http.download_bytes", size)
+    logger.info(f"Descargado {url} → {key} ({size} bytes en {elapsed:.2f}s)")
+    return DownloadResult(key=key, size=size, sha256=checksum, seconds=elapsed, data=data)
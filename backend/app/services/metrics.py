@@ -0,0 +1,117 @@
+"""
+metrics.py
+Métricas en memoria del proceso: contadores, gauges y distribuciones (tiempos, tamaños).
+Se exponen como JSON en GET /metrics.
+
+Cada worker tiene sus propias métricas; el agregado entre procesos lo hace quien las recoge.
+"""
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Nº máximo de muestras que se guardan por distribución (ventana deslizante)
+MAX_SAMPLES = 2048
+
+# Referencia para las métricas de arranque (el módulo se importa al principio del proceso)
+STARTED_AT = time.perf_counter()
+
+_lock = threading.Lock()
+_counters: dict = {}
+_gauges: dict = {}
+_samples: dict = {}
+_totals: dict = {}
+_buckets: dict = {}        # name → (límites, cuentas acumuladas por límite)
+
+
+def incr(name: str, amount: float = 1):
+    """Incrementa un contador."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name: str, value: float):
+    """Fija el valor actual de un gauge."""
+    with _lock:
+        _gauges[name] = value
+
+
+def register_buckets(name: str, bounds: tuple):
+    """Activa un histograma de buckets fijos (desde el arranque) para la distribución `name`."""
+    with _lock:
+        _buckets[name] = (tuple(bounds), [0] * len(bounds))
+
+
+def observe(name: str, value: float):
+    """Añade una muestra a la distribución `name`."""
+    with _lock:
+        if name not in _samples:
+            _samples[name] = deque(maxlen=MAX_SAMPLES)
+            _totals[name] = [0, 0.0]
+        _samples[name].append(value)
+        _totals[name][0] += 1
+        _totals[name][1] += value
+        if name in _buckets:
+            bounds, counts = _buckets[name]
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[i] += 1
+
+
+@contextmanager
+def timer(name: str):
+    """Mide el tiempo (segundos) del bloque y lo registra en la distribución `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def percentile(name: str, q: float) -> float | None:
+    """Percentil q (0-100) de las últimas muestras de `name`, o None si no hay muestras."""
+    with _lock:
+        values = sorted(_samples.get(name, ()))
+    if not values:
+        return None
+    idx = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _summary(values: list, count: int, total: float) -> dict:
+    values = sorted(values)
+    n = len(values)
+
+    def pct(q):
+        return values[min(n - 1, int(round(q / 100 * (n - 1))))]
+
+    return {
+        "count": count,
+        "sum": total,
+        "avg": total / count if count else 0,
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+        "max": values[-1],
+    }
+
+
+def snapshot() -> dict:
+    """Copia de todas las métricas, con resumen de percentiles para las distribuciones."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        samples = {k: list(v) for k, v in _samples.items() if v}
+        totals = {k: tuple(v) for k, v in _totals.items()}
+        buckets = {k: dict(zip(b, c)) for k, (b, c) in _buckets.items()}
+    distributions = {k: _summary(v, *totals[k]) for k, v in samples.items()}
+    for name, counts in buckets.items():
+        if name in distributions:
+            # Cuentas acumuladas (≤ límite) desde el arranque, estilo Prometheus
+            distributions[name]["buckets"] = {f"le_{b}": n for b, n in counts.items()}
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "distributions": distributions,
+    }
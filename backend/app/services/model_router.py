@@ -0,0 +1,141 @@
+"""
+model_router.py
+Elige el tier de modelo (modelo de Gemini + tools) para cada generación según la
+complejidad del WebPlanDTO, y desplaza tráfico a un tier más rápido cuando el p95
+observado de un tier supera el SLO.
+
+Tiers (MODEL_TIERS, JSON) ordenados del más rápido/barato al más capaz:
+    [{"name": "lite",  "model": "gemini-2.5-flash-lite", "tools": false, "max_score": 3},
+     {"name": "flash", "model": "gemini-2.5-flash",      "tools": true,  "max_score": 8},
+     {"name": "pro",   "model": "gemini-2.5-pro",        "tools": true}]
+
+Sin MODEL_TIERS hay un único tier (gemini-2.5-flash con Stitch), el comportamiento de siempre.
+
+Puntuación = nº de secciones + ROUTER_ATTACHMENT_WEIGHT por imagen/documento
+             + ROUTER_EDIT_WEIGHT si es una edición de una página existente
+               (base_page_id: el chat la pone cuando el mensaje pide cambios, ver chat._plan).
+El primer tier cuyo max_score la cubre es el elegido (sin max_score: sin límite).
+
+SLO: cada tier lleva una fracción de desvío (0..1). Si su p95 (de todas las generaciones,
+también las fallidas o descartadas por el output guard) supera ROUTER_P95_SLO_S,
+la fracción sube ROUTER_SHIFT_STEP y esa parte de sus peticiones va al tier anterior;
+cuando el p95 baja de ROUTER_RECOVER_RATIO × SLO, la fracción baja. Los runners
+de cada tier se registran con set_runner(), así se pueden sustituir por dobles en tests.
+"""
+
+import os
+import json
+import random
+import logging
+from dataclasses import dataclass
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIERS = [{"name": "flash", "model": "gemini-2.5-flash", "tools": True}]
+
+ROUTER_P95_SLO_S = float(os.getenv("ROUTER_P95_SLO_S", 60))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", 20))
+ROUTER_SHIFT_STEP = float(os.getenv("ROUTER_SHIFT_STEP", 0.1))
+ROUTER_MAX_SHIFT = float(os.getenv("ROUTER_MAX_SHIFT", 0.8))
+ROUTER_RECOVER_RATIO = float(os.getenv("ROUTER_RECOVER_RATIO", 0.8))
+ROUTER_ATTACHMENT_WEIGHT = float(os.getenv("ROUTER_ATTACHMENT_WEIGHT", 2))
+ROUTER_EDIT_WEIGHT = float(os.getenv("ROUTER_EDIT_WEIGHT", 2))
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    model: str
+    tools: bool = True
+    max_score: float | None = None
+
+
+def _load_tiers() -> list:
+    raw = os.getenv("MODEL_TIERS")
+    try:
+        specs = json.loads(raw) if raw else DEFAULT_TIERS
+    except ValueError as e:
+        logger.error(f"MODEL_TIERS no es JSON válido ({e}); se usa el tier por defecto")
+        specs = DEFAULT_TIERS
+    return [Tier(**spec) for spec in specs]
+
+
+def complexity(plan) -> float:
+    """Puntuación de complejidad de un plan (ver cabecera del módulo)."""
+    attachments = len(getattr(plan, "images", None) or []) + len(getattr(plan, "docs", None) or [])
+    score = len(plan.sections) + ROUTER_ATTACHMENT_WEIGHT * attachments
+    if getattr(plan, "base_page_id", None):
+        score += ROUTER_EDIT_WEIGHT
+    return score
+
+
+class ModelRouter:
+
+    def __init__(self, tiers: list | None = None, slo_s: float = ROUTER_P95_SLO_S, min_samples: int = ROUTER_MIN_SAMPLES):
+        self.tiers = tiers or _load_tiers()
+        self.slo_s = slo_s
+        self.min_samples = min_samples
+        self.shift = {t.name: 0.0 for t in self.tiers}   # fracción desviada al tier anterior
+        self.runners: dict = {}                           # tier → runner (o doble de test)
+        self._observed: dict = {t.name: 0 for t in self.tiers}
+
+    @property
+    def default(self) -> Tier:
+        return self.tiers[0]
+
+    def tier(self, name: str) -> Tier:
+        return next(t for t in self.tiers if t.name == name)
+
+    def set_runner(self, tier_name: str, runner):
+        self.runners[tier_name] = runner
+
+    def choose(self, plan) -> Tier:
+        """Tier para `plan`: por complejidad y, si su p95 está fuera de SLO, quizá uno más rápido."""
+        score = complexity(plan)
+        index = next(
+            (i for i, t in enumerate(self.tiers) if t.max_score is None or score <= t.max_score),
+            len(self.tiers) - 1,
+        )
+        if index > 0 and random.random() < self.shift[self.tiers[index].name]:
+            metrics.incr(f"router.shifted.{self.tiers[index].name}")
+            index -= 1
+        tier = self.tiers[index]
+        metrics.incr(f"router.requests.{tier.name}")
+        return tier
+
+    def observe(self, tier: Tier, seconds: float):
+        """Registra la latencia de una generación y reajusta el desvío del tier."""
+        name = f"router.latency_s.{tier.name}"
+        metrics.observe(name, seconds)
+        self._observed[tier.name] += 1
+        # Se reajusta cada min_samples generaciones nuevas del tier
+        if self._observed[tier.name] % self.min_samples:
+            return
+        p95 = metrics.percentile(name, 95)
+        current = self.shift[tier.name]
+        if p95 > self.slo_s:
+            self.shift[tier.name] = min(ROUTER_MAX_SHIFT, current + ROUTER_SHIFT_STEP)
+        elif p95 < self.slo_s * ROUTER_RECOVER_RATIO:
+            self.shift[tier.name] = max(0.0, current - ROUTER_SHIFT_STEP)
+        if self.shift[tier.name] != current:
+            logger.info(
+                f"Tier {tier.name}: p95 {p95:.1f}s (SLO {self.slo_s:.0f}s), "
+                f"desvío {current:.0%} → {self.shift[tier.name]:.0%}"
+            )
+        metrics.set_gauge(f"router.shift.{tier.name}", self.shift[tier.name])
+
+    def stats(self) -> dict:
+        return {
+            t.name: {
+                "model": t.model,
+                "tools": t.tools,
+                "max_score": t.max_score,
+                "shift": self.shift[t.name],
+                "p95_s": metrics.percentile(f"router.latency_s.{t.name}", 95),
+            }
+            for t in self.tiers
+        }
+
+
+router = ModelRouter()
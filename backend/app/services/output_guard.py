@@ -0,0 +1,97 @@
+"""
+output_guard.py
+Vigila la respuesta del modelo mientras llega para cortar cuanto antes las generaciones
+que no van a servir, en vez de pagar la respuesta entera y guardar basura:
+
+- not_html:    el texto no empieza por <!DOCTYPE html> / <html> (p. ej. describe la página)
+- too_large:   el HTML supera GUARD_MAX_HTML_BYTES
+- tool_rounds: el agente encadena más de GUARD_MAX_TOOL_ROUNDS llamadas a tools
+
+Si Stitch devuelve una URL de descarga, el texto del modelo no se usa y no se exige que sea HTML.
+"""
+
+import os
+import re
+from app.services import metrics
+
+GUARD_ENABLED = os.getenv("GUARD_ENABLED", "true").lower() == "true"
+GUARD_MAX_HTML_BYTES = int(os.getenv("GUARD_MAX_HTML_BYTES", 2 * 1024 * 1024))
+GUARD_MAX_TOOL_ROUNDS = int(os.getenv("GUARD_MAX_TOOL_ROUNDS", 6))
+# Caracteres (sin espacios ni ``` iniciales) que hacen falta para decidir si es HTML
+GUARD_PREFIX_CHARS = int(os.getenv("GUARD_PREFIX_CHARS", 256))
+GUARD_MAX_ATTEMPTS = max(1, int(os.getenv("GUARD_MAX_ATTEMPTS", 2)))
+
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*")
+_HTML_START_RE = re.compile(r"^(<!doctype\s+html|<html)", re.IGNORECASE)
+
+
+class OutputRejected(Exception):
+    """La respuesta del modelo no pasa el guard; `reason` es la causa (not_html, too_large, tool_rounds)."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def strip_fence(text: str) -> str:
+    """Quita el bloque ```html ... ``` con el que a veces el modelo envuelve el código."""
+    text = _FENCE_RE.sub("", text, count=1)
+    return re.sub(r"\s*```\s*$", "", text)
+
+
+class OutputGuard:
+    """Estado del guard para un intento de generación."""
+
+    def __init__(
+        self,
+        max_bytes: int = GUARD_MAX_HTML_BYTES,
+        max_tool_rounds: int = GUARD_MAX_TOOL_ROUNDS,
+        prefix_chars: int = GUARD_PREFIX_CHARS,
+        enabled: bool = GUARD_ENABLED,
+    ):
+        self.max_bytes = max_bytes
+        self.max_tool_rounds = max_tool_rounds
+        self.prefix_chars = prefix_chars
+        self.enabled = enabled
+        self.tool_rounds = 0
+        self.size = 0
+        self.has_download = False
+        self._prefix_ok = False
+        self._head = ""
+
+    def _reject(self, reason: str, message: str):
+        metrics.incr(f"guard.aborted.{reason}")
+        raise OutputRejected(reason, message)
+
+    def on_tool_call(self):
+        self.tool_rounds += 1
+        # El texto previo a una tool call era el modelo "pensando en voz alta", no la respuesta
+        self._head = ""
+        if self.enabled and self.tool_rounds > self.max_tool_rounds:
+            self._reject("tool_rounds", f"Más de {self.max_tool_rounds} llamadas a tools")
+
+    def on_download_url(self):
+        self.has_download = True
+
+    def on_text(self, chunk: str):
+        """Trozo nuevo del texto de la respuesta (parcial en streaming, o el final completo)."""
+        if not self.enabled:
+            return
+        self.size += len(chunk.encode("utf-8"))
+        if self.size > self.max_bytes:
+            self._reject("too_large", f"La respuesta supera {self.max_bytes} bytes")
+        if self._prefix_ok or self.has_download:
+            return
+        self._head += chunk
+        head = _FENCE_RE.sub("", self._head, count=1).lstrip()
+        if _HTML_START_RE.match(head):
+            self._prefix_ok = True
+        elif len(head) >= self.prefix_chars:
+            self._reject("not_html", f"La respuesta no es un documento HTML: {head[:60]!r}")
+
+    def finish(self, text: str):
+        """Comprobación final con el texto completo (por si era más corto que el prefijo)."""
+        if not self.enabled or self.has_download or self._prefix_ok:
+            return
+        if not _HTML_START_RE.match(strip_fence(text).lstrip()):
+            self._reject("not_html", f"La respuesta no es un documento HTML: {text.strip()[:60]!r}")
@@ -5,5 +5,5 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class PageGenerator:
-    async def generate(self, plan):
-        return await generate_with_adk(plan)
\ No newline at end of file
+    async def generate(self, plan, on_progress=None):
+        return await generate_with_adk(plan, on_progress=on_progress)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+responses.py
+Serialización rápida de las respuestas grandes (HTML de 100+ KB dentro de JSON).
+
+- dumps(): orjson si está instalado; si no, json estándar con el mismo formato compacto
+- FastJSONResponse: respuesta por defecto de la app (default_response_class)
+- page_response(): resultado de una generación sin pasar por response_model (no se
+  vuelve a validar ni a recorrer el DTO) y, si el cliente lo pide con ?format=html o
+  Accept: text/html, el HTML en crudo sin envolverlo en JSON
+
+Benchmark de CPU y latencia de serialización por tamaño de respuesta:
+    python -m app.services.responses bench [--iterations 200]
+"""
+
+import sys
+import json
+import time
+from fastapi import Request
+from fastapi.responses import JSONResponse, HTMLResponse, Response
+
+_orjson = None
+
+
+def _load_orjson():
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson
+
+
+def dumps(obj) -> bytes:
+    """JSON compacto en UTF-8 (sin escapar los caracteres no ASCII)."""
+    orjson = _load_orjson()
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+
+    def render(self, content) -> bytes:
+        if hasattr(content, "model_dump"):
+            content = content.model_dump()
+        return dumps(content)
+
+
+def _accept_ranges(accept: str) -> list:
+    """[(tipo, subtipo, q)] de una cabecera Accept; los rangos mal formados se ignoran."""
+    ranges = []
+    for part in accept.split(","):
+        media, *params = part.split(";")
+        media_type, _, subtype = media.strip().lower().partition("/")
+        if not media_type or not subtype:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = min(1.0, max(0.0, float(value.strip())))
+                except ValueError:
+                    q = 0.0
+        ranges.append((media_type, subtype, q))
+    return ranges
+
+
+def _quality(ranges: list, media_type: str, subtype: str) -> float:
+    """q del rango más específico que cubre media_type/subtype (0 si ninguno lo cubre)."""
+    best, best_q = -1, 0.0
+    for range_type, range_subtype, q in ranges:
+        if range_type == media_type and range_subtype == subtype:
+            specificity = 2
+        elif range_type == media_type and range_subtype == "*":
+            specificity = 1
+        elif range_type == "*" and range_subtype == "*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best:
+            best, best_q = specificity, q
+    return best_q
+
+
+def wants_html(request: Request) -> bool:
+    """
+    El cliente prefiere el HTML en crudo: ?format=html, o un Accept que da a text/html más
+    q que a application/json (con los comodines). Si empatan, JSON (el formato por defecto).
+    """
+    if request.query_params.get("format") == "html":
+        return True
+    ranges = _accept_ranges(request.headers.get("accept", ""))
+    return _quality(ranges, "text", "html") > _quality(ranges, "application", "json")
+
+
+def page_response(request: Request, result, status_code: int = 200) -> Response:
+    """Respuesta de GeneratedPageDTO: JSON con orjson o HTML en crudo (framework en X-Framework)."""
+    if wants_html(request):
+        return HTMLResponse(result.html, status_code=status_code, headers={"X-Framework": result.framework})
+    return FastJSONResponse({"html": result.html, "framework": result.framework}, status_code=status_code)
+
+
+def _bench(iterations: int = 200, sizes: tuple = (1_000, 10_000, 100_000, 1_000_000)) -> dict:
+    """
+    Compara, por tamaño de HTML, el camino anterior (validar con response_model +
+    jsonable_encoder + json estándar) con dumps() y con el HTML en crudo.
+    """
+    from fastapi.encoders import jsonable_encoder
+    from app.dto.result_dto import GeneratedPageDTO
+
+    def pct(values: list, q: float) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+    unit = "<div class=\"card\"><h2>Título</h2><p>Descripción del producto con acentos: áéíóú ñ</p></div>\n"
+    results = {}
+    for size in sizes:
+        html = "<!DOCTYPE html><html><body>\n" + unit * (size // len(unit)) + "</body></html>"
+        dto = GeneratedPageDTO.model_construct(html=html, framework="html")
+        paths = {
+            "response_model+json": lambda: json.dumps(
+                jsonable_encoder(GeneratedPageDTO.model_validate(dto.model_dump())),
+                ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+            ).encode("utf-8"),
+            "fast_json": lambda: dumps({"html": dto.html, "framework": dto.framework}),
+            "raw_html": lambda: dto.html.encode("utf-8"),
+        }
+        row = {}
+        for name, func in paths.items():
+            latencies = []
+            cpu_start = time.process_time()
+            for _ in range(iterations):
+                start = time.perf_counter()
+                body = func()
+                latencies.append(time.perf_counter() - start)
+            cpu = time.process_time() - cpu_start
+            row[name] = {
+                "bytes": len(body),
+                "cpu_us_per_response": round(cpu / iterations * 1e6, 1),
+                "p50_us": round(pct(latencies, 50) * 1e6, 1),
+                "p95_us": round(pct(latencies, 95) * 1e6, 1),
+            }
+        results[f"{size // 1000} KB"] = row
+    return {"orjson": bool(_load_orjson()), "iterations": iterations, "sizes": results}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        n = int(sys.argv[sys.argv.index("--iterations") + 1]) if "--iterations" in sys.argv else 200
+        print(json.dumps(_bench(n), indent=2))
+    else:
+        print("Uso: python -m app.services.responses bench [--iterations N]")
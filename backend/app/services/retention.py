@@ -0,0 +1,421 @@
+"""
+retention.py
+Retención, archivado y limpieza de lo que se acumula en disco y en BD.
+
+Políticas (días, 0 = conservar para siempre):
+- RETENTION_UPLOADS_DAYS     imágenes/documentos subidos ({uuid}_{nombre} en el almacenamiento)
+- RETENTION_DOWNLOADS_DAYS   HTML descargado de Stitch (stitch/ en el almacenamiento) que ninguna
+                             página usa (generaciones que fallaron), y el uploads/downloads/ antiguo
+- RETENTION_PAGES_DAYS       páginas del file store (.html/.json + index.json); se archivan antes de borrarse
+- RETENTION_CHAT_DAYS        filas de chat_messages
+- RETENTION_DB_PAGES_DAYS    filas de generated_pages
+- RETENTION_USERS_DAYS       usuarios sin mensajes ni páginas
+
+Los borrados en BD van por lotes pequeños (RETENTION_BATCH_SIZE), cada uno en su
+transacción, para no bloquear las tablas calientes. Las páginas antiguas se archivan
+igual estén donde estén: las del file store en archive/pages_{fecha}.tar.zst (o .tar.gz
+si no está instalado `zstandard`) con un manifest.json, y las filas de generated_pages en
+archive/db_pages_{fecha}.jsonl.zst (una fila por línea, con su HTML) antes de borrarlas,
+también cuando se suelta una partición entera (RETENTION_ARCHIVE_DB_PAGES=false lo
+desactiva). Los mensajes del chat y las revisiones se borran sin archivar: las páginas ya
+guardan el prompt y el HTML de cada turno. También se detectan huérfanos (ficheros sin
+índice/usuario y viceversa).
+
+Uso manual:
+    python -m app.services.retention            → informe dry-run
+    python -m app.services.retention --apply    → aplica las políticas
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tarfile
+from datetime import datetime, timedelta, timezone
+from app.services import file_storage, shared_state, metrics, storage
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() == "true"
+RETENTION_DRY_RUN = os.getenv("RETENTION_DRY_RUN", "true").lower() == "true"
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", 24))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+RETENTION_BATCH_PAUSE_S = float(os.getenv("RETENTION_BATCH_PAUSE_S", 0.05))
+RETENTION_ARCHIVE_DB_PAGES = os.getenv("RETENTION_ARCHIVE_DB_PAGES", "true").lower() == "true"
+
+TTL_DAYS = {
+    "uploads": int(os.getenv("RETENTION_UPLOADS_DAYS", 0)),
+    "downloads": int(os.getenv("RETENTION_DOWNLOADS_DAYS", 0)),
+    "pages": int(os.getenv("RETENTION_PAGES_DAYS", 0)),
+    "chat_messages": int(os.getenv("RETENTION_CHAT_DAYS", 0)),
+    "generated_pages": int(os.getenv("RETENTION_DB_PAGES_DAYS", 0)),
+    "users": int(os.getenv("RETENTION_USERS_DAYS", 0)),
+}
+
+ARCHIVE_DIR = os.getenv(
+    "ARCHIVE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'archive'))
+)
+
+def _cutoff(kind: str) -> datetime | None:
+    days = TTL_DAYS.get(kind, 0)
+    if days <= 0:
+        return None
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def _old_files(directory: str, cutoff: datetime, match=None) -> list:
+    """(ruta, bytes) de los ficheros de `directory` modificados antes de `cutoff`."""
+    if not os.path.isdir(directory):
+        return []
+    limit = cutoff.timestamp()
+    found = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.is_file() or (match and not match(entry.name)):
+                continue
+            st = entry.stat()
+            if st.st_mtime < limit:
+                found.append((entry.path, st.st_size))
+    return found
+
+
+def _delete_files(files: list, dry_run: bool) -> dict:
+    total = sum(size for _, size in files)
+    if not dry_run:
+        for path, _ in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return {"files": len(files), "bytes": total}
+
+
+def _old_objects(cutoff: datetime, match=None) -> list:
+    """ObjectStat de los objetos del almacenamiento modificados antes de `cutoff`."""
+    limit = cutoff.timestamp()
+    return [
+        obj for obj in storage.backend().iter_objects()
+        if obj.mtime < limit and (match is None or match(os.path.basename(obj.key)))
+    ]
+
+
+def _delete_objects(objects: list, dry_run: bool) -> dict:
+    total = sum(obj.size for obj in objects)
+    if not dry_run:
+        backend = storage.backend()
+        for obj in objects:
+            backend.delete(obj.key)
+    return {"files": len(objects), "bytes": total}
+
+
+def _page_files(meta: dict) -> list:
+    """ObjectStat de los .html/.json de una página que existen en el almacenamiento."""
+    objects = []
+    for key in ("html_file", "json_file"):
+        if meta.get(key):
+            obj = storage.backend().stat(meta[key])
+            if obj is not None:
+                objects.append(obj)
+    return objects
+
+
+def _open_archive(path_base: str):
+    """Abre un tar en streaming comprimido con zstd si está disponible, o gzip."""
+    try:
+        import zstandard
+        path = f"{path_base}.tar.zst"
+        raw = open(path, "wb")
+        writer = zstandard.ZstdCompressor(level=10).stream_writer(raw)
+        return path, tarfile.open(fileobj=writer, mode="w|"), (writer, raw)
+    except ImportError:
+        path = f"{path_base}.tar.gz"
+        return path, tarfile.open(path, mode="w:gz"), ()
+
+
+def _archive_pages(pages: list) -> tuple:
+    """
+    Empaqueta los .html/.json de `pages` junto con un manifest.json.
+    Devuelve (ruta del archivo, manifest).
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    path, tar, closers = _open_archive(os.path.join(ARCHIVE_DIR, f"pages_{stamp}"))
+
+    manifest = {"created_at": datetime.now(timezone.utc).isoformat(), "pages": []}
+    try:
+        for meta in pages:
+            files = []
+            for obj in _page_files(meta):
+                data = storage.backend().get(obj.key)
+                if data is None:
+                    continue
+                info = tarfile.TarInfo(f"pages/{obj.key}")
+                info.size = len(data)
+                info.mtime = int(obj.mtime)
+                tar.addfile(info, io.BytesIO(data))
+                files.append({
+                    "name": obj.key,
+                    "bytes": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                })
+            manifest["pages"].append({**meta, "files": files})
+
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+    finally:
+        tar.close()
+        for closer in closers:
+            closer.close()
+
+    # Copia del manifest junto al archivo para consultarlo sin descomprimir
+    with open(f"{path}.manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return path, manifest
+
+
+class _RowArchive:
+    """
+    archive/db_pages_{fecha}.jsonl.zst (o .jsonl.gz): filas de generated_pages, una por
+    línea. El fichero se crea con la primera fila y se descarta si no llega ninguna.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.path = None
+        self.rows = 0
+        self._file = None
+        self._closers = ()
+
+    def _open(self):
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        base = os.path.join(ARCHIVE_DIR, f"{self.name}_{stamp}")
+        try:
+            import zstandard
+            self.path = f"{base}.jsonl.zst"
+            raw = open(self.path, "wb")
+            writer = zstandard.ZstdCompressor(level=10).stream_writer(raw)
+            self._file = io.TextIOWrapper(writer, encoding="utf-8")
+            self._closers = (self._file, raw)
+        except ImportError:
+            import gzip
+            self.path = f"{base}.jsonl.gz"
+            self._file = gzip.open(self.path, "wt", encoding="utf-8")
+            self._closers = (self._file,)
+
+    def __call__(self, rows):
+        """Añade filas (objetos del modelo o mappings de SQL) y las escribe ya en disco."""
+        if self._file is None:
+            self._open()
+        for row in rows:
+            data = dict(row) if hasattr(row, "keys") else {
+                c.name: getattr(row, c.name) for c in row.__table__.columns
+            }
+            self._file.write(json.dumps(data, ensure_ascii=False, default=str) + "\n")
+            self.rows += 1
+        self._file.flush()
+
+    def close(self) -> str | None:
+        for closer in self._closers:
+            closer.close()
+        return self.path
+
+
+def _expire_pages(dry_run: bool) -> dict:
+    cutoff = _cutoff("pages")
+    if cutoff is None:
+        return {"pages": 0, "bytes": 0, "archive": None}
+
+    old = [
+        meta for meta in file_storage.list_pages()
+        if meta.get("created_at") and datetime.fromisoformat(meta["created_at"]) < cutoff
+    ]
+    total = sum(obj.size for meta in old for obj in _page_files(meta))
+    archive = None
+    if old and not dry_run:
+        archive, _ = _archive_pages(old)
+        file_storage.remove_pages([meta["page_id"] for meta in old])
+        logger.info(f"Retención: {len(old)} páginas archivadas en {archive}")
+    return {"pages": len(old), "bytes": total, "archive": archive}
+
+
+def _expire_db(dry_run: bool) -> dict:
+    cutoffs = {kind: _cutoff(kind) for kind in ("chat_messages", "generated_pages", "users")}
+    cutoffs = {k: v.replace(tzinfo=None) for k, v in cutoffs.items() if v}  # columnas naive (UTC)
+    if not cutoffs:
+        return {}
+    if "generated_pages" in cutoffs:
+        # El historial de revisiones caduca con las páginas
+        cutoffs["page_revisions"] = cutoffs["generated_pages"]
+
+    from app.db.database import SessionLocal, engine, db_partitioned
+    from app.db import repository, partitioning
+
+    db = SessionLocal()
+    try:
+        if dry_run:
+            return repository.count_retention_candidates(db, cutoffs)
+
+        archives = {"generated_pages": _RowArchive("db_pages")} if RETENTION_ARCHIVE_DB_PAGES else {}
+        partitions = {}
+        deleted = {}
+        try:
+            if db_partitioned and engine.dialect.name == "postgresql":
+                # Meses completos caducados: DETACH + DROP de la partición, sin borrar fila a fila
+                for kind in partitioning.PARTITIONED_TABLES:
+                    if kind in cutoffs:
+                        partitions[kind] = partitioning.drop_partitions_before(
+                            engine, kind, cutoffs[kind], archive=archives.get(kind)
+                        )
+                        metrics.incr(f"retention.dropped_partitions.{kind}", partitions[kind]["partitions"])
+
+            deleters = {
+                "chat_messages": repository.delete_messages_before,
+                "generated_pages": repository.delete_pages_before,
+                "page_revisions": repository.delete_revisions_before,
+                "users": repository.delete_empty_users_before,
+            }
+            # Usuarios al final: sus mensajes/páginas pueden haber caducado en este mismo ciclo
+            for kind in ("chat_messages", "generated_pages", "page_revisions", "users"):
+                if kind not in cutoffs:
+                    continue
+                deleted[kind] = 0
+                extra = {"archive": archives[kind]} if kind in archives else {}
+                while True:
+                    n = deleters[kind](db, cutoffs[kind], RETENTION_BATCH_SIZE, **extra)
+                    deleted[kind] += n
+                    if n < RETENTION_BATCH_SIZE:
+                        break
+                    time.sleep(RETENTION_BATCH_PAUSE_S)
+                if kind in partitions:
+                    deleted[kind] += partitions[kind]["rows"]
+                metrics.incr(f"retention.deleted.{kind}", deleted[kind])
+        finally:
+            for kind, archive in archives.items():
+                path = archive.close()
+                if path:
+                    deleted[f"{kind}_archive"] = path
+                    logger.info(f"Retención: {archive.rows} filas de {kind} archivadas en {path}")
+        return deleted
+    finally:
+        db.close()
+
+
+def find_orphans() -> dict:
+    """
+    Detecta inconsistencias entre el almacenamiento, index.json y la BD:
+    - ficheros .html/.json sin entrada en el índice
+    - entradas del índice sin sus ficheros
+    - páginas en disco cuya sesión no existe en la tabla users
+    """
+    index = file_storage.list_pages()
+    indexed_files = set()
+    missing_files = []
+    for meta in index:
+        for key in ("html_file", "json_file"):
+            name = meta.get(key)
+            if not name:
+                continue
+            indexed_files.add(name)
+            if storage.backend().stat(name) is None:
+                missing_files.append(meta["page_id"])
+
+    unindexed = [
+        {"file": obj.key, "bytes": obj.size}
+        for obj in storage.backend().iter_objects()
+        if obj.key.endswith((".html", ".json")) and obj.key not in indexed_files
+    ]
+
+    orphans = {
+        "files_without_index": unindexed,
+        "index_without_files": sorted(set(missing_files)),
+    }
+
+    try:
+        from app.db.database import SessionLocal
+        from app.db import repository
+        db = SessionLocal()
+        try:
+            known = repository.get_session_ids(db)
+        finally:
+            db.close()
+        orphans["pages_without_user"] = sorted(
+            meta["page_id"] for meta in index if meta.get("session_id") not in known
+        )
+    except Exception as e:
+        logger.warning(f"No se pudieron cruzar las páginas con la BD: {e}")
+    return orphans
+
+
+def run_retention(dry_run: bool = True) -> dict:
+    """Aplica (o simula con dry_run) todas las políticas. Devuelve el informe."""
+    start = time.perf_counter()
+    report = {"dry_run": dry_run, "ttl_days": TTL_DAYS}
+
+    cutoff = _cutoff("uploads")
+    report["uploads"] = _delete_objects(
+        _old_objects(cutoff, match=storage.UPLOAD_KEY_RE.match), dry_run
+    ) if cutoff else {"files": 0, "bytes": 0}
+
+    cutoff = _cutoff("downloads")
+    if cutoff:
+        used = {meta.get("html_file") for meta in file_storage.list_pages()}
+        unused = [
+            obj for obj in _old_objects(cutoff)
+            if obj.key.startswith(file_storage.DOWNLOADS_PREFIX) and obj.key not in used
+        ]
+        objects = _delete_objects(unused, dry_run)
+        legacy = _delete_files(_old_files(file_storage.DOWNLOADS_DIR, cutoff), dry_run)
+        report["downloads"] = {k: objects[k] + legacy[k] for k in ("files", "bytes")}
+    else:
+        report["downloads"] = {"files": 0, "bytes": 0}
+
+    report["pages"] = _expire_pages(dry_run)
+
+    try:
+        report["db"] = _expire_db(dry_run)
+    except Exception as e:
+        logger.error(f"Retención en BD fallida: {e}")
+        report["db"] = {"error": str(e)}
+
+    report["orphans"] = find_orphans()
+    report["reclaimed_bytes"] = (
+        report["uploads"]["bytes"] + report["downloads"]["bytes"] + report["pages"]["bytes"]
+    )
+    report["seconds"] = time.perf_counter() - start
+
+    if not dry_run:
+        metrics.incr("retention.reclaimed_bytes", report["reclaimed_bytes"])
+    logger.info(
+        f"Retención {'(dry-run) ' if dry_run else ''}completada: "
+        f"{report['reclaimed_bytes']} bytes en disco, BD: {report['db']}"
+    )
+    return report
+
+
+async def retention_loop():
+    """
+    Ejecuta la retención periódicamente. Solo un worker por host la ejecuta en cada
+    intervalo (lease en el registro in-flight de shared_state).
+    """
+    interval = RETENTION_INTERVAL_HOURS * 3600
+    while True:
+        try:
+            if shared_state.inflight_register("retention", ttl=interval):
+                await asyncio.to_thread(run_retention, RETENTION_DRY_RUN)
+        except Exception as e:
+            logger.error(f"Error en el ciclo de retención: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    result = run_retention(dry_run="--apply" not in sys.argv)
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
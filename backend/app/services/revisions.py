@@ -0,0 +1,152 @@
+"""
+revisions.py
+Codificación delta del historial de páginas de cada sesión (tabla page_revisions).
+
+Cada revisión se guarda como snapshot (HTML completo) o como delta respecto a la
+revisión anterior. Se hace snapshot en la primera revisión, cada REVISION_SNAPSHOT_EVERY
+revisiones y cuando el delta no compensa (más de REVISION_MAX_DELTA_RATIO del tamaño
+del HTML). Así reconstruir cualquier revisión cuesta como mucho un snapshot y
+REVISION_SNAPSHOT_EVERY - 1 deltas.
+
+Formato del delta (JSON compacto), sobre las líneas de la revisión anterior:
+    [[i1, i2], ["línea nueva\\n", ...], ...]   copiar líneas [i1, i2) / insertar líneas
+
+Benchmark de almacenamiento (bytes por revisión frente a copias completas):
+    python -m app.services.revisions bench [--revisions 200]
+"""
+
+import os
+import sys
+import json
+import random
+import difflib
+import hashlib
+
+REVISION_SNAPSHOT_EVERY = int(os.getenv("REVISION_SNAPSHOT_EVERY", 10))
+REVISION_MAX_DELTA_RATIO = float(os.getenv("REVISION_MAX_DELTA_RATIO", 0.5))
+
+KIND_SNAPSHOT = "snapshot"
+KIND_DELTA = "delta"
+
+
+def html_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def make_delta(old: str, new: str) -> str:
+    """Delta por líneas que transforma `old` en `new`."""
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:   # replace / insert (en delete no hay nada que añadir)
+            ops.append(b[j1:j2])
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def apply_delta(old: str, delta: str) -> str:
+    a = old.splitlines(keepends=True)
+    out = []
+    for op in json.loads(delta):
+        if len(op) == 2 and isinstance(op[0], int):
+            out.extend(a[op[0]:op[1]])
+        else:
+            out.extend(op)
+    return "".join(out)
+
+
+def encode(previous_html: str | None, html: str, revision: int, last_snapshot: int | None) -> tuple:
+    """
+    Decide cómo guardar la revisión `revision` (1, 2, ...). Devuelve (kind, content).
+    `last_snapshot`: número de la última revisión guardada como snapshot.
+    """
+    if previous_html is None or last_snapshot is None or revision - last_snapshot >= REVISION_SNAPSHOT_EVERY:
+        return KIND_SNAPSHOT, html
+    delta = make_delta(previous_html, html)
+    if len(delta) > REVISION_MAX_DELTA_RATIO * len(html):
+        return KIND_SNAPSHOT, html
+    return KIND_DELTA, delta
+
+
+def reconstruct(chain: list) -> str:
+    """HTML de la última revisión de `chain`: [(kind, content)] desde un snapshot, en orden."""
+    if not chain or chain[0][0] != KIND_SNAPSHOT:
+        raise ValueError("La cadena de revisiones debe empezar por un snapshot")
+    html = chain[0][1]
+    for kind, content in chain[1:]:
+        html = content if kind == KIND_SNAPSHOT else apply_delta(html, content)
+    return html
+
+
+def unified_diff(old: str, new: str, old_label: str, new_label: str) -> str:
+    return "".join(difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True), fromfile=old_label, tofile=new_label
+    ))
+
+
+def _synthetic_page(rng: random.Random, sections: int = 40) -> list:
+    lines = ["<!DOCTYPE html>\n", "<html><head><style>body{font-family:sans-serif}</style></head><body>\n"]
+    for i in range(sections):
+        lines.append(f"<section id=\"s{i}\">\n")
+        lines.extend(f"  <p>{' '.join(rng.choice(('lorem', 'ipsum', 'tienda', 'oferta', 'envío')) for _ in range(12))}</p>\n"
+                     for _ in range(8))
+        lines.append("</section>\n")
+    lines.append("</body></html>\n")
+    return lines
+
+
+def _bench(revisions: int = 200, seed: int = 7) -> dict:
+    """Secuencia sintética de revisiones (cada una cambia unas pocas líneas de la anterior)."""
+    import time
+
+    rng = random.Random(seed)
+    lines = _synthetic_page(rng)
+    full_bytes = delta_bytes = 0
+    stored, previous, last_snapshot = [], None, None
+    encode_s = 0.0
+    for revision in range(1, revisions + 1):
+        for _ in range(rng.randint(1, 6)):
+            i = rng.randrange(2, len(lines) - 1)
+            lines[i] = f"  <p>cambio {revision} {rng.random():.6f}</p>\n"
+        html = "".join(lines)
+        start = time.perf_counter()
+        kind, content = encode(previous, html, revision, last_snapshot)
+        encode_s += time.perf_counter() - start
+        if kind == KIND_SNAPSHOT:
+            last_snapshot = revision
+        stored.append((revision, kind, content, html_hash(html)))
+        full_bytes += len(html.encode("utf-8"))
+        delta_bytes += len(content.encode("utf-8"))
+        previous = html
+
+    # Reconstrucción de todas las revisiones desde su snapshot, verificando el hash
+    start = time.perf_counter()
+    worst = 0.0
+    for i, (revision, _, _, digest) in enumerate(stored):
+        t0 = time.perf_counter()
+        base = max(j for j in range(i + 1) if stored[j][1] == KIND_SNAPSHOT)
+        html = reconstruct([(k, c) for _, k, c, _ in stored[base:i + 1]])
+        worst = max(worst, time.perf_counter() - t0)
+        assert html_hash(html) == digest, f"revisión {revision} corrupta"
+    rebuild_s = time.perf_counter() - start
+
+    return {
+        "revisions": revisions,
+        "snapshot_every": REVISION_SNAPSHOT_EVERY,
+        "full_copy_bytes_per_revision": full_bytes / revisions,
+        "delta_bytes_per_revision": delta_bytes / revisions,
+        "ratio": delta_bytes / full_bytes,
+        "encode_ms_avg": encode_s / revisions * 1000,
+        "reconstruct_ms_avg": rebuild_s / revisions * 1000,
+        "reconstruct_ms_max": worst * 1000,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        n = int(sys.argv[sys.argv.index("--revisions") + 1]) if "--revisions" in sys.argv else 200
+        print(json.dumps(_bench(n), indent=2))
+    else:
+        print("Uso: python -m app.services.revisions bench [--revisions N]")
@@ -0,0 +1,179 @@
+"""
+scheduler.py
+Planificador delante de WebBuilderAgent.run para repartir la capacidad de Gemini
+de forma justa entre sesiones:
+
+- Token bucket por sesión (compartido entre workers vía shared_state)
+- Límite global de generaciones concurrentes por proceso
+- Weighted fair queueing entre sesiones (una sesión que envía ráfagas no adelanta a las demás)
+- Clases de prioridad: chat interactivo > API /generate > /generate/batch > especulativa,
+  con envejecimiento (aging): cada PRIORITY_AGING_S de espera sube una clase, así que
+  un flujo continuo de peticiones interactivas no deja sin turno a las demás
+- Métricas de espera en cola por clase de prioridad
+"""
+
+import os
+import time
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from app.services import metrics, shared_state, executors
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_API = "api"
+PRIORITY_BATCH = "batch"
+PRIORITY_SPECULATIVE = "speculative"
+
+# Menor valor = se atiende antes
+PRIORITY_RANK = {
+    PRIORITY_INTERACTIVE: 0,
+    PRIORITY_API: 1,
+    PRIORITY_BATCH: 2,
+    PRIORITY_SPECULATIVE: 3,
+}
+
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", 4))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", 100))
+# Token bucket por sesión: SESSION_RATE_PER_MIN generaciones/minuto con ráfagas de hasta SESSION_BURST
+SESSION_RATE_PER_MIN = float(os.getenv("SESSION_RATE_PER_MIN", 6))
+SESSION_BURST = float(os.getenv("SESSION_BURST", 3))
+# Segundos de espera en cola que equivalen a subir una clase de prioridad (0 = prioridad estricta)
+PRIORITY_AGING_S = float(os.getenv("PRIORITY_AGING_S", 30))
+
+
+class RateLimitExceeded(Exception):
+    """La sesión ha agotado su cuota o la cola está llena."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GenerationScheduler:
+
+    def __init__(
+        self,
+        max_concurrency: int = GENERATION_MAX_CONCURRENCY,
+        max_queue: int = GENERATION_MAX_QUEUE,
+        rate_per_min: float = SESSION_RATE_PER_MIN,
+        burst: float = SESSION_BURST,
+        aging_s: float = PRIORITY_AGING_S,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.aging_s = aging_s
+        self.weights: dict = {}       # session_id → peso (1 por defecto)
+
+        self._active = 0
+        self._queue = []              # (rank, finish_tag, seq, session_id, future, encolado_en)
+        self._virtual_time = 0.0
+        self._last_finish: dict = {}  # session_id → último finish tag asignado
+        self._seq = itertools.count()
+
+    async def check_rate(self, session_id: str, cost: float = 1):
+        """
+        Consume `cost` tokens del bucket de la sesión o lanza RateLimitExceeded.
+        El bucket está en SQLite (BEGIN IMMEDIATE puede esperar al lock): va al pool de hilos.
+        """
+        if self.rate <= 0:
+            return
+        granted, retry_after = await executors.run_in_thread(
+            shared_state.take_token, f"gen:{session_id}", self.rate, self.burst, cost
+        )
+        if not granted:
+            metrics.incr("scheduler.rate_limited")
+            raise RateLimitExceeded(
+                f"Demasiadas generaciones para la sesión {session_id}", retry_after=retry_after
+            )
+
+    def _finish_tag(self, session_id: str) -> float:
+        """Finish tag de WFQ: cada petición 'cuesta' 1/peso en el tiempo virtual de su sesión."""
+        start = max(self._virtual_time, self._last_finish.get(session_id, 0.0))
+        tag = start + 1.0 / self.weights.get(session_id, 1.0)
+        self._last_finish[session_id] = tag
+        return tag
+
+    async def acquire(self, session_id: str, priority: str = PRIORITY_API, rate_limited: bool = True):
+        """
+        Espera turno para generar. Lanza RateLimitExceeded si la sesión o la cola están saturadas.
+        rate_limited=False no consume token (p. ej. elementos de un batch ya cobrado al entrar).
+        """
+        if rate_limited:
+            await self.check_rate(session_id)
+
+        rank = PRIORITY_RANK.get(priority, max(PRIORITY_RANK.values()))
+        start = time.perf_counter()
+
+        if self._active < self.max_concurrency and not self._queue:
+            self._active += 1
+        else:
+            if len(self._queue) >= self.max_queue:
+                metrics.incr("scheduler.queue_full")
+                raise RateLimitExceeded("Cola de generación llena", retry_after=5.0)
+
+            future = asyncio.get_running_loop().create_future()
+            tag = self._finish_tag(session_id)
+            self._queue.append((rank, tag, next(self._seq), session_id, future, time.monotonic()))
+            metrics.set_gauge("scheduler.queued", len(self._queue))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Si ya se nos había concedido el turno, lo devolvemos
+                if future.done() and not future.cancelled():
+                    self.release()
+                raise
+
+        wait = time.perf_counter() - start
+        metrics.observe(f"scheduler.queue_wait_s.{priority}", wait)
+        metrics.set_gauge("scheduler.active", self._active)
+
+    def _next(self):
+        """
+        Saca de la cola la siguiente petición: menor clase efectiva (la clase menos lo que ha
+        esperado en unidades de PRIORITY_AGING_S) y, a igualdad, menor finish tag (WFQ).
+        """
+        now = time.monotonic()
+
+        def order(entry):
+            rank, tag, seq, _, _, enqueued_at = entry
+            if self.aging_s > 0:
+                rank -= (now - enqueued_at) / self.aging_s
+            return rank, tag, seq
+
+        best = min(self._queue, key=order)
+        self._queue.remove(best)
+        return best
+
+    def release(self):
+        """Libera un hueco y se lo pasa al siguiente en la cola (si lo hay)."""
+        self._queue = [entry for entry in self._queue if not entry[4].done()]
+        while self._queue:
+            _, tag, _, session_id, future, _ = self._next()
+            if future.done():
+                continue
+            self._virtual_time = max(self._virtual_time, tag)
+            metrics.set_gauge("scheduler.queued", len(self._queue))
+            future.set_result(None)
+            return
+        self._active -= 1
+        if self._active == 0:
+            # Sistema ocioso: reiniciamos el tiempo virtual
+            self._virtual_time = 0.0
+            self._last_finish.clear()
+        metrics.set_gauge("scheduler.active", self._active)
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, priority: str = PRIORITY_API, rate_limited: bool = True):
+        await self.acquire(session_id, priority, rate_limited)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+scheduler = GenerationScheduler()
@@ -0,0 +1,289 @@
+"""
+search.py
+Búsqueda de texto completo sobre las páginas guardadas en disco (file_storage).
+
+Índice SQLite FTS5 en .state/search.db con prompt, site_type y el texto visible
+de la página (sin etiquetas, scripts ni estilos). Se actualiza de forma incremental
+desde file_storage.save_page; reindex_all() lo reconstruye a partir de index.json.
+
+La búsqueda sobre la BD (tabla generated_pages) usa tsvector + GIN en PostgreSQL:
+ver repository.search_pages.
+
+Benchmark (por defecto 10^6 documentos en los dos motores; postgres usa DATABASE_URL
+y tablas temporales):
+    python -m app.services.search bench [n_docs] [--engine sqlite|postgres|both]
+"""
+
+import os
+import re
+import sys
+import html as html_lib
+import time
+import random
+import sqlite3
+import logging
+import threading
+from app.services import shared_state
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DB = os.getenv("SEARCH_DB", os.path.join(shared_state.STATE_DIR, "search.db"))
+# Solo se indexan los primeros N caracteres de texto de cada página
+MAX_INDEXED_CHARS = int(os.getenv("SEARCH_MAX_INDEXED_CHARS", 20000))
+
+_local = threading.local()
+
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style)\b[^>]*>.*?</\1>", re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACES_RE = re.compile(r"\s+")
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def html_to_text(html: str) -> str:
+    """Texto visible aproximado de un HTML (sin scripts, estilos ni etiquetas)."""
+    text = _SCRIPT_STYLE_RE.sub(" ", html or "")
+    text = _TAG_RE.sub(" ", text)
+    text = html_lib.unescape(text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def _connect(path: str = None) -> sqlite3.Connection:
+    path = path or SEARCH_DB
+    conns = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "pid", None) != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    if path in conns:
+        return conns[path]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5("
+        "page_id UNINDEXED, session_id UNINDEXED, created_at UNINDEXED, "
+        "prompt, site_type, body, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    conns[path] = conn
+    return conn
+
+
+def _fts_query(query: str) -> str:
+    """Convierte el texto del usuario en una consulta FTS5 segura (AND de términos, prefijo en el último)."""
+    tokens = _TOKEN_RE.findall(query or "")
+    if not tokens:
+        return ""
+    terms = [f'"{t}"' for t in tokens[:-1]]
+    terms.append(f'"{tokens[-1]}"*')
+    return " ".join(terms)
+
+
+def index_page(metadata: dict, html: str, path: str = None):
+    """Indexa (o reindexa) una página guardada. Los errores se registran pero no se propagan."""
+    try:
+        conn = _connect(path)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM pages_fts WHERE page_id = ?", (metadata["page_id"],))
+        conn.execute(
+            "INSERT INTO pages_fts (page_id, session_id, created_at, prompt, site_type, body) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                metadata["page_id"],
+                metadata.get("session_id"),
+                metadata.get("created_at"),
+                metadata.get("prompt") or "",
+                metadata.get("site_type") or "",
+                html_to_text(html)[:MAX_INDEXED_CHARS],
+            ),
+        )
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        logger.error(f"Error indexando {metadata.get('page_id')}: {e}")
+
+
+def remove_page(page_id: str, path: str = None):
+    """Elimina una página del índice."""
+    _connect(path).execute("DELETE FROM pages_fts WHERE page_id = ?", (page_id,))
+
+
+def search_files(query: str, session_id: str = None, limit: int = 20, offset: int = 0, path: str = None) -> dict:
+    """
+    Busca en las páginas del file store. Resultados ordenados por bm25
+    (el prompt pesa más que el tipo de sitio, y este más que el cuerpo).
+    """
+    fts = _fts_query(query)
+    if not fts:
+        return {"total": 0, "results": []}
+
+    conn = _connect(path)
+    where = "pages_fts MATCH ?"
+    params = [fts]
+    if session_id:
+        where += " AND session_id = ?"
+        params.append(session_id)
+
+    total = conn.execute(f"SELECT count(*) FROM pages_fts WHERE {where}", params).fetchone()[0]
+    rows = conn.execute(
+        "SELECT page_id, session_id, created_at, prompt, site_type, "
+        "snippet(pages_fts, 5, '<b>', '</b>', '…', 12), "
+        "bm25(pages_fts, 0, 0, 0, 10.0, 5.0, 1.0) AS score "
+        f"FROM pages_fts WHERE {where} ORDER BY score LIMIT ? OFFSET ?",
+        params + [limit, offset],
+    ).fetchall()
+
+    return {
+        "total": total,
+        "results": [
+            {
+                "page_id": r[0],
+                "session_id": r[1],
+                "created_at": r[2],
+                "prompt": r[3],
+                "site_type": r[4],
+                "snippet": r[5],
+                "score": -r[6],
+            }
+            for r in rows
+        ],
+    }
+
+
+def reindex_all() -> int:
+    """Reconstruye el índice a partir de index.json y los .html guardados."""
+    from app.services import file_storage, storage
+
+    count = 0
+    backend = storage.backend()
+    for meta in file_storage.list_pages():
+        data = backend.get(meta["html_file"])
+        if data is None:
+            continue
+        index_page(meta, data.decode("utf-8", errors="replace"))
+        count += 1
+    logger.info(f"Índice de búsqueda reconstruido: {count} páginas")
+    return count
+
+
+def _latencies(run_query, words: list, n_queries: int) -> dict:
+    latencies = []
+    for _ in range(n_queries):
+        query = " ".join(random.choices(words, k=2))
+        start = time.perf_counter()
+        run_query(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "queries": n_queries,
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)], 2),
+        "max_ms": round(latencies[-1], 2),
+    }
+
+
+def _bench_sqlite(n_docs: int, n_queries: int, words: list) -> dict:
+    """Índice FTS5 sintético de n_docs páginas y latencia de consulta."""
+    import shutil
+    import tempfile
+
+    site_types = ["landing", "ecommerce", "portfolio", "blog"]
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "bench_search.db")
+    try:
+        return _bench_sqlite_run(path, n_docs, n_queries, words, site_types)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)   # a 10^6 docs son varios GB
+
+
+def _bench_sqlite_run(path: str, n_docs: int, n_queries: int, words: list, site_types: list) -> dict:
+    conn = _connect(path)
+
+    start = time.perf_counter()
+    batch = []
+    conn.execute("BEGIN")
+    for i in range(n_docs):
+        body = " ".join(random.choices(words, k=200))
+        batch.append((f"page_{i}", f"s{i % 5000}", "", " ".join(random.choices(words, k=10)),
+                      random.choice(site_types), body))
+        if len(batch) == 10_000:
+            conn.executemany("INSERT INTO pages_fts VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO pages_fts VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.execute("COMMIT")
+    conn.execute("INSERT INTO pages_fts(pages_fts) VALUES ('optimize')")
+    index_s = time.perf_counter() - start
+
+    result = _latencies(lambda q: search_files(q, limit=20, path=path), words, n_queries)
+    return {"engine": "sqlite_fts5", "docs": n_docs, "index_s": round(index_s, 1),
+            "db_bytes": os.path.getsize(path), **result}
+
+
+def _bench_postgres(n_docs: int, n_queries: int, words: list) -> dict:
+    """
+    Lo mismo en PostgreSQL: tabla temporal con las columnas de generated_pages, tsvector
+    con la misma expresión que la columna real, índice GIN y la consulta de repository.
+    """
+    from sqlalchemy import text
+    from app.db.database import engine
+    from app.db.models import SEARCH_VECTOR_SQL
+
+    with engine.connect() as conn:
+        conn.execute(text(
+            "CREATE TEMP TABLE bench_pages (id bigint PRIMARY KEY, prompt text, site_type text, "
+            "html text NOT NULL, search_vector tsvector)"
+        ))
+        start = time.perf_counter()
+        # Mismo vocabulario (w0..w49999), 10 palabras de prompt y 200 de cuerpo por documento
+        for first in range(0, n_docs, 50_000):
+            conn.execute(text(
+                "INSERT INTO bench_pages (id, prompt, site_type, html) "
+                "SELECT g, (SELECT string_agg('w' || (random() * 49999)::int, ' ') FROM generate_series(1, 10) WHERE g >= 0), "
+                "(ARRAY['landing','ecommerce','portfolio','blog'])[1 + (g % 4)], "
+                "'<p>' || (SELECT string_agg('w' || (random() * 49999)::int, ' ') FROM generate_series(1, 200) WHERE g >= 0) || '</p>' "
+                "FROM generate_series(:first, :last) AS g"
+            ), {"first": first, "last": min(first + 50_000, n_docs) - 1})
+        conn.execute(text(f"UPDATE bench_pages SET search_vector = {SEARCH_VECTOR_SQL}"))
+        conn.execute(text("CREATE INDEX ON bench_pages USING gin (search_vector)"))
+        conn.execute(text("ANALYZE bench_pages"))
+        index_s = time.perf_counter() - start
+        table_bytes = conn.execute(text("SELECT pg_total_relation_size('bench_pages')")).scalar()
+
+        def run_query(query: str):
+            params = {"q": query}
+            conn.execute(text(
+                "SELECT count(*) FROM bench_pages WHERE search_vector @@ websearch_to_tsquery('simple', :q)"
+            ), params).scalar()
+            conn.execute(text(
+                "SELECT id, ts_rank_cd(search_vector, websearch_to_tsquery('simple', :q)) AS rank "
+                "FROM bench_pages WHERE search_vector @@ websearch_to_tsquery('simple', :q) "
+                "ORDER BY rank DESC LIMIT 20"
+            ), params).all()
+
+        result = _latencies(run_query, words, n_queries)
+        conn.rollback()
+    return {"engine": "postgresql_gin", "docs": n_docs, "index_s": round(index_s, 1),
+            "db_bytes": table_bytes, **result}
+
+
+def _bench(n_docs: int = 1_000_000, n_queries: int = 200, engines: tuple = ("sqlite", "postgres")) -> list:
+    words = [f"w{i}" for i in range(50_000)]
+    results = []
+    for name in engines:
+        print(f"Indexando {n_docs} documentos en {name}...", file=sys.stderr)
+        bench = _bench_sqlite if name == "sqlite" else _bench_postgres
+        results.append(bench(n_docs, n_queries, words))
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        import json
+        n = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 1_000_000
+        engine_arg = sys.argv[sys.argv.index("--engine") + 1] if "--engine" in sys.argv else "both"
+        engines = ("sqlite", "postgres") if engine_arg == "both" else (engine_arg,)
+        print(json.dumps(_bench(n, engines=engines), indent=2))
+    elif len(sys.argv) > 1 and sys.argv[1] == "reindex":
+        reindex_all()
+    else:
+        print("Uso: python -m app.services.search [bench [n_docs] [--engine sqlite|postgres|both] | reindex]")
@@ -0,0 +1,336 @@
+"""
+shared_state.py
+Estado compartido entre procesos para poder ejecutar varios workers por host
+(`gunicorn -w N` / `uvicorn --workers N`) sin IDs duplicados ni escrituras perdidas.
+
+Backend local: una base SQLite en modo WAL (la propia SQLite serializa las
+escrituras entre procesos) más file locks (fcntl) para secciones críticas
+de lectura-modificación-escritura sobre ficheros, como uploads/index.json.
+
+Ofrece:
+- Cache clave/valor con TTL (valores JSON)
+- Asignación atómica de identificadores únicos (page_id)
+- Registro de trabajos en curso (in-flight) con caducidad
+- Contadores por ventana de tiempo (rate counters) y token buckets
+- file_lock(): lock exclusivo entre procesos
+- purge_expired() / purge_loop(): borrado periódico de lo caducado (cache, reservas de
+  IDs, in-flight, ventanas de contadores y buckets inactivos)
+
+Lo que es propio de cada proceso (el Runner de ADK, el asyncio.Lock de
+inicialización, los singletons WebBuilderAgent) sigue siendo global del módulo:
+cada worker tiene su propio event loop y su propia conexión MCP.
+"""
+
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Fuera de uploads/ para que no quede expuesto por StaticFiles
+STATE_DIR = os.getenv(
+    "SHARED_STATE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '.state'))
+)
+STATE_DB = os.path.join(STATE_DIR, "shared_state.db")
+BUSY_TIMEOUT_S = float(os.getenv("SHARED_STATE_BUSY_TIMEOUT", 30))
+# Purga periódica: los page_id llevan la fecha, así que una reserva de hace días ya no
+# puede colisionar (y las páginas existentes se comprueban además contra index.json)
+PURGE_INTERVAL_S = float(os.getenv("SHARED_STATE_PURGE_INTERVAL_S", 600))
+ALLOCATION_TTL_S = float(os.getenv("SHARED_STATE_ALLOCATION_TTL_S", 2 * 24 * 3600))
+# Un bucket sin uso durante este tiempo está lleno: equivale a no tener fila
+BUCKET_IDLE_S = float(os.getenv("SHARED_STATE_BUCKET_IDLE_S", 24 * 3600))
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Devuelve la conexión SQLite del hilo actual.
+    Se reabre si el proceso ha hecho fork (las conexiones no sobreviven al fork).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+
+    os.makedirs(STATE_DIR, exist_ok=True)
+    conn = sqlite3.connect(STATE_DB, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS allocations (
+            namespace TEXT NOT NULL,
+            id TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (namespace, id)
+        );
+        CREATE TABLE IF NOT EXISTS inflight (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT NOT NULL,
+            window_start INTEGER NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (name, window_start)
+        );
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        """
+    )
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+@contextmanager
+def _transaction():
+    """Transacción con lock de escritura tomado desde el principio (BEGIN IMMEDIATE)."""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+@contextmanager
+def file_lock(name: str):
+    """
+    Lock exclusivo entre procesos del mismo host.
+    Uso: with file_lock("index"): ... lectura-modificación-escritura ...
+    """
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = os.path.join(STATE_DIR, f"{name}.lock")
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# ---------------------------------------------------------------------------
+# Cache clave/valor
+# ---------------------------------------------------------------------------
+
+def cache_get(key: str, default=None):
+    """Devuelve el valor cacheado (deserializado) o default si no existe o ha caducado."""
+    row = _connect().execute(
+        "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+    ).fetchone()
+    if row is None:
+        return default
+    value, expires_at = row
+    if expires_at is not None and expires_at < time.time():
+        return default
+    return json.loads(value)
+
+
+def cache_set(key: str, value, ttl: float | None = None):
+    """Guarda un valor serializable a JSON. ttl en segundos (None = sin caducidad)."""
+    expires_at = time.time() + ttl if ttl else None
+    _connect().execute(
+        "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+        (key, json.dumps(value, ensure_ascii=False), expires_at),
+    )
+
+
+def cache_delete(key: str):
+    """Elimina una clave de la cache."""
+    _connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+# ---------------------------------------------------------------------------
+# Asignación de identificadores
+# ---------------------------------------------------------------------------
+
+def allocate_id(namespace: str, base_id: str, taken: set | None = None) -> str:
+    """
+    Reserva de forma atómica un identificador único dentro de un namespace.
+    Si base_id ya está reservado (o aparece en `taken`), añade un sufijo numérico:
+    2026-02-19_landing_a3f2b1 → 2026-02-19_landing_a3f2b1_2
+
+    `taken` permite tener en cuenta IDs que existían antes de usar este registro.
+    """
+    taken = taken or set()
+    with _transaction() as conn:
+        candidate = base_id
+        counter = 2
+        while True:
+            if candidate not in taken:
+                exists = conn.execute(
+                    "SELECT 1 FROM allocations WHERE namespace = ? AND id = ?",
+                    (namespace, candidate),
+                ).fetchone()
+                if not exists:
+                    conn.execute(
+                        "INSERT INTO allocations (namespace, id, created_at) VALUES (?, ?, ?)",
+                        (namespace, candidate, time.time()),
+                    )
+                    return candidate
+            candidate = f"{base_id}_{counter}"
+            counter += 1
+
+
+# ---------------------------------------------------------------------------
+# Registro in-flight
+# ---------------------------------------------------------------------------
+
+def inflight_register(key: str, ttl: float = 600, owner: str | None = None) -> bool:
+    """
+    Marca `key` como en curso. Devuelve False si otro proceso ya lo tiene registrado.
+    Las entradas caducan a los `ttl` segundos (por si un worker muere sin liberarlas).
+    """
+    now = time.time()
+    owner = owner or f"pid:{os.getpid()}"
+    with _transaction() as conn:
+        conn.execute("DELETE FROM inflight WHERE key = ? AND expires_at < ?", (key, now))
+        try:
+            conn.execute(
+                "INSERT INTO inflight (key, owner, started_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, owner, now, now + ttl),
+            )
+        except sqlite3.IntegrityError:
+            return False
+    return True
+
+
+def inflight_release(key: str):
+    """Libera una entrada del registro in-flight."""
+    _connect().execute("DELETE FROM inflight WHERE key = ?", (key,))
+
+
+def inflight_list(prefix: str = "") -> list:
+    """Lista los trabajos en curso (no caducados) cuyo key empieza por `prefix`."""
+    rows = _connect().execute(
+        "SELECT key, owner, started_at FROM inflight WHERE key LIKE ? AND expires_at >= ?",
+        (f"{prefix}%", time.time()),
+    ).fetchall()
+    return [{"key": k, "owner": o, "started_at": s} for k, o, s in rows]
+
+
+# ---------------------------------------------------------------------------
+# Contadores por ventana
+# ---------------------------------------------------------------------------
+
+def incr_counter(name: str, amount: float = 1, window_s: int = 60) -> float:
+    """
+    Incrementa el contador `name` en la ventana de tiempo actual y devuelve su valor.
+    Las ventanas antiguas del mismo contador se purgan en la misma transacción.
+    """
+    window_start = int(time.time() // window_s * window_s)
+    with _transaction() as conn:
+        conn.execute(
+            "DELETE FROM counters WHERE name = ? AND window_start < ?",
+            (name, window_start),
+        )
+        conn.execute(
+            "INSERT INTO counters (name, window_start, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(name, window_start) DO UPDATE SET value = value + excluded.value",
+            (name, window_start, amount),
+        )
+        row = conn.execute(
+            "SELECT value FROM counters WHERE name = ? AND window_start = ?",
+            (name, window_start),
+        ).fetchone()
+    return row[0]
+
+
+def get_counter(name: str, window_s: int = 60) -> float:
+    """Valor del contador `name` en la ventana actual (0 si no hay datos)."""
+    window_start = int(time.time() // window_s * window_s)
+    row = _connect().execute(
+        "SELECT value FROM counters WHERE name = ? AND window_start = ?",
+        (name, window_start),
+    ).fetchone()
+    return row[0] if row else 0
+
+
+# ---------------------------------------------------------------------------
+# Token buckets
+# ---------------------------------------------------------------------------
+
+def take_token(key: str, rate: float, capacity: float, cost: float = 1) -> tuple[bool, float]:
+    """
+    Intenta consumir `cost` tokens del bucket `key` (recarga `rate` tokens/s hasta `capacity`).
+    Devuelve (concedido, segundos_hasta_tener_tokens).
+    """
+    now = time.time()
+    with _transaction() as conn:
+        row = conn.execute(
+            "SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)
+        ).fetchone()
+        tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+        granted = tokens >= cost
+        if granted:
+            tokens -= cost
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+            (key, tokens, now),
+        )
+    retry_after = 0.0 if granted else (cost - tokens) / rate if rate > 0 else float("inf")
+    return granted, retry_after
+
+
+# ---------------------------------------------------------------------------
+# Purga
+# ---------------------------------------------------------------------------
+
+def purge_expired(allocation_ttl_s: float = None, bucket_idle_s: float = None, counter_max_age_s: float = 3600) -> dict:
+    """
+    Borra las filas que ya no sirven: cache caducada (ctx:*...), reservas de IDs
+    antiguas, in-flight caducado, ventanas de contadores pasadas y buckets inactivos.
+    Devuelve las filas borradas por tabla.
+    """
+    now = time.time()
+    allocation_ttl_s = ALLOCATION_TTL_S if allocation_ttl_s is None else allocation_ttl_s
+    bucket_idle_s = BUCKET_IDLE_S if bucket_idle_s is None else bucket_idle_s
+    statements = {
+        "cache": ("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", now),
+        "allocations": ("DELETE FROM allocations WHERE created_at < ?", now - allocation_ttl_s),
+        "inflight": ("DELETE FROM inflight WHERE expires_at < ?", now),
+        "counters": ("DELETE FROM counters WHERE window_start < ?", now - counter_max_age_s),
+        "buckets": ("DELETE FROM buckets WHERE updated_at < ?", now - bucket_idle_s),
+    }
+    deleted = {}
+    with _transaction() as conn:
+        for table, (sql, limit) in statements.items():
+            deleted[table] = conn.execute(sql, (limit,)).rowcount
+    return deleted
+
+
+async def purge_loop():
+    """Purga periódica en segundo plano (la hace cualquier worker; es idempotente y barata)."""
+    from app.services import metrics
+
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL_S)
+        try:
+            deleted = await asyncio.to_thread(purge_expired)
+            for table, n in deleted.items():
+                metrics.incr(f"shared_state.purged.{table}", n)
+            if any(deleted.values()):
+                logger.info(f"Estado compartido purgado: {deleted}")
+        except Exception as e:
+            logger.warning(f"Purga del estado compartido fallida: {e}")
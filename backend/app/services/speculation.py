@@ -0,0 +1,198 @@
+"""
+speculation.py
+Pre-generación especulativa mientras el usuario escribe en /chat.
+
+1. La página manda borradores del prompt con debounce (mensaje "draft" del WebSocket
+   o POST /api/chat/draft)
+2. Cada borrador pasa por analyze_prompt; cuando SPECULATION_STABLE_DRAFTS borradores
+   seguidos dan el mismo plan, se lanza la generación con la prioridad más baja
+3. Al enviar, si el plan final coincide se reutiliza (ya terminada o en curso);
+   si no, se cancela (la cancelación cierra también el run de ADK)
+
+Límites estrictos: una especulación en curso por sesión, SPECULATION_MAX_PER_MIN
+lanzamientos por sesión y minuto (compartido entre workers) y SPECULATION_MAX_ACTIVE
+por proceso. Las especulaciones son del worker que las lanzó: si el envío llega a otro
+worker cuenta como fallo.
+
+Coincidencia de planes (plan_key): solo entran los campos del plan que lee el generador
+(PLAN_KEY_FIELDS, ver stitch_adk_client.generate_with_adk), y el prompt con los espacios
+normalizados: cambiar el espaciado no cambia la página, cambiar una palabra sí (el prompt
+va literal al modelo), así que un borrador al que le falta texto no debe reutilizarse.
+
+Métricas: speculation.started / hits / misses / wasted (llamadas al modelo que no se usaron),
+el gauge speculation.hit_rate y speculation.miss_field.{campo} (primer campo distinto en
+cada fallo; "not_started" si el plan coincidía pero seguía en cola) para medir cuánto
+se pierde por exigir coincidencia exacta.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from app.services import executors, metrics, shared_state
+
+logger = logging.getLogger(__name__)
+
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "true").lower() == "true"
+SPECULATION_STABLE_DRAFTS = int(os.getenv("SPECULATION_STABLE_DRAFTS", 2))
+SPECULATION_MIN_CHARS = int(os.getenv("SPECULATION_MIN_CHARS", 12))
+SPECULATION_MAX_PER_MIN = int(os.getenv("SPECULATION_MAX_PER_MIN", 2))
+SPECULATION_MAX_ACTIVE = int(os.getenv("SPECULATION_MAX_ACTIVE", 4))
+# Un resultado especulativo no reclamado en este tiempo se descarta
+SPECULATION_TTL_S = float(os.getenv("SPECULATION_TTL_S", 120))
+
+
+# Campos de WebPlanDTO que cambian lo que se pide al modelo
+PLAN_KEY_FIELDS = ("site_type", "sections", "style", "prompt", "images", "docs", "context", "base_page_id")
+
+
+def plan_fields(plan) -> dict:
+    fields = plan.model_dump(include=set(PLAN_KEY_FIELDS))
+    if fields.get("prompt"):
+        fields["prompt"] = " ".join(fields["prompt"].split())
+    return fields
+
+
+def plan_key(plan) -> str:
+    return json.dumps(plan_fields(plan), sort_keys=True)
+
+
+def _first_difference(key_a: str, key_b: str) -> str:
+    a, b = json.loads(key_a), json.loads(key_b)
+    return next((f for f in PLAN_KEY_FIELDS if a.get(f) != b.get(f)), "unknown")
+
+
+@dataclass
+class _SessionState:
+    last_key: str | None = None
+    streak: int = 0
+    spec_key: str | None = None
+    task: asyncio.Task | None = None
+    started_generating: bool = False
+    finished_at: float | None = None
+    updated_at: float = field(default_factory=time.monotonic)
+
+
+class Speculator:
+
+    def __init__(self):
+        self._sessions: dict = {}      # session_id → _SessionState
+
+    def _active(self) -> int:
+        return sum(1 for s in self._sessions.values() if s.task is not None and not s.task.done())
+
+    def _discard(self, state: _SessionState, reason: str):
+        """Cancela/descarta la especulación de una sesión; cuenta como llamada desperdiciada si llegó a generar."""
+        if state.task is None:
+            return
+        if not state.task.done():
+            state.task.cancel()
+        if state.started_generating:
+            metrics.incr("speculation.wasted")
+        metrics.incr(f"speculation.discarded.{reason}")
+        state.task, state.spec_key, state.started_generating, state.finished_at = None, None, False, None
+
+    def _purge(self):
+        now = time.monotonic()
+        for session_id, state in list(self._sessions.items()):
+            if state.finished_at is not None and now - state.finished_at > SPECULATION_TTL_S:
+                self._discard(state, "expired")
+            if state.task is None and now - state.updated_at > SPECULATION_TTL_S:
+                del self._sessions[session_id]
+
+    def _update_hit_rate(self):
+        counters = metrics.snapshot()["counters"]
+        hits = counters.get("speculation.hits", 0)
+        total = hits + counters.get("speculation.misses", 0)
+        if total:
+            metrics.set_gauge("speculation.hit_rate", hits / total)
+
+    async def on_draft(self, session_id: str, plan, generate) -> bool:
+        """
+        Registra un borrador ya analizado. `generate(plan, on_progress)` es la corrutina
+        que genera (WebBuilderAgent.generate_plan con prioridad especulativa).
+        Devuelve True si hay una especulación en curso o lista para este plan.
+        """
+        if not SPECULATION_ENABLED:
+            return False
+        self._purge()
+        key = plan_key(plan)
+        state = self._sessions.setdefault(session_id, _SessionState())
+        state.updated_at = time.monotonic()
+        state.streak = state.streak + 1 if key == state.last_key else 1
+        state.last_key = key
+
+        if state.spec_key == key:
+            return True
+        if state.streak < SPECULATION_STABLE_DRAFTS:
+            return False
+
+        # El plan ha cambiado y es estable: la especulación anterior ya no sirve
+        self._discard(state, "plan_changed")
+        if self._active() >= SPECULATION_MAX_ACTIVE:
+            metrics.incr("speculation.capped.global")
+            return False
+        # El plan queda reservado mientras se consulta la cuota (shared_state, fuera del loop):
+        # un borrador igual que llegue entretanto no lanza otra generación
+        state.spec_key = key
+        try:
+            launches = await executors.run_in_thread(shared_state.incr_counter, f"spec:{session_id}")
+        except BaseException:
+            if state.spec_key == key:
+                state.spec_key = None
+            raise
+        if state.spec_key != key:
+            return False     # otro borrador con un plan distinto la ha sustituido
+        if launches > SPECULATION_MAX_PER_MIN:
+            state.spec_key = None
+            metrics.incr("speculation.capped.session")
+            return False
+
+        async def on_progress(stage: str, data: dict):
+            state.started_generating = True
+
+        async def run():
+            try:
+                return await generate(plan, on_progress)
+            finally:
+                state.finished_at = time.monotonic()
+
+        state.task = asyncio.create_task(run())
+        # Evita el aviso de "excepción no recuperada" si nadie la reclama
+        state.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        metrics.incr("speculation.started")
+        logger.info(f"Generación especulativa lanzada para sesión {session_id} ({plan.site_type})")
+        return True
+
+    def claim(self, session_id: str, plan) -> asyncio.Task | None:
+        """
+        Al enviar: devuelve la tarea especulativa si su plan coincide con el final
+        (y ya había empezado a generar o terminado); si no, la cancela y devuelve None.
+        """
+        state = self._sessions.get(session_id)
+        if state is None or state.task is None:
+            return None
+        task = state.task
+        key = plan_key(plan)
+        if state.spec_key == key and (state.started_generating or task.done()) and not task.cancelled():
+            state.task, state.spec_key, state.started_generating, state.finished_at = None, None, False, None
+            metrics.incr("speculation.hits")
+            self._update_hit_rate()
+            return task
+        # Plan distinto, o aún en cola con prioridad mínima: mejor generar ya con prioridad interactiva
+        reason = "not_started" if state.spec_key == key else _first_difference(state.spec_key, key)
+        metrics.incr(f"speculation.miss_field.{reason}")
+        metrics.incr("speculation.misses")
+        self._discard(state, "miss")
+        self._update_hit_rate()
+        return None
+
+    def cancel_session(self, session_id: str):
+        state = self._sessions.pop(session_id, None)
+        if state is not None:
+            self._discard(state, "disconnected")
+
+
+speculator = Speculator()
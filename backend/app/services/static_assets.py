@@ -0,0 +1,131 @@
+"""
+static_assets.py
+Interfaz del chat (app/static/chat/) preconstruida al arrancar:
+
+- chat.css / chat.js se publican con nombre versionado por hash de contenido
+  (chat.3f2a9c1b7d4e.css) y Cache-Control inmutable de un año
+- index.html se reescribe con esos nombres y se sirve con ETag + no-cache,
+  así que una visita repetida cuesta un 304
+- Todo se precomprime una sola vez (gzip y, si está instalado `brotli`, br);
+  por petición solo se elige la variante según Accept-Encoding
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from fastapi import Request
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'static', 'chat'))
+ASSET_URL_PREFIX = "/static/chat"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+
+@dataclass
+class Asset:
+    content_type: str
+    etag: str
+    cache_control: str
+    variants: dict = field(default_factory=dict)   # encoding ("identity", "gzip", "br") → bytes
+
+
+_index: Asset | None = None
+_assets: dict = {}   # nombre versionado → Asset
+
+
+def _compress(data: bytes) -> dict:
+    variants = {"identity": data, "gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        variants["br"] = brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    # Sin sentido servir una variante comprimida que no es más pequeña
+    return {k: v for k, v in variants.items() if k == "identity" or len(v) < len(data)}
+
+
+def _make_asset(data: bytes, ext: str, cache_control: str) -> Asset:
+    digest = hashlib.sha256(data).hexdigest()
+    return Asset(
+        content_type=CONTENT_TYPES[ext],
+        etag=f'"{digest[:32]}"',
+        cache_control=cache_control,
+        variants=_compress(data),
+    )
+
+
+def build():
+    """Lee, versiona y precomprime los ficheros del chat. Idempotente."""
+    global _index
+    assets = {}
+    html_path = os.path.join(STATIC_DIR, "index.html")
+    with open(html_path, "r", encoding="utf-8") as f:
+        html = f.read()
+
+    for name in sorted(os.listdir(STATIC_DIR)):
+        base, ext = os.path.splitext(name)
+        if name == "index.html" or ext not in CONTENT_TYPES:
+            continue
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            data = f.read()
+        fingerprint = hashlib.sha256(data).hexdigest()[:12]
+        versioned = f"{base}.{fingerprint}{ext}"
+        assets[versioned] = _make_asset(data, ext, IMMUTABLE_CACHE)
+        html = html.replace("{{" + name + "}}", f"{ASSET_URL_PREFIX}/{versioned}")
+
+    _assets.clear()
+    _assets.update(assets)
+    _index = _make_asset(html.encode("utf-8"), ".html", REVALIDATE_CACHE)
+    logger.info(f"UI del chat preconstruida: {', '.join(assets)}")
+
+
+def _pick_encoding(asset: Asset, accept_encoding: str) -> str:
+    accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants and encoding in accepted:
+            return encoding
+    return "identity"
+
+
+def _respond(asset: Asset, request: Request) -> Response:
+    headers = {
+        "ETag": asset.etag,
+        "Cache-Control": asset.cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if asset.etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    encoding = _pick_encoding(asset, request.headers.get("accept-encoding", ""))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=asset.variants[encoding], media_type=asset.content_type, headers=headers)
+
+
+def index_response(request: Request) -> Response:
+    """Respuesta de GET /chat."""
+    if _index is None:
+        build()
+    return _respond(_index, request)
+
+
+def asset_response(name: str, request: Request) -> Response | None:
+    """Respuesta de un fichero versionado, o None si no existe (versión antigua o nombre inválido)."""
+    if _index is None:
+        build()
+    asset = _assets.get(name)
+    if asset is None:
+        return None
+    return _respond(asset, request)
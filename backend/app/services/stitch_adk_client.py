@@ -1,16 +1,16 @@
 import os
+import time
 import asyncio
 import logging
 import base64
-import httpx
+from contextlib import aclosing
 from pathlib import Path
 from dotenv import load_dotenv
-from google.genai import types
-from google.adk.agents import Agent
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.adk.tools.mcp_tool import McpToolset
-from google.adk.tools.mcp_tool.mcp_session_manager import StreamableHTTPConnectionParams
+from app.services import metrics, http_client, file_storage, doc_ingestion, executors, cassettes, model_router, adk_cache, storage
+from app.services.output_guard import OutputGuard, OutputRejected, GUARD_MAX_ATTEMPTS
+
+# google.adk / google.genai / MCP se importan dentro de las funciones:
+# importar este módulo es barato y el coste se paga en el warm-up (o en la primera generación).
 
 load_dotenv()
 
@@ -21,14 +21,29 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 STITCH_API_KEY = os.getenv("STITCH_API_KEY")
+# Streaming (SSE) de la respuesta del modelo: permite al guard cortar en cuanto se desvía
+ADK_STREAMING = os.getenv("ADK_STREAMING", "true").lower() == "true"
 APP_NAME = "stitch_app"
 USER_ID = "stitch_user"
+STITCH_MCP_URL = os.getenv("STITCH_MCP_URL", "https://stitch.googleapis.com/mcp")
+
+AGENT_INSTRUCTION = (
+    "You are a professional web UI generator powered by Google Stitch. "
+    "Generate complete, responsive HTML/CSS/JS pages based on the user's plan. "
+    "ALWAYS return the complete raw HTML/CSS/JS code directly. "
+    "NEVER describe what you generated. "
+    "NEVER summarize. "
+    "NEVER say 'I have generated' or 'The page has been created'. "
+    "Your response must start with <!DOCTYPE html> and end with </html>. "
+    "Return ONLY the HTML code, nothing else."
+)
 
 _toolset = None
-_runner = None
+_runner = None      # runner del tier por defecto
 _session = None
 _session_service = None
 _lock = asyncio.Lock()
+_first_generation_done = False
 
 
 async def _initialize():
@@ -39,32 +54,30 @@ async def _initialize():
             return
 
         logger.info("Inicializando Stitch ADK client...")
+        start = time.perf_counter()
 
-        _toolset = McpToolset(
-            connection_params=StreamableHTTPConnectionParams(
-                url="https://stitch.googleapis.com/mcp",
-                headers={
-                    "Accept": "application/json",
-                    "X-Goog-Api-Key": STITCH_API_KEY
-                },
-            ),
-        )
+        from google.adk.agents import Agent
+        from google.adk.runners import Runner
+        from google.adk.sessions import InMemorySessionService
+        from google.adk.tools.mcp_tool import McpToolset
+        from google.adk.tools.mcp_tool.mcp_session_manager import StreamableHTTPConnectionParams
+        metrics.set_gauge("startup.adk_import_s", time.perf_counter() - start)
 
-        root_agent = Agent(
-            name="stitch_agent",
-            model="gemini-2.5-flash",
-            instruction=(
-                "You are a professional web UI generator powered by Google Stitch. "
-                "Generate complete, responsive HTML/CSS/JS pages based on the user's plan. "
-                "ALWAYS return the complete raw HTML/CSS/JS code directly. "
-                "NEVER describe what you generated. "
-                "NEVER summarize. "
-                "NEVER say 'I have generated' or 'The page has been created'. "
-                "Your response must start with <!DOCTYPE html> and end with </html>. "
-                "Return ONLY the HTML code, nothing else."
-            ),
-            tools=[_toolset],
+        connection_params = StreamableHTTPConnectionParams(
+            url=STITCH_MCP_URL,
+            headers={
+                "Accept": "application/json",
+                "X-Goog-Api-Key": STITCH_API_KEY
+            },
         )
+        if adk_cache.ADK_CACHE_ENABLED:
+            # Esquemas de las tools desde disco, sin ir a la red (ver adk_cache.py)
+            _toolset = adk_cache.toolset_class()(
+                connection_params=connection_params,
+                cache_fingerprint=adk_cache.fingerprint(STITCH_MCP_URL, model_router.router.tiers, AGENT_INSTRUCTION),
+            )
+        else:
+            _toolset = McpToolset(connection_params=connection_params)
 
         _session_service = InMemorySessionService()
         _session = await _session_service.create_session(
@@ -72,17 +85,79 @@ async def _initialize():
             user_id=USER_ID
         )
 
-        _runner = Runner(
-            app_name=APP_NAME,
-            agent=root_agent,
-            session_service=_session_service
-        )
+        # Un agente y un runner por tier de modelo (ver model_router.py).
+        # setdefault: respeta runners ya registrados (dobles en tests)
+        for tier in model_router.router.tiers:
+            agent = Agent(
+                name="stitch_agent",
+                model=tier.model,
+                instruction=AGENT_INSTRUCTION,
+                tools=[_toolset] if tier.tools else [],
+            )
+            # CASSETTE_MODE: grabar o reproducir el stream de eventos (ver cassettes.py)
+            model_router.router.runners.setdefault(tier.name, cassettes.wrap_runner(Runner(
+                app_name=APP_NAME,
+                agent=agent,
+                session_service=_session_service
+            )))
+        _runner = model_router.router.runners[model_router.router.default.name]
 
+        metrics.set_gauge("startup.adk_init_s", time.perf_counter() - start)
         logger.info("Stitch ADK client inicializado correctamente")
 
 
-async def generate_with_adk(plan) -> str:
+def _run_config():
+    from google.adk.agents.run_config import RunConfig, StreamingMode
+    return RunConfig(streaming_mode=StreamingMode.SSE if ADK_STREAMING else StreamingMode.NONE)
+
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+
+def _read_image_b64(key: str) -> str:
+    """
+    Lee y codifica en base64 una imagen subida (clave de storage, nunca una ruta del cliente).
+    Se ejecuta fuera del event loop. Lanza ValueError si la clave no vale.
+    """
+    if Path(key).suffix.lower() not in IMAGE_EXTENSIONS:
+        raise ValueError(f"No es una imagen: {key!r}")
+    path = storage.upload_local_path(key)
+    if path is None:
+        raise FileNotFoundError(key)
+    with open(path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+async def _emit(on_progress, stage: str, **data):
+    """Notifica un evento de progreso; un fallo del receptor no interrumpe la generación."""
+    if on_progress is None:
+        return
+    try:
+        await on_progress(stage, data)
+    except Exception as e:
+        logger.debug(f"No se pudo notificar el progreso '{stage}': {e}")
+
+
+async def generate_with_adk(plan, on_progress=None) -> str:
+    """
+    Genera el HTML de `plan` con el agente de Stitch.
+    on_progress: corrutina opcional (stage, data) que recibe los eventos de progreso
+    ("planning", "tool_call", "tool_result", "partial_html", "downloading", "retrying").
+    partial_html trae {offset, chunk}: el HTML parcial es el anterior cortado en `offset`
+    más `chunk` (offset 0 en cada intento nuevo).
+    Cancelar la tarea que llama cierra también el run de ADK en curso.
+    Si el output guard descarta la respuesta se reintenta hasta GUARD_MAX_ATTEMPTS veces
+    y, agotados los intentos, se lanza OutputRejected.
+    """
     await _initialize()
+    from google.genai import types
+
+    tier = model_router.router.choose(plan)
+    runner = model_router.router.runners.get(tier.name, _runner)
+    await _emit(
+        on_progress, "planning",
+        site_type=plan.site_type, sections=plan.sections, style=plan.style, tier=tier.name,
+    )
 
     # Construir partes del mensaje
     parts = []
@@ -91,8 +166,7 @@ async def generate_with_adk(plan) -> str:
     if getattr(plan, 'images', None):
         for image_path in plan.images:
             try:
-                with open(image_path, 'rb') as f:
-                    image_data = base64.b64encode(f.read()).decode('utf-8')
+                image_data = await executors.run_in_thread(_read_image_b64, image_path)
                 ext = Path(image_path).suffix.lower().replace('.', '')
                 mime = f"image/{'jpeg' if ext == 'jpg' else ext}"
                 parts.append(types.Part(
@@ -112,52 +186,163 @@ async def generate_with_adk(plan) -> str:
     )
     if getattr(plan, 'images', None):
         user_text += "Use the provided images in the design. "
+    if getattr(plan, 'context', None):
+        user_text += (
+            "Context from this chat session (previous pages are referenced by id):\n"
+            f"{plan.context}\n"
+        )
+    if getattr(plan, 'base_page_id', None):
+        user_text += f"This request edits page {plan.base_page_id}: keep its structure and apply the changes. "
     if getattr(plan, 'docs', None):
-        user_text += f"Reference these documents: {plan.docs}. "
+        doc_context, _ = await doc_ingestion.build_document_context(
+            plan.docs, f"{getattr(plan, 'prompt', '') or ''} {' '.join(plan.sections)}"
+        )
+        if doc_context:
+            user_text += f"Use this content from the attached documents:\n{doc_context}\n"
     user_text += "Return ONLY the raw HTML code starting with <!DOCTYPE html>."
 
     parts.append(types.Part(text=user_text))
 
-    logger.info(f"Generando página tipo '{plan.site_type}' con {len(parts)-1} imágenes...")
+    logger.info(f"Generando página tipo '{plan.site_type}' con {len(parts)-1} imágenes (tier {tier.name})...")
+
+    retry_hint = types.Part(text=(
+        "Your previous answer was rejected. Respond ONLY with the complete HTML document, "
+        "starting with <!DOCTYPE html>. Do not describe it."
+    ))
 
+    def content_for(attempt: int):
+        return types.Content(role="user", parts=parts if attempt == 1 else parts + [retry_hint])
+
+    return await _generate_on_tier(tier, runner, content_for, on_progress)
+
+
+async def _generate_on_tier(tier, runner, content_for, on_progress=None) -> str:
+    """
+    Intentos de la generación en el runner de `tier`, vigilados por el output guard
+    (`content_for(intento)` da el mensaje de cada intento). La latencia va a
+    router.observe también cuando la generación falla (OutputRejected u otro error):
+    un tier que se cuelga o responde basura tiene que contar para su p95.
+    """
+    start = time.perf_counter()
+    try:
+        for attempt in range(1, GUARD_MAX_ATTEMPTS + 1):
+            attempt_start = time.perf_counter()
+            try:
+                html = await _run_attempt(content_for(attempt), OutputGuard(), on_progress, runner)
+                break
+            except OutputRejected as e:
+                metrics.observe("guard.aborted_after_s", time.perf_counter() - attempt_start)
+                logger.warning(f"Intento {attempt}/{GUARD_MAX_ATTEMPTS} descartado ({e.reason}): {e}")
+                if attempt >= GUARD_MAX_ATTEMPTS:
+                    raise
+                metrics.incr("guard.retries")
+                await _emit(on_progress, "retrying", reason=e.reason, attempt=attempt + 1)
+    except asyncio.CancelledError:
+        raise   # cancelada por el cliente: no dice nada de la latencia del tier
+    except Exception:
+        metrics.incr(f"router.failures.{tier.name}")
+        model_router.router.observe(tier, time.perf_counter() - start)
+        raise
+    model_router.router.observe(tier, time.perf_counter() - start)
+    _record_first_generation()
+    return html
+
+
+def _record_first_generation():
+    global _first_generation_done
+    if not _first_generation_done:
+        _first_generation_done = True
+        metrics.set_gauge("startup.first_generation_s", time.perf_counter() - metrics.STARTED_AT)
+
+
+async def _run_attempt(content, guard: OutputGuard, on_progress=None, runner=None) -> str:
+    """Un run del agente (`runner`, por defecto el del tier por defecto), vigilado por `guard`."""
+    runner = runner or _runner
     # Sesión fresca por cada generación
     session = await _session_service.create_session(app_name=APP_NAME, user_id=USER_ID)
-    content = types.Content(role="user", parts=parts)
 
     html_parts = []
+    streamed = []
     download_url = None
+    # partial_html solo lleva el trozo nuevo: el cliente hace texto[:offset] + chunk.
+    # Vista previa = respuestas finales unidas por "\n" + lo que va llegando del turno actual
+    preview_len = 0
+    turn_start = 0
 
-    async for event in _runner.run_async(
+    # aclosing: si nos cancelan (o el guard aborta), el generador de ADK se cierra ya
+    # y con él la llamada en curso
+    async with aclosing(runner.run_async(
         session_id=session.id,
         user_id=session.user_id,
-        new_message=content
-    ):
-        logger.info(f"EVENT: {event}")
-
-        # Busca URL de descarga en tool results
-        if hasattr(event, 'content') and event.content:
-            for p in event.content.parts:
-                if hasattr(p, 'function_response') and p.function_response:
-                    result = p.function_response.response
-                    logger.info(f"TOOL RESULT: {result}")
-                    if isinstance(result, dict):
-                        for key in ['url', 'download_url', 'file_url', 'link']:
-                            if key in result:
-                                download_url = result[key]
-
-        if event.is_final_response() and event.content and event.content.parts:
-            for p in event.content.parts:
-                if getattr(p, "text", None):
-                    html_parts.append(p.text)
+        new_message=content,
+        run_config=_run_config(),
+    )) as events:
+        async for event in events:
+            logger.info(f"EVENT: {event}")
+
+            # Busca URL de descarga en tool results
+            if hasattr(event, 'content') and event.content:
+                for p in event.content.parts:
+                    if getattr(p, 'function_call', None):
+                        guard.on_tool_call()
+                        await _emit(on_progress, "tool_call", name=p.function_call.name)
+                    if hasattr(p, 'function_response') and p.function_response:
+                        result = p.function_response.response
+                        logger.info(f"TOOL RESULT: {result}")
+                        await _emit(on_progress, "tool_result", name=p.function_response.name)
+                        if isinstance(result, dict):
+                            for key in ['url', 'download_url', 'file_url', 'link']:
+                                if key in result:
+                                    download_url = result[key]
+                                    guard.on_download_url()
+
+            # Texto en streaming: se vigila según llega
+            if getattr(event, 'partial', False) and event.content and event.content.parts:
+                for p in event.content.parts:
+                    if getattr(p, "text", None):
+                        chunk = p.text
+                        if not streamed:
+                            chunk = ("\n" if html_parts else "") + chunk
+                            turn_start = preview_len + len(chunk) - len(p.text)
+                        streamed.append(p.text)
+                        guard.on_text(p.text)
+                        await _emit(on_progress, "partial_html", offset=preview_len, chunk=chunk)
+                        preview_len += len(chunk)
+
+            if event.is_final_response() and event.content and event.content.parts:
+                texts = [p.text for p in event.content.parts if getattr(p, "text", None)]
+                if texts:
+                    turn_text = "\n".join(texts)
+                    if not streamed:
+                        guard.on_text(turn_text)
+                    # Normalmente la respuesta final repite lo ya emitido: solo se manda si cambia
+                    if streamed and "".join(streamed) != turn_text:
+                        await _emit(on_progress, "partial_html", offset=turn_start, chunk=turn_text)
+                        preview_len = turn_start + len(turn_text)
+                    elif not streamed:
+                        chunk = ("\n" if html_parts else "") + turn_text
+                        await _emit(on_progress, "partial_html", offset=preview_len, chunk=chunk)
+                        preview_len += len(chunk)
+                    html_parts.extend(texts)
+                streamed = []
 
     # Si encontró URL de descarga, descarga el HTML
     if download_url:
         logger.info(f"Descargando HTML desde: {download_url}")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(download_url)
-            if response.status_code == 200:
-                return response.text
+        await _emit(on_progress, "downloading", url=download_url)
+        # Con cassettes, el runner graba o sirve la descarga (reproducir no sale a la red)
+        download_html = getattr(runner, "download_html", None) or http_client.download_to_storage
+        try:
+            # Directa al almacenamiento; save_page reutiliza ese objeto como .html de la página
+            download = await download_html(
+                download_url, prefix=file_storage.DOWNLOADS_PREFIX, suffix=".html"
+            )
+            return download.data.decode("utf-8", errors="replace")
+        except Exception as e:
+            logger.warning(f"No se pudo descargar {download_url}: {e}. Se usa la respuesta del modelo")
+            guard.has_download = False
 
     result = "\n".join(html_parts)
+    guard.finish(result)
     logger.info(f"Página generada: {len(result)} caracteres")
-    return result
\ No newline at end of file
+    return result
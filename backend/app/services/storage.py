@@ -0,0 +1,567 @@
+"""
+storage.py
+Backend de almacenamiento de los ficheros de uploads/ (páginas .html/.json e imágenes/
+documentos subidos). Las claves son nombres lógicos ("2026-02-19_landing_a3f2b1.html");
+dónde acaban físicamente lo decide el backend.
+
+- LocalStorage (STORAGE_BACKEND=local, por defecto): fan-out por hash de la clave en
+  subdirectorios (uploads/3f/a2/{clave}) para que ningún directorio tenga cientos de miles
+  de entradas; escritura atómica (fichero temporal + os.replace). Lee también la ruta plana
+  antigua, así el re-sharding se puede hacer en caliente.
+- S3Storage (STORAGE_BACKEND=s3): cualquier servicio compatible con S3 (S3_ENDPOINT_URL
+  apunta a MinIO, LocalStack o moto para probar en local). Requiere `boto3`. Las lecturas
+  cacheadas se validan con un GET condicional (If-None-Match), sin HEAD previo. Las copias
+  locales de local_path() viven en una cache en disco acotada (S3_CACHE_MAX_BYTES, expiran
+  tras S3_CACHE_TTL_S sin usarse; se desaloja primero la usada hace más tiempo).
+
+index.json y downloads/ no son objetos del backend: son estado local del host.
+
+Re-sharding en caliente del directorio plano existente:
+    python -m app.services.storage reshard [--dry-run]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from fastapi import Request
+from fastapi.responses import Response, FileResponse, RedirectResponse
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+LOCAL_STORAGE_ROOT = os.getenv(
+    "LOCAL_STORAGE_ROOT",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'uploads'))
+)
+STORAGE_FANOUT_LEVELS = int(os.getenv("STORAGE_FANOUT_LEVELS", 2))
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "uploads/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_PRESIGN_EXPIRES_S = int(os.getenv("S3_PRESIGN_EXPIRES_S", 3600))
+S3_CACHE_MAX_BYTES = int(os.getenv("S3_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+S3_CACHE_TTL_S = float(os.getenv("S3_CACHE_TTL_S", 24 * 3600))
+RESHARD_BATCH = int(os.getenv("RESHARD_BATCH", 500))
+RESHARD_PAUSE_S = float(os.getenv("RESHARD_PAUSE_S", 0.05))
+STREAM_CHUNK_BYTES = int(os.getenv("STORAGE_STREAM_CHUNK_BYTES", 256 * 1024))
+
+# Nombres del directorio raíz que no son objetos (estado local del file store)
+RESERVED_NAMES = {"index.json", "downloads"}
+
+
+class InvalidKey(ValueError):
+    """Clave con componentes no permitidos (.., rutas absolutas, nombres reservados)."""
+
+
+@dataclass(frozen=True)
+class ObjectStat:
+    key: str
+    size: int
+    mtime: float
+    version: object    # cambia con cada reescritura (inodo/mtime/tamaño en local, ETag en S3)
+
+
+def _check_key(key: str) -> str:
+    parts = key.split("/")
+    if (not key or key.startswith("/") or "\\" in key or any(p in ("", ".", "..") for p in parts)
+            or parts[0] in RESERVED_NAMES):
+        raise InvalidKey(f"Clave no válida: {key!r}")
+    return key
+
+
+# Ficheros subidos con /generate/upload: {uuid4.hex}_{nombre original}, en la raíz.
+# Son las únicas claves que pueden nombrar PromptDTO.images / PromptDTO.docs.
+UPLOAD_KEY_RE = re.compile(r"^[0-9a-f]{32}_[^/\\]+$")
+
+
+def upload_key(filename: str) -> str:
+    """Clave nueva para un fichero subido."""
+    name = os.path.basename((filename or "").replace("\\", "/")) or "file"
+    return f"{uuid.uuid4().hex}_{name}"
+
+
+def check_upload_key(key: str) -> str:
+    """Lanza InvalidKey si `key` no es una clave de fichero subido (rutas, .., otros objetos)."""
+    if not isinstance(key, str) or not UPLOAD_KEY_RE.match(key):
+        raise InvalidKey(f"No es un fichero subido: {key!r}")
+    return _check_key(key)
+
+
+def upload_local_path(key: str) -> str | None:
+    """Ruta local legible de un fichero subido (None si no existe). Lanza InvalidKey como check_upload_key."""
+    return backend().local_path(check_upload_key(key))
+
+
+class StorageBackend(ABC):
+    """Interfaz común. Todas las operaciones son bloqueantes (usar executors.run_in_thread)."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str | None = None):
+        ...
+
+    @abstractmethod
+    def open_writer(self) -> "ObjectWriter":
+        """Escritura en streaming de un objeto cuya clave se decide al final (ver ObjectWriter)."""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    def stat(self, key: str) -> ObjectStat | None:
+        ...
+
+    def get_if_changed(self, key: str, version=None) -> tuple:
+        """
+        (stat, contenido) del objeto. stat None: no existe; contenido None: su versión sigue
+        siendo `version` (quien llama ya lo tiene). Por defecto stat + get; los backends
+        remotos lo hacen en una sola petición condicional.
+        """
+        stat = self.stat(key)
+        if stat is None or (version is not None and stat.version == version):
+            return stat, None
+        data = self.get(key)
+        return (stat, data) if data is not None else (None, None)
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Borra el objeto si existe. True si se ha borrado (los backends que no lo saben, True)."""
+
+    @abstractmethod
+    def iter_objects(self):
+        """Itera ObjectStat de todos los objetos."""
+
+    @abstractmethod
+    def iter_chunks(self, key: str, offset: int = 0, chunk_size: int = STREAM_CHUNK_BYTES):
+        """
+        Itera el contenido del objeto desde `offset` en trozos (sin cargarlo entero en memoria).
+        FileNotFoundError si el objeto no existe (también si se borra antes de empezar a leer).
+        """
+
+    @abstractmethod
+    def local_path(self, key: str) -> str | None:
+        """Ruta local legible del objeto (para quien necesita un fichero: ADK, extracción de docs)."""
+
+    @abstractmethod
+    def response(self, key: str, request: Request) -> Response | None:
+        """Respuesta HTTP que sirve el objeto en GET /uploads/{key}, o None si no existe."""
+
+
+class ObjectWriter(ABC):
+    """
+    Objeto en construcción: write() por trozos y commit(clave) al final (la clave puede
+    depender del contenido, p. ej. su SHA-256). abort() descarta lo escrito.
+    Bloqueante como el resto del backend.
+    """
+
+    @abstractmethod
+    def write(self, data: bytes):
+        ...
+
+    @abstractmethod
+    def commit(self, key: str, content_type: str | None = None):
+        ...
+
+    @abstractmethod
+    def abort(self):
+        ...
+
+
+class _LocalWriter(ObjectWriter):
+
+    def __init__(self, storage: "LocalStorage"):
+        self.storage = storage
+        os.makedirs(storage.root, exist_ok=True)
+        self.tmp = os.path.join(storage.root, f".{uuid.uuid4().hex}.tmp")
+        self.file = open(self.tmp, "wb")
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def commit(self, key: str, content_type: str | None = None):
+        path = self.storage.path(key)
+        self.file.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp, path)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp)
+        except FileNotFoundError:
+            pass
+
+
+class LocalStorage(StorageBackend):
+
+    def __init__(self, root: str = LOCAL_STORAGE_ROOT, levels: int = STORAGE_FANOUT_LEVELS):
+        self.root = root
+        self.levels = levels
+
+    def path(self, key: str) -> str:
+        """Ruta con fan-out: {raíz}/{subcarpeta de la clave}/{aa}/{bb}/{nombre}."""
+        _check_key(key)
+        directory, name = os.path.split(key)
+        digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+        shards = [digest[2 * i:2 * i + 2] for i in range(self.levels)]
+        return os.path.join(self.root, directory, *shards, name)
+
+    def _legacy_path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _find(self, key: str) -> str | None:
+        path = self.path(key)
+        if os.path.exists(path):
+            return path
+        legacy = self._legacy_path(key)
+        if legacy != path and os.path.isfile(legacy):
+            return legacy
+        # El re-sharding puede haberlo movido entre las dos comprobaciones
+        return path if os.path.exists(path) else None
+
+    def put(self, key: str, data: bytes, content_type: str | None = None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Único por proceso y por hilo: dos put() simultáneos de la misma clave no comparten temporal
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        legacy = self._legacy_path(key)
+        if legacy != path and os.path.isfile(legacy):
+            os.remove(legacy)   # la copia plana antigua quedaría obsoleta
+
+    def open_writer(self) -> ObjectWriter:
+        return _LocalWriter(self)
+
+    def get(self, key: str) -> bytes | None:
+        path = self._find(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def stat(self, key: str) -> ObjectStat | None:
+        path = self._find(key)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return ObjectStat(key, st.st_size, st.st_mtime, (st.st_ino, st.st_mtime_ns, st.st_size))
+
+    def delete(self, key: str) -> bool:
+        deleted = False
+        for path in {self.path(key), self._legacy_path(key)}:
+            try:
+                os.remove(path)
+                deleted = True
+            except (FileNotFoundError, IsADirectoryError):
+                pass
+        return deleted
+
+    def _key_for(self, rel_path: str) -> str:
+        """Clave de un fichero a partir de su ruta relativa (con fan-out o plana antigua)."""
+        parts = rel_path.split(os.sep)
+        if len(parts) > self.levels:
+            key = "/".join(parts[:len(parts) - 1 - self.levels] + parts[-1:])
+            if self.path(key) == os.path.join(self.root, rel_path):
+                return key
+        return "/".join(parts)
+
+    def iter_objects(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d not in RESERVED_NAMES]
+            for name in filenames:
+                if name.endswith(".tmp") or (dirpath == self.root and name in RESERVED_NAMES):
+                    continue
+                full = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full)
+                except FileNotFoundError:
+                    continue
+                key = self._key_for(os.path.relpath(full, self.root))
+                yield ObjectStat(key, st.st_size, st.st_mtime, (st.st_ino, st.st_mtime_ns, st.st_size))
+
+    def iter_chunks(self, key: str, offset: int = 0, chunk_size: int = STREAM_CHUNK_BYTES):
+        path = self._find(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def local_path(self, key: str) -> str | None:
+        return self._find(key)
+
+    def response(self, key: str, request: Request) -> Response | None:
+        path = self._find(key)
+        if path is None:
+            return None
+        return FileResponse(path, filename=None)
+
+    def reshard(self, dry_run: bool = False, batch: int = RESHARD_BATCH, pause_s: float = RESHARD_PAUSE_S) -> dict:
+        """
+        Mueve los ficheros planos del directorio raíz a su ruta con fan-out.
+        Seguro en caliente: cada movimiento es un os.replace atómico y los lectores
+        buscan en las dos rutas. Se pausa entre lotes para no saturar el disco.
+        """
+        report = {"moved": 0, "bytes": 0, "skipped": 0, "seconds": 0.0}
+        start = time.perf_counter()
+        with os.scandir(self.root) as it:
+            entries = [e for e in it if e.is_file() and e.name not in RESERVED_NAMES and not e.name.endswith(".tmp")]
+        for i, entry in enumerate(entries, 1):
+            target = self.path(entry.name)
+            if target == entry.path:
+                report["skipped"] += 1
+                continue
+            size = entry.stat().st_size
+            if not dry_run:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.exists(target):
+                    os.remove(entry.path)   # ya se escribió una versión nueva con fan-out
+                else:
+                    os.replace(entry.path, target)
+            report["moved"] += 1
+            report["bytes"] += size
+            if i % batch == 0:
+                logger.info(f"Re-sharding: {i}/{len(entries)} ficheros")
+                time.sleep(pause_s)
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+
+class _S3Writer(ObjectWriter):
+    """Acumula en un temporal (en memoria hasta 8 MB) y lo sube con upload_fileobj al hacer commit."""
+
+    def __init__(self, storage: "S3Storage"):
+        self.storage = storage
+        self.file = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def commit(self, key: str, content_type: str | None = None):
+        self.file.seek(0)
+        extra = {"ContentType": content_type} if content_type else {}
+        try:
+            self.storage.client.upload_fileobj(
+                self.file, self.storage.bucket, self.storage._object_key(key), ExtraArgs=extra,
+            )
+        finally:
+            self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class S3Storage(StorageBackend):
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: str | None = S3_ENDPOINT_URL,
+                 cache_dir: str | None = None, client=None):
+        from app.services import shared_state
+
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requiere S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.cache_dir = cache_dir or os.path.join(shared_state.STATE_DIR, "s3_cache")
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{_check_key(key)}"
+
+    def _error_code(self, error) -> str:
+        return str(error.response.get("Error", {}).get("Code"))
+
+    def _not_found(self, error) -> bool:
+        return self._error_code(error) in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, key: str, data: bytes, content_type: str | None = None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, **extra)
+
+    def open_writer(self) -> ObjectWriter:
+        return _S3Writer(self)
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))["Body"].read()
+        except self.client.exceptions.ClientError as e:
+            if self._not_found(e):
+                return None
+            raise
+
+    def stat(self, key: str) -> ObjectStat | None:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self.client.exceptions.ClientError as e:
+            if self._not_found(e):
+                return None
+            raise
+        return ObjectStat(key, head["ContentLength"], head["LastModified"].timestamp(), head["ETag"])
+
+    def get_if_changed(self, key: str, version=None) -> tuple:
+        """Un solo GET condicional (If-None-Match con el ETag conocido) en vez de HEAD + GET."""
+        extra = {"IfNoneMatch": version} if version else {}
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), **extra)
+        except self.client.exceptions.ClientError as e:
+            if self._not_found(e):
+                return None, None
+            if self._error_code(e) in ("304", "NotModified"):
+                # Un 304 no trae tamaño ni fecha: solo confirma la versión
+                return ObjectStat(key, 0, 0.0, version), None
+            raise
+        data = obj["Body"].read()
+        return ObjectStat(key, obj["ContentLength"], obj["LastModified"].timestamp(), obj["ETag"]), data
+
+    def delete(self, key: str) -> bool:
+        # DELETE de S3 es idempotente (204 aunque no exista): sin HEAD previo
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return True
+
+    def iter_objects(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                yield ObjectStat(
+                    obj["Key"][len(self.prefix):], obj["Size"], obj["LastModified"].timestamp(), obj["ETag"]
+                )
+
+    def iter_chunks(self, key: str, offset: int = 0, chunk_size: int = STREAM_CHUNK_BYTES):
+        extra = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), **extra)["Body"]
+        except self.client.exceptions.ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def local_path(self, key: str) -> str | None:
+        """Descarga el objeto a la cache local (una vez por versión) y devuelve su ruta."""
+        stat = self.stat(key)
+        if stat is None:
+            return None
+        version = hashlib.md5(f"{key}:{stat.version}".encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f"{version}_{os.path.basename(key)}")
+        try:
+            os.utime(path)     # el mtime hace de "último uso" para el LRU (compartido entre workers)
+            metrics.incr("storage.s3_cache.hits")
+            return path
+        except FileNotFoundError:
+            pass
+        metrics.incr("storage.s3_cache.misses")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        self.evict_cache(keep=path)
+        return path
+
+    def evict_cache(self, keep: str | None = None) -> int:
+        """
+        Borra de la cache local las copias sin usar desde hace S3_CACHE_TTL_S y, si aún se pasa
+        de S3_CACHE_MAX_BYTES, las usadas hace más tiempo. `keep` (la recién descargada) no se
+        toca. Los .tmp de descargas en curso solo se borran si han caducado. Devuelve cuántas borra.
+        """
+        now = time.time()
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue    # desalojado por otro worker
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            return 0
+
+        removed, total = 0, sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            expired = now - mtime > S3_CACHE_TTL_S
+            if path == keep or not (expired or (total > S3_CACHE_MAX_BYTES and not path.endswith(".tmp"))):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        if removed:
+            metrics.incr("storage.s3_cache.evictions", removed)
+        metrics.set_gauge("storage.s3_cache.bytes", total)
+        return removed
+
+    def response(self, key: str, request: Request) -> Response | None:
+        if self.stat(key) is None:
+            return None
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=S3_PRESIGN_EXPIRES_S,
+        )
+        return RedirectResponse(url, status_code=307)
+
+
+_backend = None
+
+
+def backend() -> StorageBackend:
+    """Backend configurado con STORAGE_BACKEND (singleton del proceso)."""
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "s3":
+            _backend = S3Storage()
+        else:
+            _backend = LocalStorage()
+        logger.info(f"Almacenamiento de uploads: {type(_backend).__name__}")
+    return _backend
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command != "reshard":
+        print("Uso: python -m app.services.storage reshard [--dry-run]")
+        sys.exit(1)
+    result = LocalStorage().reshard(dry_run="--dry-run" in sys.argv)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
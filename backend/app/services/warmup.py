@@ -0,0 +1,128 @@
+"""
+warmup.py
+Calentamiento en segundo plano al arrancar: comprobación de BD (create_all) e
+inicialización de ADK/MCP, para que la réplica acepte tráfico enseguida y el
+primer usuario no pague la conexión con Stitch.
+
+/healthz → el proceso está vivo
+/readyz  → el warm-up ha terminado (BD verificada y runner de ADK listo)
+
+En segundo plano los pasos se reintentan sin límite (/readyz sigue en 503 hasta que
+funcionen). Con STARTUP_MODE=blocking se acotan con WARMUP_MAX_ATTEMPTS y
+WARMUP_DEADLINE_S: si no lo consiguen, el arranque falla en vez de quedarse colgado.
+"""
+
+import os
+import asyncio
+import logging
+import time
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Reintentos del warm-up si la BD o Stitch todavía no están disponibles
+RETRY_BASE_DELAY_S = 1.0
+RETRY_MAX_DELAY_S = 30.0
+# Límites en modo blocking (0 = sin límite)
+WARMUP_MAX_ATTEMPTS = int(os.getenv("WARMUP_MAX_ATTEMPTS", 10))
+WARMUP_DEADLINE_S = float(os.getenv("WARMUP_DEADLINE_S", 120))
+
+
+class WarmupFailed(RuntimeError):
+    """Un paso del warm-up no ha tenido éxito dentro de sus intentos o su plazo."""
+
+state = {
+    "ready": False,
+    "steps": {},      # step → {"ok": bool, "seconds": float, "error": str | None}
+}
+
+
+def _check_database():
+    """Comprueba la conexión y crea/verifica las tablas (bloqueante, se ejecuta en un hilo)."""
+    from app.db.database import engine, test_connection, db_partitioned
+    from app.db import models, migrations, partitioning
+
+    if not test_connection():
+        raise RuntimeError("No se pudo conectar a la BD")
+    models.Base.metadata.create_all(bind=engine)
+    if db_partitioned:
+        partitioning.ensure_partitions(engine)
+    migrations.check_search_vector(engine)
+    logger.info("Tablas creadas/verificadas correctamente")
+
+
+async def _init_adk():
+    """Importa ADK y abre el toolset de Stitch (la primera generación ya no lo paga)."""
+    from app.services import stitch_adk_client, cassettes
+    await stitch_adk_client._initialize()
+    if cassettes.CASSETTE_MODE == "replay":
+        return  # las cassettes no necesitan conexión con Stitch
+    # Abre la sesión MCP y descubre las tools de Stitch fuera del camino crítico
+    await stitch_adk_client._toolset.get_tools()
+
+
+async def _run_step(name: str, func, max_attempts: int = 0, deadline: float | None = None):
+    """
+    Ejecuta un paso con reintentos y backoff exponencial hasta que tenga éxito.
+    `max_attempts` (0 = sin límite) y `deadline` (time.monotonic(), None = sin plazo)
+    acotan los reintentos: al agotarlos se lanza WarmupFailed.
+    """
+    delay = RETRY_BASE_DELAY_S
+    attempt = 0
+    while True:
+        attempt += 1
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                await func()
+            else:
+                await asyncio.to_thread(func)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            state["steps"][name] = {"ok": False, "seconds": elapsed, "error": str(e)}
+            metrics.incr(f"startup.{name}.errors")
+            out_of_attempts = max_attempts and attempt >= max_attempts
+            out_of_time = deadline is not None and time.monotonic() + delay > deadline
+            if out_of_attempts or out_of_time:
+                logger.error(f"Warm-up '{name}' abandonado tras {attempt} intentos: {e}")
+                raise WarmupFailed(f"Warm-up '{name}' fallido tras {attempt} intentos: {e}") from e
+            logger.warning(f"Warm-up '{name}' falló ({e}); reintento en {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY_S)
+            continue
+
+        elapsed = time.perf_counter() - start
+        state["steps"][name] = {"ok": True, "seconds": elapsed, "error": None}
+        metrics.set_gauge(f"startup.{name}_s", elapsed)
+        logger.info(f"Warm-up '{name}' completado en {elapsed:.2f}s")
+        return
+
+
+async def warm_up(blocking: bool = False):
+    """
+    Ejecuta en paralelo los pasos de calentamiento y marca la réplica como lista.
+    `blocking`: con límite de intentos/plazo; si un paso falla se cancelan los demás
+    y se propaga WarmupFailed (el arranque de la app falla).
+    """
+    start = time.perf_counter()
+    max_attempts = WARMUP_MAX_ATTEMPTS if blocking else 0
+    deadline = time.monotonic() + WARMUP_DEADLINE_S if blocking and WARMUP_DEADLINE_S > 0 else None
+    tasks = [
+        asyncio.create_task(_run_step("database", _check_database, max_attempts, deadline)),
+        asyncio.create_task(_run_step("adk", _init_adk, max_attempts, deadline)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    elapsed = time.perf_counter() - start
+    state["ready"] = True
+    metrics.set_gauge("startup.warmup_s", elapsed)
+    logger.info(f"Warm-up completo en {elapsed:.2f}s — réplica lista")
+
+
+def is_ready() -> bool:
+    return state["ready"]
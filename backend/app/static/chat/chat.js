@@ -0,0 +1,289 @@
+function getSessionId() {
+    let sid = localStorage.getItem('session_id');
+    if (!sid) {
+        sid = crypto.randomUUID();
+        localStorage.setItem('session_id', sid);
+    }
+    return sid;
+}
+
+const SESSION_ID = getSessionId();
+const messageInput = document.getElementById('messageInput');
+const sendBtn = document.getElementById('sendBtn');
+const messagesDiv = document.getElementById('messages');
+
+messageInput.addEventListener('keypress', (e) => {
+    if (e.key === 'Enter' && !e.shiftKey) {
+        e.preventDefault();
+        sendMessage();
+    }
+});
+
+function updateFileLabel() {
+    const files = document.getElementById('fileInput').files;
+    const fileBtn = document.getElementById('fileBtn');
+    if (files.length > 0) {
+        fileBtn.textContent = `📎 ${files.length}`;
+        fileBtn.style.background = '#667eea';
+        fileBtn.style.color = 'white';
+    } else {
+        fileBtn.textContent = '📎';
+        fileBtn.style.background = '#e0e0e0';
+        fileBtn.style.color = '#333';
+    }
+}
+
+// --- WebSocket del chat: una conexión por pestaña, progreso en vivo y cancelación ---
+
+const STAGE_LABELS = {
+    planning: 'Planificando la página…',
+    tool_call: 'Llamando a Stitch…',
+    tool_result: 'Procesando la respuesta de Stitch…',
+    partial_html: 'Recibiendo el HTML…',
+    downloading: 'Descargando el resultado…',
+    retrying: 'La respuesta no era válida, reintentando…',
+    speculative_hit: 'Aprovechando la generación anticipada…',
+};
+const HEARTBEAT_TIMEOUT_MS = 60000;
+
+let socket = null;
+let reconnectDelay = 1000;
+let lastHeartbeat = 0;
+const pending = new Map();   // id de la petición → div de carga
+const partials = new Map();  // id de la petición → HTML recibido hasta ahora
+const PREVIEW_TAIL_CHARS = 400;
+
+function connectSocket() {
+    const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+    socket = new WebSocket(`${protocol}://${location.host}/ws/chat/${encodeURIComponent(SESSION_ID)}`);
+
+    socket.onopen = () => {
+        reconnectDelay = 1000;
+        lastHeartbeat = Date.now();
+    };
+    socket.onmessage = (event) => handleSocketMessage(JSON.parse(event.data));
+    socket.onclose = () => {
+        // Las generaciones en curso se cancelan en el servidor al cerrarse la conexión
+        for (const id of pending.keys()) {
+            finishPending(id);
+            addTextMessage('Conexión perdida: la generación se ha interrumpido.');
+        }
+        setTimeout(connectSocket, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+    };
+}
+
+function socketReady() {
+    return socket && socket.readyState === WebSocket.OPEN;
+}
+
+// Si el servidor deja de latir, cerramos para forzar la reconexión
+setInterval(() => {
+    if (socketReady() && Date.now() - lastHeartbeat > HEARTBEAT_TIMEOUT_MS) {
+        socket.close();
+    }
+}, 10000);
+
+function handleSocketMessage(data) {
+    lastHeartbeat = Date.now();
+    const loadingDiv = pending.get(data.id);
+
+    if (data.type === 'progress' && loadingDiv) {
+        let label = STAGE_LABELS[data.stage] || data.stage;
+        if (data.stage === 'partial_html') {
+            // Solo llega el trozo nuevo: se corta en `offset` y se añade
+            const html = (partials.get(data.id) || '').slice(0, data.offset) + data.chunk;
+            partials.set(data.id, html);
+            label += ` (${(html.length / 1024).toFixed(1)} KB)`;
+            const preview = loadingDiv.querySelector('.partial-preview');
+            if (preview) preview.textContent = html.slice(-PREVIEW_TAIL_CHARS);
+        } else if (data.stage === 'retrying') {
+            partials.delete(data.id);
+        }
+        loadingDiv.querySelector('.progress-stage').textContent = label;
+    } else if (data.type === 'result') {
+        finishPending(data.id);
+        addAgentMessage(data.response, data.html_file, data.json_file, data.page_id);
+    } else if (data.type === 'error') {
+        finishPending(data.id);
+        addTextMessage(data.message);
+    } else if (data.type === 'cancelled') {
+        finishPending(data.id);
+        addTextMessage('Generación cancelada.');
+    }
+}
+
+// --- Borradores para la pre-generación especulativa (ver speculation.py) ---
+
+const DRAFT_DEBOUNCE_MS = 700;
+const DRAFT_CONFIRM_MS = 1500;
+let draftTimer = null;
+
+function sendDraft() {
+    const message = messageInput.value.trim();
+    if (!message || !socketReady() || document.getElementById('fileInput').files.length > 0) return;
+    socket.send(JSON.stringify({ type: 'draft', message }));
+    // Si el texto sigue igual, un segundo borrador confirma que el plan es estable
+    draftTimer = setTimeout(() => {
+        if (messageInput.value.trim() === message && socketReady()) {
+            socket.send(JSON.stringify({ type: 'draft', message }));
+        }
+    }, DRAFT_CONFIRM_MS);
+}
+
+messageInput.addEventListener('input', () => {
+    clearTimeout(draftTimer);
+    draftTimer = setTimeout(sendDraft, DRAFT_DEBOUNCE_MS);
+});
+
+function finishPending(id) {
+    const loadingDiv = pending.get(id);
+    if (loadingDiv) loadingDiv.remove();
+    pending.delete(id);
+    partials.delete(id);
+}
+
+function cancelGeneration(id) {
+    if (socketReady()) {
+        socket.send(JSON.stringify({ type: 'cancel', id }));
+    }
+}
+
+function addLoadingMessage(id) {
+    const loadingDiv = document.createElement('div');
+    loadingDiv.className = 'message agent';
+    loadingDiv.innerHTML = '<div class="message-content typing-indicator"><span></span><span></span><span></span></div>';
+    if (id) {
+        loadingDiv.innerHTML += '<div class="progress-bar"><span class="progress-stage">En cola…</span>'
+            + '<button class="cancel-btn">Cancelar</button></div><pre class="partial-preview"></pre>';
+        loadingDiv.querySelector('.cancel-btn').addEventListener('click', () => cancelGeneration(id));
+    }
+    messagesDiv.appendChild(loadingDiv);
+    scrollToBottom();
+    return loadingDiv;
+}
+
+async function sendMessage() {
+    const message = messageInput.value.trim();
+    const files = document.getElementById('fileInput').files;
+    if (!message) return;
+
+    addUserMessage(message);
+    messageInput.value = '';
+    clearTimeout(draftTimer);
+
+    // Sin adjuntos y con el socket abierto: varias generaciones a la vez, con progreso
+    if (files.length === 0 && socketReady()) {
+        const id = crypto.randomUUID();
+        pending.set(id, addLoadingMessage(id));
+        socket.send(JSON.stringify({ type: 'message', id, message }));
+        messageInput.focus();
+        return;
+    }
+
+    sendBtn.disabled = true;
+    const loadingDiv = addLoadingMessage(null);
+
+    try {
+        let response;
+
+        if (files.length > 0) {
+            const formData = new FormData();
+            formData.append('prompt', message);
+            for (const file of files) {
+                if (file.type.startsWith('image/')) {
+                    formData.append('images', file);
+                } else {
+                    formData.append('docs', file);
+                }
+            }
+            response = await fetch('/generate/upload', {
+                method: 'POST',
+                body: formData
+            });
+            document.getElementById('fileInput').value = '';
+            updateFileLabel();
+        } else {
+            response = await fetch('/api/chat/message', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ message, session_id: SESSION_ID })
+            });
+        }
+
+        loadingDiv.remove();
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+
+        const data = await response.json();
+        addAgentMessage(
+            data.html || data.response,
+            data.html_file,
+            data.json_file,
+            data.page_id
+        );
+
+    } catch (error) {
+        loadingDiv.remove();
+        addTextMessage(`Error: ${error.message}`);
+    } finally {
+        sendBtn.disabled = false;
+        messageInput.focus();
+    }
+}
+
+function addUserMessage(text) {
+    const div = document.createElement('div');
+    div.className = 'message user';
+    div.innerHTML = `<div class="message-content">${escapeHtml(text)}</div>`;
+    messagesDiv.appendChild(div);
+    scrollToBottom();
+}
+
+function addAgentMessage(html, htmlFile, jsonFile, pageId) {
+    const div = document.createElement('div');
+    div.className = 'message agent';
+
+    let content = '';
+
+    if (html && (html.trim().startsWith('<!DOCTYPE') || html.trim().startsWith('<html'))) {
+        const encoded = html.replace(/"/g, '&quot;');
+        content += `<iframe srcdoc="${encoded}"></iframe>`;
+    } else if (html) {
+        content += `<div class="message-content">${escapeHtml(html)}</div>`;
+    }
+
+    if (htmlFile || jsonFile) {
+        content += `<div style="display:flex; gap:8px; flex-wrap:wrap; margin-top:8px;">`;
+        if (htmlFile) {
+            content += `<span class="file-badge">📄 <a href="/uploads/${htmlFile}" target="_blank">${htmlFile}</a></span>`;
+        }
+        if (jsonFile) {
+            content += `<span class="file-badge">🗂️ <a href="/uploads/${jsonFile}" target="_blank">${jsonFile}</a></span>`;
+        }
+        content += `</div>`;
+    }
+
+    div.innerHTML = content;
+    messagesDiv.appendChild(div);
+    scrollToBottom();
+}
+
+function addTextMessage(text) {
+    const div = document.createElement('div');
+    div.className = 'message agent';
+    div.innerHTML = `<div class="message-content">${escapeHtml(text)}</div>`;
+    messagesDiv.appendChild(div);
+    scrollToBottom();
+}
+
+function scrollToBottom() {
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+}
+
+function escapeHtml(text) {
+    const map = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#039;' };
+    return text.replace(/[&<>"']/g, m => map[m]);
+}
+
+connectSocket();
+messageInput.focus();
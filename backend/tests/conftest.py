@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""
+Configuración común de los tests: todo el estado (shared_state, almacenamiento, BD SQLite,
+índice de búsqueda, caches) va a un directorio temporal. Las variables de entorno se fijan
+antes de importar `app`, porque los módulos leen su configuración al importarse.
+"""
+
+import os
+import sys
+import tempfile
+
+_ROOT = tempfile.mkdtemp(prefix="awg-tests-")
+os.environ.setdefault("SHARED_STATE_DIR", os.path.join(_ROOT, "state"))
+os.environ.setdefault("LOCAL_STORAGE_ROOT", os.path.join(_ROOT, "uploads"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_ROOT, 'app.db')}")
+os.environ.setdefault("ARCHIVE_DIR", os.path.join(_ROOT, "archive"))
+os.environ.setdefault("STORAGE_BACKEND", "local")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def file_store(tmp_path, monkeypatch):
+    """file_storage + LocalStorage sobre un directorio vacío (el índice en memoria se reinicia)."""
+    from app.services import file_storage, storage
+
+    root = str(tmp_path / "uploads")
+    monkeypatch.setattr(file_storage, "BASE_DIR", root)
+    monkeypatch.setattr(file_storage, "INDEX_FILE", os.path.join(root, "index.json"))
+    monkeypatch.setattr(file_storage, "DOWNLOADS_DIR", os.path.join(root, "downloads"))
+    monkeypatch.setattr(storage, "_backend", storage.LocalStorage(root))
+    file_storage._index_cache.update(key=None, entries=[], by_id={}, by_session={})
+    file_storage._page_cache.clear()
+    return file_storage
+
+
+@pytest.fixture
+def db():
+    """Sesión sobre la BD SQLite de los tests, con las tablas creadas."""
+    from app.db.database import SessionLocal, Base, engine
+    from app.db import models  # noqa: F401  (registra las tablas)
+
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,182 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Cache en disco de las tools de Stitch, con una sesión MCP de prueba en lugar del servidor."""
+
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import adk_cache, metrics
+from app.services.model_router import Tier
+
+SCHEMAS = [
+    {"name": "generate_screen", "inputSchema": {"type": "object", "properties": {"prompt": {"type": "string"}}}},
+    {"name": "get_screen", "inputSchema": {"type": "object", "properties": {"id": {"type": "string"}}}},
+]
+
+
+class _Schema:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def model_dump(self, **kwargs) -> dict:
+        return json.loads(json.dumps(self.data))
+
+
+class FakeMcpServer:
+    """Sesión MCP de prueba: cuenta los list_tools y permite cambiar los esquemas."""
+
+    def __init__(self, schemas: list):
+        self.schemas = schemas
+        self.list_calls = 0
+
+    async def create_session(self):
+        return self
+
+    async def list_tools(self):
+        self.list_calls += 1
+        await asyncio.sleep(0)
+        return SimpleNamespace(tools=[_Schema(s) for s in self.schemas])
+
+
+class _NetworkToolset:
+    async def get_tools(self, readonly_context=None):
+        return ["sin-cache"]
+
+
+class FakeToolset(adk_cache.ToolCache, _NetworkToolset):
+    """Como CachedMcpToolset, pero las "tools" son los nombres de los esquemas."""
+
+    def __init__(self, server: FakeMcpServer, fingerprint: str = "fp-1"):
+        self._mcp_session_manager = server
+        self._init_cache(fingerprint)
+
+    def _build(self, schemas: list) -> list:
+        if any("name" not in s for s in schemas):
+            raise ValueError("esquema sin nombre")
+        return [s["name"] for s in schemas]
+
+
+class SchemaError(Exception):
+    """Como mcp.shared.exceptions.McpError: el código JSON-RPC va en .error.code."""
+
+    def __init__(self, code: int):
+        super().__init__(f"error {code}")
+        self.error = SimpleNamespace(code=code)
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "adk_tools.json"
+    monkeypatch.setattr(adk_cache, "ADK_CACHE_PATH", str(path))
+    monkeypatch.setattr(adk_cache, "ADK_CACHE_TTL_S", 3600)
+    monkeypatch.setattr(adk_cache, "ADK_CACHE_REFRESH_S", 600)
+    return path
+
+
+def _counter(name: str) -> int:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+
+def test_miss_then_hit_without_network(cache_path):
+    server = FakeMcpServer(SCHEMAS)
+    assert asyncio.run(FakeToolset(server).get_tools()) == ["generate_screen", "get_screen"]
+    assert server.list_calls == 1 and cache_path.exists()
+
+    hits = _counter("adk_cache.hits")
+    assert asyncio.run(FakeToolset(server).get_tools()) == ["generate_screen", "get_screen"]
+    assert server.list_calls == 1
+    assert _counter("adk_cache.hits") == hits + 1
+
+
+def test_expired_cache_is_rediscovered(cache_path):
+    server = FakeMcpServer(SCHEMAS)
+    asyncio.run(FakeToolset(server).get_tools())
+    entry = json.loads(cache_path.read_text())
+    entry["fetched_at"] = time.time() - 7200
+    cache_path.write_text(json.dumps(entry))
+
+    expired = _counter("adk_cache.invalidated.expired")
+    asyncio.run(FakeToolset(server).get_tools())
+    assert server.list_calls == 2
+    assert _counter("adk_cache.invalidated.expired") == expired + 1
+    assert json.loads(cache_path.read_text())["fetched_at"] > entry["fetched_at"]
+
+
+def test_fingerprint_change_invalidates(cache_path):
+    tiers = [Tier(name="flash", model="gemini-2.5-flash", tools=True)]
+    fp = adk_cache.fingerprint("https://stitch.example/mcp", tiers, "instrucción")
+    assert fp == adk_cache.fingerprint("https://stitch.example/mcp", tiers, "instrucción")
+    assert fp != adk_cache.fingerprint("https://stitch.example/mcp", tiers, "otra instrucción")
+    assert fp != adk_cache.fingerprint("https://otro.example/mcp", tiers, "instrucción")
+
+    server = FakeMcpServer(SCHEMAS)
+    asyncio.run(FakeToolset(server, fp).get_tools())
+    config = _counter("adk_cache.invalidated.config")
+    other = adk_cache.fingerprint("https://stitch.example/mcp", tiers + [Tier(name="pro", model="gemini-2.5-pro")], "instrucción")
+    asyncio.run(FakeToolset(server, other).get_tools())
+    assert server.list_calls == 2
+    assert _counter("adk_cache.invalidated.config") == config + 1
+
+
+def test_corrupt_or_tampered_file_is_ignored(cache_path):
+    server = FakeMcpServer(SCHEMAS)
+    cache_path.write_text("{no es json")
+    asyncio.run(FakeToolset(server).get_tools())
+    assert server.list_calls == 1
+
+    entry = json.loads(cache_path.read_text())
+    entry["schemas"][0]["name"] = "otra_tool"
+    cache_path.write_text(json.dumps(entry))
+    mismatch = _counter("adk_cache.invalidated.schema_mismatch")
+    assert asyncio.run(FakeToolset(server).get_tools()) == ["generate_screen", "get_screen"]
+    assert _counter("adk_cache.invalidated.schema_mismatch") == mismatch + 1
+
+
+def test_refresh_swaps_changed_schemas(cache_path):
+    server = FakeMcpServer(SCHEMAS)
+    toolset = FakeToolset(server)
+    changed = _counter("adk_cache.schema_changed")
+
+    async def scenario():
+        await toolset.get_tools()
+        server.schemas = SCHEMAS + [{"name": "edit_screen", "inputSchema": {"type": "object"}}]
+        await toolset.refresh()            # fichero reciente: sin red
+        assert server.list_calls == 1
+        await toolset.refresh(force=True)
+        return await toolset.get_tools()
+
+    assert asyncio.run(scenario())[-1] == "edit_screen"
+    assert _counter("adk_cache.schema_changed") == changed + 1
+    # Otro worker lee los esquemas nuevos del fichero sin ir a la red
+    assert asyncio.run(FakeToolset(server).get_tools())[-1] == "edit_screen"
+    assert server.list_calls == 2
+
+
+def test_schema_error_forces_a_single_refresh(cache_path):
+    server = FakeMcpServer(SCHEMAS)
+    toolset = FakeToolset(server)
+    assert adk_cache.is_schema_error(SchemaError(-32602))
+    assert not adk_cache.is_schema_error(SchemaError(-32603))
+    assert not adk_cache.is_schema_error(RuntimeError("timeout"))
+
+    async def scenario():
+        await toolset.get_tools()
+        server.schemas = [{"name": "generate_screen_v2", "inputSchema": {"type": "object"}}]
+        started_at = time.monotonic()
+        # Varias llamadas fallan a la vez: un único list_tools
+        await asyncio.gather(*(toolset.on_schema_error(SchemaError(-32602), started_at) for _ in range(3)))
+        return await toolset.get_tools()
+
+    assert asyncio.run(scenario()) == ["generate_screen_v2"]
+    assert server.list_calls == 2
+
+
+def test_rejected_schemas_fall_back_to_network_toolset(cache_path):
+    server = FakeMcpServer([{"inputSchema": {"type": "object"}}])
+    assert asyncio.run(FakeToolset(server).get_tools()) == ["sin-cache"]
+    assert not cache_path.exists()
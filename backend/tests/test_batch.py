@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""/generate/batch: la cuota de la sesión se cobra por plan único antes de generar."""
+
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.routes import generate
+from app.dto.prompt_dto import BatchPromptDTO
+from app.dto.result_dto import GeneratedPageDTO
+from app.services.scheduler import scheduler
+
+
+@pytest.fixture
+def batch(monkeypatch, file_store, db):
+    generated = []
+
+    async def fake_generate_plan(plan, **kwargs):
+        generated.append(plan.site_type)
+        return GeneratedPageDTO.model_construct(html=f"<html>{plan.site_type}</html>", framework="html")
+
+    monkeypatch.setattr(generate.agent, "generate_plan", fake_generate_plan)
+    monkeypatch.setattr(scheduler, "rate", 0.0001)
+    monkeypatch.setattr(scheduler, "burst", 3)
+    request = SimpleNamespace(client=SimpleNamespace(host="127.0.0.1"))
+    session = f"batch-test-{time.time()}"
+
+    def run(*prompts):
+        data = BatchPromptDTO(prompts=[{"prompt": p} for p in prompts], session_id=session)
+
+        async def scenario():
+            response = await generate.generate_batch(data, request)
+            return [json.loads(line) async for line in response.body_iterator]
+
+        return asyncio.run(scenario())
+
+    run.generated = generated
+    return run
+
+
+def test_batch_charges_one_token_per_unique_plan(batch):
+    lines = batch("tienda de ropa", "Tienda  de ropa", "blog de viajes")   # 2 planes únicos
+    assert {line["status"] for line in lines} == {"ok"}
+    assert len(lines) == 3 and len(batch.generated) == 2
+    assert [line["deduplicated"] for line in sorted(lines, key=lambda l: l["index"])] == [False, True, False]
+
+    # Queda 1 token: otro batch de 2 planes únicos se rechaza sin generar nada
+    with pytest.raises(HTTPException) as e:
+        batch("tienda", "blog")
+    assert e.value.status_code == 429
+    assert "Retry-After" in e.value.headers
+    assert len(batch.generated) == 2
+
+    assert len(batch("blog")) == 1
+
+
+def test_batch_larger_than_burst_is_413(batch):
+    with pytest.raises(HTTPException) as e:
+        batch("tienda", "blog", "portfolio", "landing page")
+    assert e.value.status_code == 413
+    assert batch.generated == []
+
+
+def test_distinct_prompts_with_the_same_plan_are_not_merged(batch):
+    # analyze_prompt da el mismo plan (rama tienda, sin prompt) a las dos
+    lines = batch("tienda de zapatos", "tienda de café")
+    assert len(batch.generated) == 2
+    assert not any(line["deduplicated"] for line in lines)
@@ -0,0 +1,133 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Cassettes: la descarga se graba y se reproduce sin red; las imágenes van en ficheros aparte."""
+
+import os
+import json
+import gzip
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import cassettes, http_client, storage, stitch_adk_client
+from app.services.output_guard import OutputGuard
+from tests.test_http_client import PAGE, server  # noqa: F401  (fixture)
+
+IMAGE_B64 = "iVBORw0KGgo" + "A" * 4000
+
+
+class _Message:
+    """Doble mínimo de types.Content (lo que usa RecordingRunner)."""
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    def model_dump_json(self, **kwargs):
+        return json.dumps(self.data)
+
+    def model_dump(self, **kwargs):
+        return self.data
+
+
+class _Event:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def model_dump(self, **kwargs):
+        return self.data
+
+
+class _InnerRunner:
+    async def run_async(self, **kwargs):
+        yield _Event({"author": "stitch_agent", "content": {"parts": [{"text": "hola"}]}})
+
+
+@pytest.fixture
+def no_network(monkeypatch):
+    def fail():
+        raise AssertionError("el replay no debe hacer peticiones HTTP")
+
+    monkeypatch.setattr(http_client, "get_client", fail)
+
+
+def _record_download(url: str, directory: str):
+    async def scenario():
+        try:
+            return await cassettes.RecordingRunner(_InnerRunner(), directory=directory).download_html(
+                url, prefix="stitch/", suffix=".html"
+            )
+        finally:
+            await http_client.close()
+
+    return asyncio.run(scenario())
+
+
+def test_recorded_download_is_replayed_without_network(server, file_store, tmp_path, monkeypatch):
+    directory = str(tmp_path / "cassettes")
+    recorded = _record_download(server, directory)
+    storage.backend().delete(recorded.key)
+
+    def fail():
+        raise AssertionError("el replay no debe hacer peticiones HTTP")
+
+    monkeypatch.setattr(http_client, "get_client", fail)
+    replayed = asyncio.run(cassettes.ReplayRunner(directory=directory).download_html(
+        server, prefix="stitch/", suffix=".html"
+    ))
+    assert replayed.data == recorded.data == PAGE
+    assert replayed.key == recorded.key
+    assert storage.backend().get(replayed.key) == PAGE
+
+
+def test_run_attempt_uses_the_replayed_download(file_store, tmp_path, no_network, monkeypatch):
+    directory = str(tmp_path / "cassettes")
+    url = "https://stitch.example/download/abc"
+    cassettes._write_atomic(cassettes._download_path(directory, url), gzip.compress(PAGE))
+
+    class Replay(cassettes.ReplayRunner):
+        async def run_async(self, **kwargs):   # eventos de ADK de pega: tool result con la URL
+            yield SimpleNamespace(
+                content=SimpleNamespace(parts=[SimpleNamespace(
+                    function_response=SimpleNamespace(name="generate", response={"download_url": url}),
+                )]),
+                partial=False,
+                is_final_response=lambda: False,
+            )
+
+    async def create_session(**kwargs):
+        return SimpleNamespace(id="s1", user_id="u1")
+
+    monkeypatch.setattr(stitch_adk_client, "_session_service", SimpleNamespace(create_session=create_session))
+    monkeypatch.setattr(stitch_adk_client, "_run_config", lambda: None)
+    html = asyncio.run(stitch_adk_client._run_attempt(None, OutputGuard(), None, Replay(directory=directory)))
+    assert html == PAGE.decode("utf-8")
+
+
+def test_missing_recorded_download_raises_instead_of_fetching(tmp_path, no_network):
+    with pytest.raises(cassettes.CassetteNotFound):
+        asyncio.run(cassettes.ReplayRunner(directory=str(tmp_path)).download_html("https://x/y"))
+
+
+def test_images_are_stored_beside_the_cassette(tmp_path):
+    directory = str(tmp_path / "cassettes")
+    message = _Message({"role": "user", "parts": [
+        {"inline_data": {"mime_type": "image/png", "data": IMAGE_B64}},
+        {"text": "una landing"},
+    ]})
+
+    async def record():
+        runner = cassettes.RecordingRunner(_InnerRunner(), directory=directory)
+        return [e async for e in runner.run_async(new_message=message)]
+
+    asyncio.run(record())
+    path = os.path.join(directory, f"{cassettes.message_key(message)}.jsonl.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header_line = f.readline()
+    assert IMAGE_B64 not in header_line
+    assert len(os.listdir(os.path.join(directory, "blobs"))) == 1
+
+    header, entries = cassettes.load(path)
+    assert cassettes.restore_message(header, directory) == message.data
+    assert entries[0][1]["content"]["parts"][0]["text"] == "hola"
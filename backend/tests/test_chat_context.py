@@ -0,0 +1,44 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Contexto de la conversación en el chat: se calcula fuera del loop y se refresca tras responder."""
+
+import asyncio
+import threading
+import time
+
+from app.dto.result_dto import GeneratedPageDTO
+from app.services import conversation_context
+
+
+def test_context_is_built_off_the_loop_and_refreshed_after_the_response(monkeypatch, file_store, db):
+    from app.api.routes import chat
+
+    loop_thread = threading.get_ident()
+    calls = []
+    build_context = conversation_context.build_context
+
+    def recording_build_context(session, session_id, budget=None):
+        calls.append(threading.get_ident() != loop_thread)
+        return build_context(session, session_id, budget)
+
+    async def fake_generate_plan(plan, session_id=None, priority=None, rate_limited=True, on_progress=None):
+        return GeneratedPageDTO.model_construct(html=f"<html>{plan.prompt}</html>", framework="html")
+
+    monkeypatch.setattr(conversation_context, "build_context", recording_build_context)
+    monkeypatch.setattr(chat.agent, "generate_plan", fake_generate_plan)
+    session_id = f"ctx-test-{time.time_ns()}"
+
+    async def scenario():
+        result = await chat._process_message(db, session_id, "landing de yoga")
+        pending = list(chat._context_refreshes)
+        await asyncio.gather(*pending)
+        return result, pending
+
+    result, pending = asyncio.run(scenario())
+
+    assert result["response"] == "<html>landing de yoga</html>"
+    assert len(pending) == 1 and not chat._context_refreshes
+    assert calls == [True, True]
+    # El refresco en segundo plano deja el turno listo para los borradores del siguiente
+    assert "landing de yoga" in conversation_context.cached_context(session_id)
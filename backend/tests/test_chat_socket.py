@@ -0,0 +1,39 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""WebSocket del chat: un latido que no se puede enviar cierra la conexión."""
+
+import asyncio
+
+from app.api.routes import chat
+
+
+class _DeadSocket:
+    """Doble de WebSocket cuyo transporte ya está roto."""
+
+    def __init__(self):
+        self.sent = 0
+        self.closed_with = None
+
+    async def send_text(self, data: str):
+        self.sent += 1
+        raise RuntimeError("Cannot call send once a close message has been sent")
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+def test_failed_heartbeat_closes_socket_and_ends_task(monkeypatch):
+    monkeypatch.setattr(chat, "WS_HEARTBEAT_S", 0.01)
+    socket = _DeadSocket()
+    conn = chat._ChatSocket(socket, "hb-session")
+
+    async def scenario():
+        task = asyncio.create_task(conn.heartbeat())
+        await asyncio.wait_for(task, timeout=1)
+        return task
+
+    task = asyncio.run(scenario())
+    assert task.exception() is None      # terminó limpio: nada queda sin recoger
+    assert socket.sent == 1
+    assert socket.closed_with == 1011
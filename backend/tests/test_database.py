@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Pool de la BD: health check de las conexiones ociosas, métricas de pre-ping y search_path para PgBouncer."""
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql
+
+from app.db import database
+from app.services import metrics
+
+
+@pytest.fixture
+def pool_engine(tmp_path):
+    eng = database._make_engine(f"sqlite:///{tmp_path / 'pool.db'}", label="health_test", health_check="background",
+                                pool_size=3, max_overflow=0)
+    pings = []
+
+    @event.listens_for(eng, "before_cursor_execute")
+    def count_pings(conn, cursor, statement, parameters, context, executemany):
+        if statement == "SELECT 1":
+            pings.append(id(conn.connection.dbapi_connection))
+
+    yield eng, pings
+    eng.dispose()
+
+
+def _fill_pool(eng, broken: int = 0) -> list:
+    """Deja 3 conexiones ociosas en el pool, las `broken` primeras con la conexión DBAPI ya cerrada."""
+    conns = [eng.connect() for _ in range(3)]
+    raw = [c.connection.dbapi_connection for c in conns]
+    for conn in conns:
+        conn.close()
+    for dbapi_conn in raw[:broken]:
+        dbapi_conn.close()       # se cae estando ya ociosa en el pool
+    return raw
+
+
+def _counter(name: str) -> int:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+
+def test_health_check_pings_every_idle_connection(pool_engine):
+    eng, pings = pool_engine
+    raw = _fill_pool(eng)
+    assert database.check_pool_health({"health_test": eng}) == {"health_test": True}
+    assert sorted(pings) == sorted(id(r) for r in raw)
+    assert eng.pool.checkedin() == 3
+
+
+def test_health_check_reports_and_discards_broken_connections(pool_engine):
+    eng, pings = pool_engine
+    raw = _fill_pool(eng, broken=1)
+    failures = _counter("db.health_test.health_check_failures")
+
+    assert database.check_pool_health({"health_test": eng}) == {"health_test": False}
+    assert len(pings) == 2       # las sanas; la rota falla antes de llegar a ejecutar
+    assert _counter("db.health_test.health_check_failures") == failures + 1
+    # La rota no vuelve a salir del pool
+    conns = [eng.connect() for _ in range(3)]
+    try:
+        assert id(raw[0]) not in {id(c.connection.dbapi_connection) for c in conns}
+        assert all(c.execute(text("SELECT 1")).scalar() == 1 for c in conns)
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def test_health_check_disposes_the_pool_when_every_connection_fails(pool_engine):
+    eng, _ = pool_engine
+    raw = _fill_pool(eng, broken=3)
+    assert database.check_pool_health({"health_test": eng}) == {"health_test": False}
+    with eng.connect() as conn:
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert id(conn.connection.dbapi_connection) not in {id(r) for r in raw}
+
+
+@pytest.mark.parametrize("mode, measured", [("pre_ping", True), ("background", False)])
+def test_pre_ping_cost_is_measured_only_with_pre_ping(tmp_path, mode, measured):
+    label = f"ping_{mode}"
+    eng = database._make_engine(f"sqlite:///{tmp_path / 'ping.db'}", label=label, health_check=mode)
+    for _ in range(2):
+        with eng.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    eng.dispose()
+    assert (f"db.{label}.pre_ping_s" in metrics.snapshot()["distributions"]) is measured
+
+
+def test_pgbouncer_search_path_is_quoted():
+    dialect = postgresql.dialect()
+    assert database._set_search_path_sql(dialect, "app") == "SET LOCAL search_path TO app"
+    assert database._set_search_path_sql(dialect, "app, public") == "SET LOCAL search_path TO app, public"
+    assert database._set_search_path_sql(dialect, "Tenant-1") == 'SET LOCAL search_path TO "Tenant-1"'
+    assert (database._set_search_path_sql(dialect, 'x; DROP TABLE users; --"')
+            == 'SET LOCAL search_path TO "x; DROP TABLE users; --"""')
@@ -0,0 +1,102 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Documentos adjuntos: formatos admitidos, chunks, cache por contenido y claves de subida."""
+
+import asyncio
+import sys
+
+import pytest
+
+from app.services import doc_ingestion, storage
+
+
+@pytest.mark.parametrize("name", ["brief.txt", "notas.MD", "contrato.docx"])
+def test_supported_formats(name):
+    doc_ingestion.check_supported(name)
+
+
+def test_unsupported_format_is_rejected():
+    with pytest.raises(ValueError, match="no soportado"):
+        doc_ingestion.check_supported("setup.exe")
+
+
+def test_pdf_without_pypdf_is_rejected(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pypdf", None)   # import pypdf → ImportError
+    with pytest.raises(ValueError, match="pypdf"):
+        doc_ingestion.check_supported("informe.pdf")
+
+
+def test_chunk_text_groups_paragraphs_and_splits_long_ones():
+    text = "uno dos\n\ntres   cuatro\n\n\n" + "x" * 25 + "\n\ncinco"
+    assert doc_ingestion.chunk_text(text, max_chars=20) == [
+        "uno dos\ntres cuatro", "x" * 20, "xxxxx\ncinco",
+    ]
+    assert doc_ingestion.chunk_text("  \n\n  ") == []
+
+
+def test_select_chunks_prefers_matches_within_budget():
+    chunks = [
+        ("a.txt", 0, "horario de apertura y contacto"),
+        ("a.txt", 1, "precios de los cafés de especialidad " * 3),
+        ("b.txt", 0, "historia de la empresa"),
+        ("b.txt", 2, "precios y cafés"),
+    ]
+    selected = doc_ingestion.select_chunks(chunks, "página con precios de cafés", token_budget=20)
+    # El más relevante que cabe; el resultado mantiene el orden original
+    assert selected == [chunks[3]]
+    assert doc_ingestion.select_chunks(chunks, "precios cafés", token_budget=1000) == [chunks[1], chunks[3]]
+    # Sin ningún término en común entran por orden hasta el presupuesto
+    assert doc_ingestion.select_chunks(chunks[:1], "zzz", token_budget=1000) == chunks[:1]
+
+
+@pytest.fixture
+def uploaded(file_store, tmp_path, monkeypatch):
+    """Guarda un documento como lo hace /generate/upload y devuelve su clave."""
+    monkeypatch.setattr(doc_ingestion, "DOC_CACHE_DIR", str(tmp_path / "doc_cache"))
+
+    def upload(name: str, content: bytes) -> str:
+        key = storage.upload_key(name)
+        storage.backend().put(key, content, "text/plain")
+        return key
+
+    return upload
+
+
+def test_content_hash_cache_miss_then_hit(uploaded):
+    first = uploaded("brief.txt", b"Vendemos cafe de Colombia.\n\nAbrimos de lunes a viernes.")
+    copy = uploaded("copia.txt", b"Vendemos cafe de Colombia.\n\nAbrimos de lunes a viernes.")
+    other = uploaded("otro.txt", b"Otro contenido")
+
+    chunks, hit = asyncio.run(doc_ingestion.load_chunks(first))
+    assert not hit and chunks == ["Vendemos cafe de Colombia.\nAbrimos de lunes a viernes."]
+    # Mismo contenido con otra clave: se reutiliza la extracción
+    assert asyncio.run(doc_ingestion.load_chunks(copy)) == (chunks, True)
+    assert asyncio.run(doc_ingestion.load_chunks(other))[1] is False
+
+
+@pytest.mark.parametrize("key", ["/etc/passwd", "../.env", "index.json", "0" * 32 + "_../../.env", "0" * 32 + "_x.exe"])
+def test_documents_outside_uploads_are_never_read(uploaded, key):
+    with pytest.raises(ValueError):
+        asyncio.run(doc_ingestion.load_chunks(key))
+    context, report = asyncio.run(doc_ingestion.build_document_context([key], "cualquier cosa"))
+    assert context == "" and len(report["failed"]) == 1
+
+
+def test_generate_rejects_server_paths(monkeypatch):
+    from fastapi import HTTPException
+    from app.api.routes import generate
+    from app.dto.prompt_dto import PromptDTO
+
+    async def never(*args, **kwargs):
+        raise AssertionError("no debería generar")
+
+    monkeypatch.setattr(generate, "_run_scheduled", never)
+    for dto, status in [
+        (PromptDTO(prompt="landing", docs=["/etc/passwd"]), 422),
+        (PromptDTO(prompt="landing", images=["../.env"]), 422),
+        (PromptDTO(prompt="landing", docs=["0" * 32 + "_datos.exe"]), 415),
+    ]:
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(generate.generate_page(dto, request=None, db=None))
+        assert e.value.status_code == status
@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Pools compartidos y monitor del event loop: lag medido, parada con la app y guardado fuera del loop."""
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.dto.result_dto import GeneratedPageDTO
+from app.services import executors, metrics, warmup
+
+
+def _slow_lag_samples() -> int:
+    """Muestras de loop.lag_s por encima de 100 ms."""
+    lag = metrics.snapshot()["distributions"].get("loop.lag_s")
+    return lag["count"] - lag["buckets"]["le_0.1"] if lag else 0
+
+
+def test_loop_monitor_records_lag_when_the_loop_is_blocked(caplog):
+    slow, slow_callbacks = _slow_lag_samples(), metrics.snapshot()["counters"].get("loop.slow_callbacks", 0)
+
+    async def scenario():
+        monitor = executors.LoopMonitor(interval=0.01, threshold=0.05)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            time.sleep(0.3)                 # callback que bloquea el loop
+            await asyncio.sleep(0.05)
+        finally:
+            monitor.stop()
+
+    asyncio.run(scenario())
+
+    assert _slow_lag_samples() >= slow + 1
+    assert metrics.snapshot()["counters"]["loop.slow_callbacks"] >= slow_callbacks + 1
+    # La pila volcada apunta a quien bloqueaba
+    assert "test_loop_monitor_records_lag_when_the_loop_is_blocked" in caplog.text
+
+
+@pytest.fixture
+def client(monkeypatch, db):
+    """La app completa con el warm-up desactivado (no hay ADK ni Stitch en los tests)."""
+    from app import main
+
+    async def no_warm_up(blocking=False):
+        return None
+
+    monkeypatch.setattr(warmup, "warm_up", no_warm_up)
+    return TestClient(main.app)
+
+
+def test_process_pool_shuts_down_on_lifespan_exit(client):
+    with client:
+        pool = executors.process_pool()
+        assert pool.submit(abs, -3).result(timeout=30) == 3
+        assert executors._monitor is not None
+    assert executors._process_pool is None and executors._thread_pool is None and executors._monitor is None
+    with pytest.raises(RuntimeError):
+        pool.submit(abs, -3)
+
+
+def test_generate_saves_the_page_off_the_loop(client, monkeypatch):
+    from app.api.routes import generate
+    from app.db import repository
+
+    async def fake_run_scheduled(data, key):
+        return GeneratedPageDTO.model_construct(html="<html>yoga</html>", framework="html")
+
+    in_thread = []
+    run_in_thread = executors.run_in_thread
+
+    async def recording_run_in_thread(func, *args, **kwargs):
+        in_thread.append(func)
+        return await run_in_thread(func, *args, **kwargs)
+
+    monkeypatch.setattr(generate, "_run_scheduled", fake_run_scheduled)
+    monkeypatch.setattr(executors, "run_in_thread", recording_run_in_thread)
+    with client:
+        response = client.post("/generate", json={"prompt": "landing de yoga"})
+
+    assert response.status_code == 200 and response.json()["html"] == "<html>yoga</html>"
+    assert repository.save_generated_page in in_thread
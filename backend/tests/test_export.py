@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Exportación en bloque: tar con rangos, zip en streaming y objetos que cambian durante la descarga."""
+
+import io
+import json
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+from app.api.routes.export import _parse_range
+from app.services import export, metrics, storage
+
+
+@pytest.fixture
+def exported(file_store, monkeypatch):
+    """Tres páginas de una sesión (una con un fichero subido) y el plan de su exportación."""
+    monkeypatch.setattr(storage, "STREAM_CHUNK_BYTES", 64)   # varios trozos por objeto
+    session_id = f"export-test-{time.time_ns()}"
+    backend = storage.backend()
+    backend.put("logo.png", b"\x89PNG" + bytes(range(256)) * 3, "image/png")
+    pages = [
+        file_store.save_page(html=f"<html>{'x' * 700 * i}página {i}</html>", prompt=f"prompt {i}", site_type="landing",
+                             session_id=session_id, assets=["logo.png"] if i == 1 else None)
+        for i in range(3)
+    ]
+    return export.plan_export(session_id), pages
+
+
+def _tar_bytes(plan, start=0, end=None) -> bytes:
+    return b"".join(export.iter_tar(export.tar_segments(plan), start, end))
+
+
+def _members(data: bytes) -> dict:
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        return {m.name.split("/", 1)[1]: tar.extractfile(m).read() for m in tar.getmembers()}
+
+
+def test_tar_contains_pages_assets_and_manifest(exported):
+    plan, pages = exported
+    data = _tar_bytes(plan)
+    assert len(data) == export.tar_size(export.tar_segments(plan))
+
+    members = _members(data)
+    for page in pages:
+        assert members[f"pages/{page['page_id']}.html"] == storage.backend().get(page["html_file"])
+    assert members["assets/logo.png"].startswith(b"\x89PNG")
+    manifest = [json.loads(line) for line in members["manifest.jsonl"].splitlines()]
+    assert manifest[0]["pages"] == 3 and manifest[0]["objects"] == 7
+    assert [m["page_id"] for m in manifest[1:]] == [p["page_id"] for p in pages]
+
+
+@pytest.mark.parametrize("start, end", [(0, 0), (1, 511), (512, 1535), (700, None), (1000, 5000)])
+def test_tar_ranges_match_full_archive(exported, start, end):
+    plan, _ = exported
+    full = _tar_bytes(plan)
+    stop = len(full) if end is None else end + 1
+    assert _tar_bytes(plan, start, end) == full[start:stop]
+
+
+def test_tar_every_suffix_resumes_exactly(exported):
+    plan, _ = exported
+    full = _tar_bytes(plan)
+    for start in range(0, len(full), 97):
+        assert _tar_bytes(plan, start) == full[start:]
+
+
+def test_parse_range():
+    assert _parse_range("bytes=10-", 100) == (10, None)
+    assert _parse_range("bytes=10-19", 100) == (10, 19)
+    assert _parse_range("bytes=-30", 100) == (70, 99)
+    assert _parse_range("bytes=-", 100) is None
+    assert _parse_range("items=0-1", 100) is None
+    assert _parse_range(None, 100) is None
+
+
+def test_zip_round_trip(exported):
+    plan, pages = exported
+    data = b"".join(export.iter_zip(plan))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        names = {n.split("/", 1)[1]: n for n in zf.namelist()}
+        for page in pages:
+            assert zf.read(names[f"pages/{page['page_id']}.json"]) == storage.backend().get(page["json_file"])
+        assert zf.read(names["assets/logo.png"]) == storage.backend().get("logo.png")
+        assert b'"type": "export"' in zf.read(names["manifest.jsonl"])
+
+
+def test_object_deleted_mid_stream_is_zero_padded(exported):
+    plan, pages = exported
+    size = export.tar_size(export.tar_segments(plan))
+    deleted = metrics.snapshot()["counters"].get("export.deleted_objects", 0)
+    key = pages[2]["html_file"]
+    planned = next(e.size for e in plan.entries if e.key == key)
+
+    chunks = export.iter_tar(export.tar_segments(plan))
+    head = next(chunks)
+    storage.backend().delete(key)      # borrado después de planificar, con la descarga en curso
+    data = head + b"".join(chunks)
+
+    assert len(data) == size
+    members = _members(data)
+    assert members[f"pages/{pages[2]['page_id']}.html"] == bytes(planned)
+    assert members[f"pages/{pages[1]['page_id']}.html"] == storage.backend().get(pages[1]["html_file"])
+    assert metrics.snapshot()["counters"]["export.deleted_objects"] == deleted + 1
+
+    # El zip también sigue siendo válido
+    with zipfile.ZipFile(io.BytesIO(b"".join(export.iter_zip(plan)))) as zf:
+        assert zf.testzip() is None
+
+
+def test_shrunk_object_is_zero_padded(exported):
+    plan, pages = exported
+    key = pages[1]["html_file"]
+    planned = next(e.size for e in plan.entries if e.key == key)
+    storage.backend().put(key, b"<html>corta</html>", "text/html")
+
+    members = _members(_tar_bytes(plan))
+    content = members[f"pages/{pages[1]['page_id']}.html"]
+    assert len(content) == planned
+    assert content == b"<html>corta</html>" + bytes(planned - 18)
@@ -0,0 +1,34 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Caches en memoria del file store: nadie puede modificarlas desde fuera."""
+
+import asyncio
+
+
+def test_cached_entries_are_returned_as_copies(file_store):
+    meta = file_store.save_page(html="<html>a</html>", prompt="landing", site_type="landing",
+                                session_id="fs-copy", assets=["logo.png"])
+    page_id = meta["page_id"]
+
+    for got in (file_store.get_page_meta(page_id), file_store.list_pages("fs-copy")[0],
+                file_store.list_pages()[0], file_store.get_page(page_id)):
+        got["prompt"] = "modificado"
+        got["assets"].append("otro.png")
+
+    assert file_store.get_page_meta(page_id)["prompt"] == "landing"
+    assert file_store.get_page_meta(page_id)["assets"] == ["logo.png"]
+    assert file_store.get_page(page_id)["assets"] == ["logo.png"]
+
+
+def test_cache_stats_are_exposed_in_metrics(file_store):
+    from app import main
+
+    meta = file_store.save_page(html="<html>b</html>", prompt="blog", site_type="blog", session_id="fs-metrics")
+    file_store.get_page(meta["page_id"])
+    file_store.get_page(meta["page_id"])
+
+    body = asyncio.run(main.get_metrics())
+    caches = body["file_storage_caches"]
+    assert caches["page_cache"]["hits"] >= 1
+    assert caches["page_cache"]["entries"] >= 1
@@ -0,0 +1,74 @@
+"""Descargas en streaming al almacenamiento contra un servidor HTTP local."""
+
+import os
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app.services import http_client, storage
+
+PAGE = ("<!DOCTYPE html><html><body>" + "<p>sección ñ</p>" * 5000 + "</body></html>").encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.end_headers()
+        # Sin Content-Length y en trozos: el límite se aplica mientras llega
+        for i in range(0, len(PAGE), 8192):
+            self.wfile.write(PAGE[i:i + 8192])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/page.html"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+async def _download(url, **kwargs):
+    try:
+        return await http_client.download_to_storage(url, **kwargs)
+    finally:
+        await http_client.close()
+
+
+def test_download_is_stored_once_and_reused_by_save_page(server, file_store):
+    result = asyncio.run(_download(server, prefix=file_store.DOWNLOADS_PREFIX, suffix=".html"))
+
+    assert result.data == PAGE and result.size == len(PAGE)
+    assert result.key == file_store.download_key(PAGE)
+    assert storage.backend().get(result.key) == PAGE
+
+    meta = file_store.save_page(PAGE.decode("utf-8"), "prompt", "landing", "session-dl")
+    assert meta["html_file"] == result.key
+    assert storage.backend().stat(f"{meta['page_id']}.html") is None
+    assert file_store.get_page(meta["page_id"])["html"] == PAGE.decode("utf-8")
+
+
+def test_download_over_the_limit_leaves_nothing_behind(server, file_store):
+    with pytest.raises(http_client.DownloadTooLarge):
+        asyncio.run(_download(server, prefix="stitch/", suffix=".html", max_bytes=len(PAGE) // 2))
+    assert list(storage.backend().iter_objects()) == []
+    # Nada llega al almacenamiento hasta que la descarga termina bien
+    root = storage.backend().root
+    assert not os.path.exists(root) or not [name for name in os.listdir(root) if name.endswith(".tmp")]
+
+
+def test_removing_a_page_keeps_a_download_shared_with_another(server, file_store):
+    result = asyncio.run(_download(server, prefix=file_store.DOWNLOADS_PREFIX, suffix=".html"))
+    first = file_store.save_page(PAGE.decode("utf-8"), "a", "landing", "session-dl")
+    second = file_store.save_page(PAGE.decode("utf-8"), "b", "landing", "session-dl")
+
+    file_store.remove_pages([first["page_id"]])
+    assert storage.backend().stat(result.key) is not None
+    file_store.remove_pages([second["page_id"]])
+    assert storage.backend().stat(result.key) is None
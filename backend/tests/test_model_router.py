@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Router de modelos: las generaciones fallidas cuentan para el p95 y el chat marca las ediciones."""
+
+import asyncio
+
+import pytest
+
+from app.services import metrics, model_router, stitch_adk_client, conversation_context, shared_state
+from app.services.output_guard import OutputRejected
+from tests.test_stitch_client import PAGE, FakeRunner, text_event, fake_adk  # noqa: F401  (fixture)
+
+
+TIERS = [model_router.Tier(name=name, model="gemini-de-pega") for name in ("ok", "rejected", "broken")]
+
+
+@pytest.fixture(autouse=True)
+def test_router(monkeypatch):
+    monkeypatch.setattr(model_router, "router", model_router.ModelRouter(tiers=TIERS))
+
+
+def _tier(name: str) -> model_router.Tier:
+    return model_router.router.tier(name)
+
+
+def _observed(tier: model_router.Tier) -> int:
+    return metrics.snapshot()["distributions"].get(f"router.latency_s.{tier.name}", {}).get("count", 0)
+
+
+def _generate(tier, runner):
+    return asyncio.run(stitch_adk_client._generate_on_tier(tier, runner, lambda attempt: None))
+
+
+def test_successful_generation_is_observed(fake_adk):
+    tier = _tier("ok")
+    assert _generate(tier, FakeRunner([text_event(PAGE, final=True)])) == PAGE
+    assert _observed(tier) == 1
+
+
+def test_rejected_generation_is_observed(fake_adk):
+    tier = _tier("rejected")
+    with pytest.raises(OutputRejected):
+        _generate(tier, FakeRunner([text_event("He generado la página que pediste.", final=True)]))
+    assert _observed(tier) == 1
+    assert metrics.snapshot()["counters"]["router.failures.rejected"] == 1
+
+
+def test_failed_runner_is_observed(fake_adk):
+    class Broken:
+        async def run_async(self, **kwargs):
+            raise RuntimeError("503 del modelo")
+            yield
+
+    tier = _tier("broken")
+    with pytest.raises(RuntimeError):
+        _generate(tier, Broken())
+    assert _observed(tier) == 1
+
+
+def test_chat_edit_sets_base_page_id_and_raises_complexity():
+    from app.api.routes import chat
+
+    session_id = "router-edit"
+    shared_state.cache_set(f"ctx:{session_id}", {
+        **conversation_context._empty_state(),
+        "recent": [{"prompt": "una tienda", "page_id": "p-1", "site_type": "ecommerce"}],
+        "text": "...",
+    })
+
+    new = chat._plan(session_id, "una tienda de zapatos", "...")
+    edit = chat._plan(session_id, "cambia el hero a azul", "...")
+
+    assert new.base_page_id is None
+    assert edit.base_page_id == "p-1"
+    assert model_router.complexity(edit) == model_router.complexity(new) + model_router.ROUTER_EDIT_WEIGHT
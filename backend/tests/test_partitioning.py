@@ -0,0 +1,140 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Retención por particiones: DETACH, archivo y DROP en transacciones separadas (engine de prueba)."""
+
+from datetime import datetime
+
+import pytest
+
+from app.db import partitioning
+
+
+class _Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalar(self):
+        return self.rows[0]
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return list(self.rows)
+
+    def mappings(self):
+        return self
+
+    def partitions(self, size):
+        for i in range(0, len(self.rows), size):
+            yield self.rows[i:i + size]
+
+
+class _Conn:
+    def __init__(self, engine, tx: int):
+        self.engine, self.tx = engine, tx
+
+    def execution_options(self, **kwargs):
+        return self
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        self.engine.log.append((self.tx, sql))
+        if "pg_inherits i JOIN" in sql:
+            return _Result(self.engine.attached)
+        if "NOT EXISTS" in sql:
+            return _Result(self.engine.detached)
+        if sql.startswith("SELECT count(*)"):
+            return _Result([len(self.engine.rows)])
+        if sql.startswith("SELECT *"):
+            return _Result(self.engine.rows)
+        return _Result([None])
+
+
+class FakeEngine:
+    """Registra cada sentencia con el número de la conexión/transacción en la que se ejecuta."""
+
+    def __init__(self, attached=(), detached=(), rows=()):
+        self.attached, self.detached, self.rows = list(attached), list(detached), list(rows)
+        self.log = []
+        self._tx = 0
+
+    def _open(self):
+        engine = self
+
+        class _Context:
+            def __enter__(self):
+                engine._tx += 1
+                engine.log.append((engine._tx, "BEGIN"))
+                self.conn = _Conn(engine, engine._tx)
+                return self.conn
+
+            def __exit__(self, exc_type, exc, tb):
+                engine.log.append((self.conn.tx, "ROLLBACK" if exc_type else "END"))
+                return False
+
+        return _Context()
+
+    begin = connect = _open
+
+
+def _transactions(engine) -> list:
+    """[[sentencias]] por transacción, en orden."""
+    groups = {}
+    for tx, sql in engine.log:
+        groups.setdefault(tx, []).append(sql)
+    return [[s for s in stmts if s not in ("BEGIN", "END", "ROLLBACK")] for _, stmts in sorted(groups.items())]
+
+
+def test_detach_archive_and_drop_run_in_separate_transactions():
+    engine = FakeEngine(attached=["generated_pages_p202601", "generated_pages_p202609"], rows=[{"id": i} for i in range(2500)])
+    events = []
+
+    def archive(chunk):
+        events.append(("archive", len(chunk), engine.log[-1][0]))
+
+    report = partitioning.drop_partitions_before(engine, "generated_pages", datetime(2026, 3, 1), archive=archive)
+
+    assert report == {"partitions": 1, "rows": 2500}
+    txs = _transactions(engine)
+    detach = next(i for i, t in enumerate(txs) if any("DETACH PARTITION generated_pages_p202601" in s for s in t))
+    drop = next(i for i, t in enumerate(txs) if any("DROP TABLE generated_pages_p202601" in s for s in t))
+    assert txs[detach] == ["ALTER TABLE generated_pages DETACH PARTITION generated_pages_p202601"]
+    assert txs[drop] == ["DROP TABLE generated_pages_p202601"]
+    # El archivo va por una conexión distinta, entre el DETACH ya confirmado y el DROP
+    archived_in = {tx for _, _, tx in events}
+    assert len(archived_in) == 1
+    archive_tx = archived_in.pop() - 1
+    assert detach < archive_tx < drop
+    assert not any("ALTER" in s or "DROP" in s for s in txs[archive_tx])
+    assert [n for _, n, _ in events] == [1000, 1000, 500]
+    assert not any("p202609" in sql and ("DETACH" in sql or "DROP" in sql) for _, sql in engine.log)
+
+
+def test_failed_archive_reattaches_and_keeps_the_table():
+    engine = FakeEngine(attached=["chat_messages_p202601"], rows=[{"id": 1}])
+
+    def archive(chunk):
+        raise OSError("disco lleno")
+
+    with pytest.raises(OSError):
+        partitioning.drop_partitions_before(engine, "chat_messages", datetime(2026, 3, 1), archive=archive)
+
+    statements = [sql for _, sql in engine.log]
+    assert not any(s.startswith("DROP") for s in statements)
+    assert ("ALTER TABLE chat_messages ATTACH PARTITION chat_messages_p202601 "
+            "FOR VALUES FROM ('2026-01-01') TO ('2026-02-01')") in statements
+
+
+def test_leftover_detached_table_is_archived_and_dropped():
+    engine = FakeEngine(detached=["generated_pages_p202512", "generated_pages_p202605"], rows=[{"id": 1}])
+    archived = []
+
+    report = partitioning.drop_partitions_before(engine, "generated_pages", datetime(2026, 3, 1), archive=archived.extend)
+
+    statements = [sql for _, sql in engine.log]
+    assert report == {"partitions": 1, "rows": 1} and archived == [{"id": 1}]
+    assert not any("DETACH" in s for s in statements)
+    assert "DROP TABLE generated_pages_p202512" in statements
+    assert "DROP TABLE generated_pages_p202605" not in statements
@@ -0,0 +1,19 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Prueba de carga del pool: el modo background ejecuta de verdad los health checks."""
+
+from app.db import pool_loadtest
+
+
+def test_background_mode_runs_health_checks(tmp_path):
+    url = f"sqlite:///{tmp_path / 'load.db'}"
+    background, pre_ping = (
+        pool_loadtest._run_level(url, mode, concurrency=2, queries=40, hold_ms=5, pool_size=2, overflow=0,
+                                 health_check_s=0.01)
+        for mode in ("background", "pre_ping")
+    )
+    assert background["health_checks"] > 0
+    assert background["health_check_failures"] == 0
+    assert background["errors"] == 0
+    assert pre_ping["health_checks"] == 0 and pre_ping["pre_ping_ms_p95"] is not None
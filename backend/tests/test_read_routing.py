@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Lecturas con réplica: read-your-writes durante DATABASE_READ_YOUR_WRITES_S tras escribir."""
+
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db import database, repository
+from app.services import metrics
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch, db):
+    """Réplica vacía (con retraso infinito): todo lo escrito en el primario le falta."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    database.Base.metadata.create_all(engine)
+    monkeypatch.setattr(database, "ReplicaSessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setattr(repository, "READ_YOUR_WRITES_S", 0.3)
+    repository._pins.clear()
+    yield db
+    repository._pins.clear()
+    engine.dispose()
+
+
+def _reads() -> tuple:
+    counters = metrics.snapshot()["counters"]
+    return counters.get("db.reads.primary", 0), counters.get("db.reads.replica", 0)
+
+
+def test_reads_after_a_write_go_to_the_primary(replica):
+    session_id = f"rw-{time.time()}"
+    user = repository.get_or_create_user(replica, session_id)
+    repository.save_message(replica, user.id, "user", "hola")
+
+    primary, replica_reads = _reads()
+    history = repository.get_chat_history(replica, session_id)
+    assert [m.content for m in history] == ["hola"]
+    assert _reads() == (primary + 1, replica_reads)
+
+
+def test_pins_expire_and_reads_return_to_the_replica(replica):
+    session_id = f"rw-exp-{time.time()}"
+    user = repository.get_or_create_user(replica, session_id)
+    repository.save_message(replica, user.id, "user", "hola")
+    time.sleep(0.35)
+
+    primary, replica_reads = _reads()
+    # La réplica no tiene el usuario: se busca en el primario, pero la consulta salió a la réplica
+    assert [m.content for m in repository.get_chat_history(replica, session_id)] == ["hola"]
+    assert _reads()[1] == replica_reads + 1
+    assert repository._pins == {}   # caducados y expulsados
+
+
+def test_pins_stay_in_process_memory(replica, monkeypatch):
+    from app.services import shared_state
+
+    def no_shared_state(*args, **kwargs):
+        raise AssertionError("el pin no debe escribir en shared_state")
+
+    monkeypatch.setattr(shared_state, "cache_set", no_shared_state)
+    user = repository.get_or_create_user(replica, f"rw-mem-{time.time()}")
+    repository.save_message(replica, user.id, "agent", "<html></html>")
+    assert f"u:{user.id}" in repository._pins
@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Respuestas de /generate: JSON con orjson (o json compacto sin él) y HTML en crudo bajo demanda."""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.dto.result_dto import GeneratedPageDTO
+from app.services import responses
+
+HTML = "<html><body>Café con ñ</body></html>"
+
+
+@pytest.fixture
+def client(monkeypatch, db):
+    from app import main
+    from app.api.routes import generate
+
+    async def fake_run_scheduled(data, key):
+        return GeneratedPageDTO(html=HTML, framework="html")
+
+    monkeypatch.setattr(generate, "_run_scheduled", fake_run_scheduled)
+    return TestClient(main.app)   # sin `with`: no hace falta el arranque completo
+
+
+@pytest.mark.parametrize("url, headers", [
+    ("/generate?format=html", {}),
+    ("/generate", {"Accept": "text/html"}),
+    ("/generate", {"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"}),
+])
+def test_raw_html_on_request(client, url, headers):
+    response = client.post(url, json={"prompt": "landing"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert response.headers["x-framework"] == "html"
+    assert response.text == HTML
+
+
+@pytest.mark.parametrize("accept", [None, "application/json", "*/*", "text/html;q=0.1, application/json",
+                                    "text/*;q=0.5, application/json;q=0.9", "text/html, application/json"])
+def test_json_by_default(client, accept):
+    headers = {"Accept": accept} if accept else {}
+    response = client.post("/generate", json={"prompt": "landing"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert GeneratedPageDTO.model_validate(response.json()) == GeneratedPageDTO(html=HTML, framework="html")
+    assert "x-framework" not in response.headers
+
+
+@pytest.mark.parametrize("accept, html", [
+    ("text/html;q=0.1, application/json", False),
+    ("application/json;q=0.5, text/html", True),
+    ("text/*, application/json;q=0.2", True),
+    ("text/html;q=0, */*", False),
+    ("text/html;q=abc, application/json;q=0.1", False),
+    ("TEXT/HTML", True),
+    ("texto-sin-subtipo, text/html;q=0.3", True),
+    ("", False),
+])
+def test_wants_html_compares_q_values(accept, html):
+    request = SimpleNamespace(query_params={}, headers={"accept": accept})
+    assert responses.wants_html(request) is html
+
+
+def test_fast_json_falls_back_to_compact_json_without_orjson(monkeypatch):
+    content = {"html": HTML, "framework": "html", "n": [1, 2]}
+    with_orjson = responses.FastJSONResponse(content).body
+    monkeypatch.setattr(responses, "_orjson", False)     # como si orjson no estuviera instalado
+
+    body = responses.FastJSONResponse(GeneratedPageDTO(html=HTML, framework="html")).body
+    assert body == '{"html":"<html><body>Café con ñ</body></html>","framework":"html"}'.encode("utf-8")
+    assert responses.FastJSONResponse(content).body == with_orjson
+    assert json.loads(body) == {"html": HTML, "framework": "html"}
@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Retención de la BD: las filas de generated_pages se archivan antes de borrarse."""
+
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.db import repository
+from app.db.models import GeneratedPage
+from app.services import retention
+
+
+@pytest.fixture
+def expiring(tmp_path, monkeypatch, db):
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(retention, "RETENTION_BATCH_SIZE", 2)
+    monkeypatch.setattr(retention, "RETENTION_BATCH_PAUSE_S", 0)
+    monkeypatch.setattr(retention, "TTL_DAYS", {**retention.TTL_DAYS, "generated_pages": 7})
+    db.query(GeneratedPage).delete()
+    db.commit()
+    return db
+
+
+def _add_page(db, session_id: str, prompt: str, age_days: int) -> GeneratedPage:
+    user = repository.get_or_create_user(db, session_id)
+    page = repository.save_generated_page(db, user.id, prompt, "landing", f"<html>{prompt}</html>")
+    page.created_at = datetime.utcnow() - timedelta(days=age_days)
+    db.commit()
+    return page
+
+
+def _read_archive(path: str) -> list:
+    assert path.endswith(".jsonl.gz")   # sin zstandard instalado
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_expired_db_pages_are_archived_before_delete(expiring):
+    old_ids = [str(_add_page(expiring, "ret-a", f"old {i}", 30).id) for i in range(5)]
+    _add_page(expiring, "ret-a", "reciente", 1)
+
+    report = retention._expire_db(dry_run=False)
+
+    assert report["generated_pages"] == 5
+    rows = _read_archive(report["generated_pages_archive"])
+    assert sorted(r["id"] for r in rows) == sorted(old_ids)
+    assert all(r["html"] == f"<html>{r['prompt']}</html>" for r in rows)
+    expiring.expire_all()
+    assert [p.prompt for p in expiring.query(GeneratedPage).all()] == ["reciente"]
+
+
+def test_no_archive_file_when_nothing_expires(expiring):
+    _add_page(expiring, "ret-b", "reciente", 1)
+
+    report = retention._expire_db(dry_run=False)
+
+    assert report["generated_pages"] == 0
+    assert "generated_pages_archive" not in report
+
+
+def test_failed_archive_keeps_rows(expiring, monkeypatch):
+    _add_page(expiring, "ret-c", "old", 30)
+
+    def broken(self, rows):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(retention._RowArchive, "__call__", broken)
+    with pytest.raises(OSError):
+        retention._expire_db(dry_run=False)
+    expiring.expire_all()
+    assert expiring.query(GeneratedPage).count() == 1
@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Historial de revisiones: deltas por líneas, snapshots y qué puede borrar la retención."""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.db import repository
+from app.db.models import PageRevision
+from app.services import revisions
+
+
+def _page(rng: random.Random, lines: int = 60) -> str:
+    return "".join(f"<p>{rng.random():.8f}</p>\n" for _ in range(lines))
+
+
+@pytest.mark.parametrize("old, new", [
+    ("", "<html>\n</html>\n"),
+    ("<html>\n</html>\n", ""),
+    ("a\nb\nc\n", "a\nx\nc\n"),
+    ("a\nb\nc", "a\nb\nc\nd"),          # sin salto de línea final
+    ("uno\ndos\n", "dos\nuno\ndos\ntres\n"),
+    ("ñandú\n€\n", "ñandú\n€\n😀\n"),
+])
+def test_delta_round_trip(old, new):
+    assert revisions.apply_delta(old, revisions.make_delta(old, new)) == new
+
+
+def test_random_edit_sequence_round_trips():
+    rng = random.Random(3)
+    html = _page(rng)
+    for _ in range(50):
+        lines = html.splitlines(keepends=True)
+        for _ in range(rng.randint(1, 5)):
+            op = rng.choice(("replace", "insert", "delete"))
+            i = rng.randrange(len(lines))
+            if op == "replace":
+                lines[i] = f"<p>cambio {rng.random()}</p>\n"
+            elif op == "insert":
+                lines.insert(i, "<div>nuevo</div>\n")
+            elif len(lines) > 1:
+                del lines[i]
+        new = "".join(lines)
+        assert revisions.apply_delta(html, revisions.make_delta(html, new)) == new
+        html = new
+
+
+def test_encode_chain_reconstructs_every_revision(monkeypatch):
+    monkeypatch.setattr(revisions, "REVISION_SNAPSHOT_EVERY", 4)
+    rng = random.Random(5)
+    lines = _page(rng).splitlines(keepends=True)
+    stored, previous, last_snapshot = [], None, None
+    for number in range(1, 11):
+        lines[rng.randrange(len(lines))] = f"<p>revisión {number}</p>\n"
+        html = "".join(lines)
+        kind, content = revisions.encode(previous, html, number, last_snapshot)
+        if kind == revisions.KIND_SNAPSHOT:
+            last_snapshot = number
+        stored.append((kind, content, last_snapshot, html))
+        previous = html
+
+    assert [k for k, *_ in stored].count(revisions.KIND_SNAPSHOT) == 3   # revisiones 1, 5 y 9
+    for i, (_, _, base, html) in enumerate(stored):
+        assert revisions.reconstruct([(k, c) for k, c, *_ in stored[base - 1:i + 1]]) == html
+
+
+def test_large_delta_falls_back_to_snapshot():
+    rng = random.Random(9)
+    kind, content = revisions.encode(_page(rng), _page(rng), 2, 1)
+    assert kind == revisions.KIND_SNAPSHOT
+
+
+def test_reconstruct_requires_snapshot_first():
+    with pytest.raises(ValueError):
+        revisions.reconstruct([(revisions.KIND_DELTA, "[]")])
+
+
+@pytest.fixture
+def history(db, monkeypatch):
+    """Sesión con 7 revisiones (snapshot cada 3: 1, 4 y 7) de antigüedad decreciente."""
+    monkeypatch.setattr(revisions, "REVISION_SNAPSHOT_EVERY", 3)
+    user = repository.get_or_create_user(db, f"rev-test-{time.time_ns()}")
+    rng = random.Random(11)
+    lines = _page(rng).splitlines(keepends=True)
+    for number in range(1, 8):
+        lines[rng.randrange(len(lines))] = f"<p>revisión {number}</p>\n"
+        row = repository.save_page_revision(db, user.id, "".join(lines))
+        row.created_at = datetime.utcnow() - timedelta(days=10 - number)   # revisión 1: hace 9 días
+    db.commit()
+    return db, user
+
+
+def _kept(db, user) -> list:
+    db.expire_all()
+    rows = db.query(PageRevision).filter(PageRevision.user_id == user.id).order_by(PageRevision.revision).all()
+    return [r.revision for r in rows]
+
+
+def test_retention_keeps_chain_of_live_revisions(history):
+    db, user = history
+    # Caducan 1..5; la 5 es un delta sobre el snapshot 4, que sigue haciendo falta
+    cutoff = datetime.utcnow() - timedelta(days=4, hours=12)
+    while repository.delete_revisions_before(db, cutoff, batch_size=2):
+        pass
+    assert _kept(db, user) == [4, 5, 6, 7]
+    assert repository._reconstruct(repository._revision_chain(db, user.id, 6))
+
+
+def test_retention_drops_whole_expired_history(history):
+    db, user = history
+    while repository.delete_revisions_before(db, datetime.utcnow(), batch_size=3):
+        pass
+    assert _kept(db, user) == []
+
+
+def test_one_shot_pages_skip_revisions(db, monkeypatch):
+    monkeypatch.setattr(repository, "REVISIONS_ENABLED", True)
+    user = repository.get_or_create_user(db, f"api_{time.time_ns()}")
+    repository.save_generated_page(db, user.id, "landing", "landing", "<html>1</html>", revision=False)
+    repository.save_generated_pages_bulk(db, user.id, [{"prompt": "b", "site_type": "blog", "html": "<html>2</html>"}],
+                                         revision=False)
+    assert _kept(db, user) == []
+
+    repository.save_generated_page(db, user.id, "landing", "landing", "<html>3</html>")
+    assert _kept(db, user) == [1]
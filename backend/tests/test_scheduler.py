@@ -0,0 +1,52 @@
+"""Planificador: cuota por sesión fuera del event loop y envejecimiento de prioridades."""
+
+import time
+import asyncio
+import pytest
+from app.services.scheduler import (
+    GenerationScheduler, RateLimitExceeded, PRIORITY_API, PRIORITY_INTERACTIVE,
+)
+
+
+def test_check_rate_charges_cost_and_limits():
+    scheduler = GenerationScheduler(rate_per_min=0.001, burst=3)
+    session = f"s-{time.time()}"
+
+    async def scenario():
+        await scheduler.check_rate(session, cost=2)
+        await scheduler.check_rate(session)
+        with pytest.raises(RateLimitExceeded):
+            await scheduler.check_rate(session)
+
+    asyncio.run(scenario())
+
+
+def _order_of_service(aging_s: float) -> list:
+    """Un hueco ocupado; llega una petición API y, después, un flujo de interactivas."""
+    scheduler = GenerationScheduler(max_concurrency=1, rate_per_min=0, aging_s=aging_s)
+    served = []
+
+    async def request(name: str, priority: str):
+        async with scheduler.slot(name, priority):
+            served.append(name)
+            await asyncio.sleep(0.02)
+
+    async def scenario():
+        await scheduler.acquire("holder", PRIORITY_INTERACTIVE)
+        tasks = [asyncio.create_task(request("api", PRIORITY_API))]
+        await asyncio.sleep(0.1)
+        tasks += [asyncio.create_task(request(f"chat{i}", PRIORITY_INTERACTIVE)) for i in range(3)]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    return served
+
+
+def test_strict_priority_serves_interactive_first():
+    assert _order_of_service(aging_s=0)[-1] == "api"
+
+
+def test_aging_lets_a_waiting_api_request_through():
+    assert _order_of_service(aging_s=0.05)[0] == "api"
@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Búsqueda de texto completo en el file store (SQLite FTS5) y la ruta /search/files."""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes.search import router
+from app.services import search
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch, file_store):
+    monkeypatch.setattr(search, "SEARCH_DB", str(tmp_path / "search.db"))
+    return search
+
+
+def _meta(page_id: str, prompt: str, site_type: str = "landing", session_id: str = "s1") -> dict:
+    return {"page_id": page_id, "prompt": prompt, "site_type": site_type, "session_id": session_id,
+            "created_at": "2026-10-01T00:00:00"}
+
+
+def test_index_search_and_remove(index):
+    index.index_page(_meta("p1", "tienda de café"), "<html><style>.x{}</style><p>Granos de Colombia</p></html>")
+    index.index_page(_meta("p2", "blog de viajes", "blog"), "<html><script>cafe()</script><p>Lisboa</p></html>")
+
+    found = index.search_files("colombia")
+    assert found["total"] == 1 and found["results"][0]["page_id"] == "p1"
+    assert "<b>Colombia</b>" in found["results"][0]["snippet"]
+    # Sin diacríticos, prefijo en el último término; scripts y estilos no se indexan
+    assert [r["page_id"] for r in index.search_files("cafe")["results"]] == ["p1"]
+    assert index.search_files("lis")["results"][0]["page_id"] == "p2"
+    assert index.search_files("***") == {"total": 0, "results": []}
+
+    # Reindexar sustituye, no duplica
+    index.index_page(_meta("p1", "tienda de té"), "<p>Ceilán</p>")
+    assert index.search_files("colombia")["total"] == 0
+    assert index.search_files("ceilan")["total"] == 1
+
+    index.remove_page("p1")
+    assert index.search_files("ceilan")["total"] == 0
+
+
+def test_session_filter(index):
+    index.index_page(_meta("a", "portfolio de fotos", session_id="s1"), "<p>fotos</p>")
+    index.index_page(_meta("b", "portfolio de fotos", session_id="s2"), "<p>fotos</p>")
+    assert [r["page_id"] for r in index.search_files("fotos", session_id="s2")["results"]] == ["b"]
+
+
+def test_save_page_indexes_and_remove_pages_unindexes(index, file_store):
+    meta = file_store.save_page("<html><h1>Pastelería Dulce</h1></html>", "web de una pastelería", "landing", "s-save")
+    assert [r["page_id"] for r in index.search_files("pasteleria")["results"]] == [meta["page_id"]]
+    file_store.remove_pages([meta["page_id"]])
+    assert index.search_files("pasteleria")["total"] == 0
+
+
+def test_files_route_ranks_prompt_matches_first_and_paginates(index):
+    # "yoga" en el cuerpo de casi todas; solo una lo tiene en el prompt (pesa 10 frente a 1)
+    for i in range(5):
+        index.index_page(_meta(f"body{i}", f"landing número {i}"), f"<p>clases de yoga {i}</p>")
+    index.index_page(_meta("prompt", "estudio de yoga"), "<p>bienvenidos</p>")
+    client = TestClient(_app())
+
+    first = client.get("/search/files", params={"q": "yoga", "limit": 2}).json()
+    assert first["total"] == 6
+    assert [r["page_id"] for r in first["results"]][0] == "prompt"
+    scores = [r["score"] for r in first["results"]]
+    assert scores == sorted(scores, reverse=True)
+
+    pages = [client.get("/search/files", params={"q": "yoga", "limit": 2, "offset": o}).json()["results"]
+             for o in (0, 2, 4)]
+    ids = [r["page_id"] for page in pages for r in page]
+    assert len(ids) == 6 and len(set(ids)) == 6
+
+    assert client.get("/search/files", params={"q": ""}).status_code == 422
+    assert client.get("/search/files", params={"q": "yoga", "limit": 500}).status_code == 422
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+    return app
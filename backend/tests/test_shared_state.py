@@ -0,0 +1,63 @@
+"""Estado compartido entre procesos: sin escrituras perdidas ni IDs duplicados con varios workers."""
+
+import time
+import multiprocessing
+from app.services import shared_state
+
+PROCESSES = 4
+CALLS = 25
+
+
+def _save_pages(worker: int):
+    from app.services import file_storage
+    for i in range(CALLS):
+        file_storage.save_page(f"<p>{worker}-{i}</p>", f"prompt {worker}-{i}", "landing", "session-shared")
+
+
+def _take_tokens(worker: int, key: str, queue):
+    granted = sum(shared_state.take_token(key, rate=0, capacity=PROCESSES * CALLS // 2)[0] for _ in range(CALLS))
+    queue.put(granted)
+
+
+def _run(target, *args):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=target, args=(n, *args)) for n in range(PROCESSES)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+
+def test_save_page_from_several_processes_keeps_every_page(file_store):
+    _run(_save_pages)
+
+    pages = file_store.list_pages("session-shared")
+    ids = [p["page_id"] for p in pages]
+    assert len(pages) == PROCESSES * CALLS
+    assert len(set(ids)) == len(ids)
+    for page_id in ids:
+        assert file_store.get_page(page_id)["html"].startswith("<p>")
+
+
+def test_take_token_never_grants_more_than_the_capacity():
+    key = f"test:{time.time()}"
+    queue = multiprocessing.get_context("fork").Queue()
+    _run(_take_tokens, key, queue)
+
+    granted = sum(queue.get(timeout=10) for _ in range(PROCESSES))
+    assert granted == PROCESSES * CALLS // 2
+
+
+def test_purge_expired_removes_stale_rows():
+    shared_state.cache_set("test:expired", 1, ttl=0.01)
+    shared_state.cache_set("test:kept", 1, ttl=60)
+    shared_state.allocate_id("test", "old-id")
+    shared_state.take_token("test:idle", rate=1, capacity=1)
+    time.sleep(0.05)
+
+    deleted = shared_state.purge_expired(allocation_ttl_s=0, bucket_idle_s=0)
+
+    assert deleted["cache"] >= 1 and deleted["allocations"] >= 1 and deleted["buckets"] >= 1
+    assert shared_state.cache_get("test:kept") == 1
+    assert shared_state._connect().execute("SELECT 1 FROM cache WHERE key = 'test:expired'").fetchone() is None
@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Pre-generación especulativa: qué borradores se reutilizan al enviar."""
+
+import asyncio
+import time
+
+import pytest
+
+from app.agents.web_builder_agent import WebBuilderAgent
+from app.dto.result_dto import GeneratedPageDTO
+from app.services import metrics, speculation
+from app.services.speculation import Speculator, plan_key
+
+agent = WebBuilderAgent.__new__(WebBuilderAgent)   # analyze_prompt no necesita el generador
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(speculation, "SPECULATION_ENABLED", True)
+    monkeypatch.setattr(speculation, "SPECULATION_STABLE_DRAFTS", 2)
+    monkeypatch.setattr(speculation, "SPECULATION_MAX_PER_MIN", 100)
+
+
+def _session() -> str:
+    return f"spec-test-{time.time_ns()}"
+
+
+async def fake_generate(plan, on_progress):
+    await on_progress("generating", {})
+    return f"<html>{plan.prompt}</html>"
+
+
+def _draft_then_submit(drafts, final, session_id=None):
+    """Manda los borradores, deja avanzar la especulación y reclama con el plan final."""
+    speculator = Speculator()
+    session_id = session_id or _session()
+
+    async def scenario():
+        for text in drafts:
+            await speculator.on_draft(session_id, agent.analyze_prompt(text), fake_generate)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        task = speculator.claim(session_id, agent.analyze_prompt(final))
+        return await task if task else None
+
+    return asyncio.run(scenario())
+
+
+def test_spacing_and_case_only_in_branches_without_prompt():
+    # Las ramas "tienda"/"portfolio" no mandan el prompt al modelo: cualquier texto con el mismo plan vale
+    assert plan_key(agent.analyze_prompt("una tienda de ropa")) == plan_key(agent.analyze_prompt("Tienda online de zapatos"))
+    # La rama por defecto sí: el espaciado se normaliza, las palabras no
+    assert plan_key(agent.analyze_prompt("landing  de yoga\n")) == plan_key(agent.analyze_prompt("landing de yoga"))
+    assert plan_key(agent.analyze_prompt("landing de yoga")) != plan_key(agent.analyze_prompt("landing de yoga y pilates"))
+
+
+def test_stable_drafts_hit_when_final_differs_only_in_spacing():
+    # Se reutiliza la página del último borrador (con su espaciado)
+    html = _draft_then_submit(["landing de yoga", "landing de yoga "], "landing  de yoga")
+    assert html == "<html>landing de yoga </html>"
+
+
+def test_changed_prompt_misses_and_records_the_field():
+    before = metrics.snapshot()["counters"].get("speculation.miss_field.prompt", 0)
+    assert _draft_then_submit(["landing de yoga", "landing de yoga"], "landing de yoga y pilates") is None
+    assert metrics.snapshot()["counters"]["speculation.miss_field.prompt"] == before + 1
+
+
+def test_changed_site_type_misses():
+    before = metrics.snapshot()["counters"].get("speculation.miss_field.site_type", 0)
+    assert _draft_then_submit(["mi portfolio", "mi portfolio"], "mi tienda") is None
+    assert metrics.snapshot()["counters"]["speculation.miss_field.site_type"] == before + 1
+
+
+def test_concurrent_drafts_launch_a_single_generation():
+    speculator = Speculator()
+    session_id = _session()
+    started = metrics.snapshot()["counters"].get("speculation.started", 0)
+
+    async def scenario():
+        plan = agent.analyze_prompt("landing de yoga")
+        await speculator.on_draft(session_id, plan, fake_generate)
+        # Varios borradores iguales a la vez mientras se consulta la cuota en el pool de hilos
+        results = await asyncio.gather(*(speculator.on_draft(session_id, plan, fake_generate) for _ in range(3)))
+        await asyncio.sleep(0)
+        task = speculator.claim(session_id, plan)
+        return results, await task
+
+    results, html = asyncio.run(scenario())
+    assert all(results) and html == "<html>landing de yoga</html>"
+    assert metrics.snapshot()["counters"]["speculation.started"] == started + 1
+
+
+def test_draft_after_first_turn_hits_on_submit(monkeypatch, file_store, db):
+    from app.api.routes import chat
+
+    calls = []
+
+    async def fake_generate_plan(plan, session_id=None, priority=None, rate_limited=True, on_progress=None):
+        calls.append((priority, plan.context))
+        if on_progress is not None:
+            await on_progress("generating", {})
+        return GeneratedPageDTO.model_construct(html=f"<html>{plan.prompt}</html>", framework="html")
+
+    monkeypatch.setattr(chat.agent, "generate_plan", fake_generate_plan)
+    monkeypatch.setattr(speculation, "speculator", Speculator())
+    session_id = _session()
+    hits = metrics.snapshot()["counters"].get("speculation.hits", 0)
+
+    async def scenario():
+        await chat._process_message(db, session_id, "landing de yoga")
+        await asyncio.gather(*chat._context_refreshes)   # contexto del turno 1, en segundo plano
+        # Turno 2: borradores estables mientras se escribe y después el envío
+        assert not await chat._speculate(session_id, "landing de pilates")
+        assert await chat._speculate(session_id, "landing de pilates")
+        await asyncio.sleep(0)
+        return await chat._process_message(db, session_id, "landing de pilates")
+
+    result = asyncio.run(scenario())
+
+    assert result["response"] == "<html>landing de pilates</html>"
+    assert metrics.snapshot()["counters"]["speculation.hits"] == hits + 1
+    assert [priority for priority, _ in calls] == ["interactive", "speculative"]
+    assert "landing de yoga" in calls[1][1]   # la especulación ya llevaba el turno 1 en su contexto
@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""UI del chat preconstruida: nombres versionados, ETag/304 y variante comprimida según Accept-Encoding."""
+
+import gzip
+import hashlib
+import re
+import sys
+import types
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.services import static_assets
+
+CSS = b"body { color: #333; }\n" * 50
+JS = b"console.log('chat');\n" * 50
+
+
+@pytest.fixture
+def chat_dir(tmp_path, monkeypatch):
+    """Directorio del chat de prueba; el estado preconstruido se restaura al acabar."""
+    (tmp_path / "index.html").write_text(
+        '<link rel="stylesheet" href="{{chat.css}}"><script src="{{chat.js}}"></script>', encoding="utf-8")
+    (tmp_path / "chat.css").write_bytes(CSS)
+    (tmp_path / "chat.js").write_bytes(JS)
+    (tmp_path / "notas.txt").write_text("no se publica")
+    monkeypatch.setattr(static_assets, "STATIC_DIR", str(tmp_path))
+    monkeypatch.setattr(static_assets, "_index", None)
+    monkeypatch.setattr(static_assets, "_assets", {})
+    return tmp_path
+
+
+@pytest.fixture
+def client(chat_dir):
+    from app import main
+
+    return TestClient(main.app)   # sin `with`: no hace falta el arranque completo
+
+
+def _versioned(name: str, data: bytes) -> str:
+    base, ext = name.rsplit(".", 1)
+    return f"{base}.{hashlib.sha256(data).hexdigest()[:12]}.{ext}"
+
+
+def test_index_links_fingerprinted_assets(client):
+    response = client.get("/chat")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == static_assets.REVALIDATE_CACHE
+    assert f'href="/static/chat/{_versioned("chat.css", CSS)}"' in response.text
+    assert f'src="/static/chat/{_versioned("chat.js", JS)}"' in response.text
+    assert "{{" not in response.text
+
+    asset = client.get(f"/static/chat/{_versioned('chat.js', JS)}", headers={"Accept-Encoding": "identity"})
+    assert asset.content == JS
+    assert asset.headers["cache-control"] == static_assets.IMMUTABLE_CACHE
+    assert asset.headers["content-type"].startswith("application/javascript")
+
+
+def test_real_chat_ui_has_no_unresolved_placeholders(monkeypatch):
+    monkeypatch.setattr(static_assets, "_index", None)
+    monkeypatch.setattr(static_assets, "_assets", {})
+    static_assets.build()
+    html = static_assets._index.variants["identity"].decode("utf-8")
+    linked = re.findall(r"/static/chat/([\w.]+)", html)
+    assert not re.search(r"\{\{[\w.]+\}\}", html)
+    assert sorted(linked) == sorted(static_assets._assets)
+
+
+def test_matching_if_none_match_returns_304(client):
+    name = _versioned("chat.css", CSS)
+    first = client.get(f"/static/chat/{name}")
+    etag = first.headers["etag"]
+
+    cached = client.get(f"/static/chat/{name}", headers={"If-None-Match": f'"otro", {etag}'})
+    assert cached.status_code == 304 and cached.content == b""
+    assert cached.headers["etag"] == etag
+    assert client.get("/chat", headers={"If-None-Match": etag}).status_code == 200   # otro ETag
+
+    index_etag = client.get("/chat").headers["etag"]
+    assert client.get("/chat", headers={"If-None-Match": index_etag}).status_code == 304
+
+
+def test_encoding_follows_accept_encoding(chat_dir, monkeypatch):
+    # brotli es opcional: un módulo mínimo basta para que build() genere la variante br
+    monkeypatch.setitem(sys.modules, "brotli", types.SimpleNamespace(compress=lambda data, quality: b"br:" + data[:10]))
+    from app import main
+
+    client = TestClient(main.app)
+    url = f"/static/chat/{_versioned('chat.css', CSS)}"
+    # TestClient (httpx) descomprime gzip por sí mismo: se comparan los bytes en bruto
+    cases = [("br, gzip", "br", b"br:" + CSS[:10]), ("gzip;q=1.0", "gzip", gzip.compress(CSS, compresslevel=9, mtime=0)),
+             ("identity", None, CSS), ("", None, CSS)]
+    for accept, encoding, body in cases:
+        with client.stream("GET", url, headers={"Accept-Encoding": accept}) as response:
+            assert response.headers.get("content-encoding") == encoding
+            assert response.headers["vary"] == "Accept-Encoding"
+            assert b"".join(response.iter_raw()) == body
+
+
+@pytest.mark.parametrize("name", ["chat.css", "notas.txt", "index.html", "chat.000000000000.css", "..%2Findex.html"])
+def test_unknown_or_traversal_names_are_404(client, name):
+    assert client.get(f"/static/chat/{name}").status_code == 404
+
+
+@pytest.mark.parametrize("name", ["../index.html", "../../app/main.py", "/etc/passwd", ""])
+def test_asset_response_only_serves_built_names(chat_dir, name):
+    assert static_assets.asset_response(name, request=None) is None
@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Cliente de Stitch con un runner de ADK de pega (sin google-adk ni red)."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import stitch_adk_client
+from app.services.output_guard import OutputGuard, OutputRejected
+
+PAGE = "<!DOCTYPE html><html><body>" + "<p>hola</p>" * 50 + "</body></html>"
+
+
+def text_event(text: str, partial: bool = False, final: bool = False):
+    return SimpleNamespace(
+        content=SimpleNamespace(parts=[SimpleNamespace(text=text)]),
+        partial=partial,
+        is_final_response=lambda: final,
+    )
+
+
+class FakeRunner:
+    """Runner de ADK que reproduce una lista de eventos."""
+
+    def __init__(self, events):
+        self.events = events
+
+    async def run_async(self, **kwargs):
+        for event in self.events:
+            yield event
+
+
+@pytest.fixture
+def fake_adk(monkeypatch):
+    async def create_session(**kwargs):
+        return SimpleNamespace(id="s1", user_id="u1")
+
+    monkeypatch.setattr(stitch_adk_client, "_session_service", SimpleNamespace(create_session=create_session))
+    monkeypatch.setattr(stitch_adk_client, "_run_config", lambda: None)
+
+
+def _run(events) -> tuple:
+    """Ejecuta un intento y reconstruye el HTML parcial como lo hace chat.js."""
+    received = []
+
+    async def on_progress(stage, data):
+        if stage == "partial_html":
+            received.append(data)
+
+    html = asyncio.run(stitch_adk_client._run_attempt(None, OutputGuard(), on_progress, FakeRunner(events)))
+    preview = ""
+    for data in received:
+        preview = preview[:data["offset"]] + data["chunk"]
+    return html, preview, received
+
+
+def test_streamed_partials_are_sent_as_deltas(fake_adk):
+    pieces = [PAGE[i:i + 40] for i in range(0, len(PAGE), 40)]
+    events = [text_event(p, partial=True) for p in pieces] + [text_event(PAGE, final=True)]
+
+    html, preview, received = _run(events)
+
+    assert html == PAGE and preview == PAGE
+    # Cada carácter viaja una vez (antes, cada evento repetía todo lo anterior)
+    assert sum(len(d["chunk"]) for d in received) == len(PAGE)
+
+
+def test_final_response_that_differs_rewrites_the_turn(fake_adk):
+    events = [text_event("<!DOCTYPE html><html>borrador", partial=True), text_event(PAGE, final=True)]
+    html, preview, received = _run(events)
+    assert html == PAGE and preview == PAGE
+    assert received[-1]["offset"] == 0
+
+
+def test_several_non_streamed_turns_are_joined(fake_adk):
+    first, second = PAGE[:100], PAGE[100:]
+    html, preview, _ = _run([text_event(first, final=True), text_event(second, final=True)])
+    assert html == f"{first}\n{second}" == preview
+
+
+def test_generate_maps_output_rejected_to_502(monkeypatch):
+    from app.api.routes import generate
+
+    async def rejected(*args, **kwargs):
+        raise OutputRejected("not_html", "La respuesta no es HTML")
+
+    monkeypatch.setattr(generate.agent, "run", rejected)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(generate._run_scheduled(SimpleNamespace(prompt="x"), "ip:test"))
+    assert e.value.status_code == 502
+    assert e.value.detail["reason"] == "not_html"
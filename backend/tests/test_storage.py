@@ -0,0 +1,213 @@
+# SPDX-FileCopyrightText: 2026-present victorcu396 <vmenendezmata@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""Backends de almacenamiento: LocalStorage en disco y S3Storage contra un cliente S3 de pega."""
+
+import io
+import os
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+from app.services import storage
+
+
+class ClientError(Exception):
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self.stream = io.BytesIO(data)
+
+    def read(self):
+        return self.stream.read()
+
+    def iter_chunks(self, size):
+        while chunk := self.stream.read(size):
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class FakeS3:
+    """Lo que S3Storage usa de un cliente de boto3, en memoria y contando las llamadas."""
+
+    exceptions = type("exceptions", (), {"ClientError": ClientError})
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = {}
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _obj(self, key):
+        if key not in self.objects:
+            raise ClientError("NoSuchKey")
+        return self.objects[key]
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self._count("put_object")
+        self.objects[Key] = {
+            "data": Body, "etag": f'"{hashlib.md5(Body).hexdigest()}"', "mtime": datetime.now(timezone.utc),
+        }
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.put_object(bucket, key, fileobj.read())
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None):
+        self._count("get_object")
+        obj = self._obj(Key)
+        if IfNoneMatch is not None and IfNoneMatch == obj["etag"]:
+            raise ClientError("304")
+        data = obj["data"][int(Range[6:-1]):] if Range else obj["data"]
+        return {"Body": _Body(data), "ContentLength": len(data), "LastModified": obj["mtime"], "ETag": obj["etag"]}
+
+    def head_object(self, Bucket, Key):
+        self._count("head_object")
+        obj = self._obj(Key)
+        return {"ContentLength": len(obj["data"]), "LastModified": obj["mtime"], "ETag": obj["etag"]}
+
+    def delete_object(self, Bucket, Key):
+        self._count("delete_object")
+        self.objects.pop(Key, None)
+
+    def download_file(self, bucket, key, filename):
+        self._count("download_file")
+        with open(filename, "wb") as f:
+            f.write(self._obj(key)["data"])
+
+    def get_paginator(self, name):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {"Contents": [
+                    {"Key": k, "Size": len(o["data"]), "LastModified": o["mtime"], "ETag": o["etag"]}
+                    for k, o in sorted(client.objects.items()) if k.startswith(Prefix)
+                ]}
+
+        return Paginator()
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return storage.S3Storage(bucket="test", prefix="uploads/", cache_dir=str(tmp_path / "s3_cache"), client=FakeS3())
+
+
+def test_backends_are_abstract():
+    with pytest.raises(TypeError):
+        storage.StorageBackend()
+    with pytest.raises(TypeError):
+        storage.ObjectWriter()
+
+
+def test_s3_roundtrip(s3):
+    s3.put("a.html", b"<html>a</html>", "text/html")
+    writer = s3.open_writer()
+    writer.write(b"<html>")
+    writer.write(b"b</html>")
+    writer.commit("stitch/b.html", "text/html")
+
+    assert s3.get("a.html") == b"<html>a</html>"
+    assert s3.get("falta.html") is None and s3.stat("falta.html") is None
+    assert sorted(o.key for o in s3.iter_objects()) == ["a.html", "stitch/b.html"]
+    assert b"".join(s3.iter_chunks("stitch/b.html", offset=6, chunk_size=2)) == b"b</html>"
+    with pytest.raises(FileNotFoundError):
+        list(s3.iter_chunks("falta.html"))
+    with open(s3.local_path("a.html"), "rb") as f:
+        assert f.read() == b"<html>a</html>"
+    assert s3.delete("a.html") and s3.get("a.html") is None
+
+
+def test_s3_delete_is_a_single_request(s3):
+    s3.put("a.html", b"<html>a</html>")
+    s3.client.calls.clear()
+    s3.delete("a.html")
+    s3.delete("a.html")        # ya no existe: DELETE es idempotente
+    assert s3.client.calls == {"delete_object": 2}
+    assert s3.get("a.html") is None
+
+
+def test_s3_local_cache_is_bounded_lru(s3, monkeypatch):
+    for name in "abcd":
+        s3.put(f"{name}.txt", name.encode() * 100)
+    paths = {}
+    for i, name in enumerate("abc"):
+        paths[name] = s3.local_path(f"{name}.txt")
+        os.utime(paths[name], (time.time() - 100 + i, time.time() - 100 + i))
+    monkeypatch.setattr(storage, "S3_CACHE_MAX_BYTES", 250)
+
+    # "a" se acaba de usar: el LRU desaloja "b", el usado hace más tiempo
+    assert s3.local_path("a.txt") == paths["a"]
+    s3.local_path("d.txt")
+    assert sorted(os.listdir(s3.cache_dir)) == sorted(os.path.basename(p) for p in (paths["a"], s3.local_path("d.txt")))
+    assert s3.client.calls["download_file"] == 4
+
+    # Un acierto no descarga; una copia borrada por la expulsión se vuelve a descargar
+    with open(s3.local_path("b.txt"), "rb") as f:
+        assert f.read() == b"b" * 100
+    assert s3.client.calls["download_file"] == 5
+
+
+def test_s3_local_cache_expires_unused_copies(s3, monkeypatch):
+    monkeypatch.setattr(storage, "S3_CACHE_TTL_S", 60)
+    s3.put("viejo.txt", b"v")
+    s3.put("nuevo.txt", b"n")
+    old = s3.local_path("viejo.txt")
+    os.utime(old, (time.time() - 120, time.time() - 120))
+    stale_tmp = os.path.join(s3.cache_dir, "x_medio.txt.abc.tmp")
+    with open(stale_tmp, "wb") as f:
+        f.write(b"descarga abandonada")
+    os.utime(stale_tmp, (time.time() - 120, time.time() - 120))
+
+    new = s3.local_path("nuevo.txt")
+    assert os.listdir(s3.cache_dir) == [os.path.basename(new)]
+    assert s3.local_path("viejo.txt") == old and os.path.exists(old)   # se vuelve a bajar
+
+
+def test_s3_get_page_does_one_conditional_get(s3, file_store, monkeypatch):
+    monkeypatch.setattr(storage, "_backend", s3)
+    meta = file_store.save_page(html="<html>s3</html>", prompt="landing", site_type="landing", session_id="s3-page")
+    client = s3.client
+    client.calls.clear()
+
+    assert file_store.get_page(meta["page_id"])["html"] == "<html>s3</html>"   # fallo de cache
+    assert file_store.get_page(meta["page_id"])["html"] == "<html>s3</html>"   # 304
+    assert client.calls == {"get_object": 2}
+
+    # Reescrito fuera: el ETag cambia y se vuelve a leer
+    key = f"uploads/{meta['page_id']}.json"
+    raw = client.objects[key]["data"].replace(b"<html>s3</html>", b"<html>v2</html>")
+    client.put_object("test", key, raw)
+    assert file_store.get_page(meta["page_id"])["html"] == "<html>v2</html>"
+
+
+def test_local_put_is_safe_across_threads(tmp_path):
+    local = storage.LocalStorage(str(tmp_path / "uploads"))
+    payloads = [bytes([i]) * 200_000 for i in range(8)]
+    errors = []
+
+    def put(data):
+        try:
+            for _ in range(10):
+                local.put("misma.html", data)
+        except Exception as e:   # con "{ruta}.{pid}.tmp" los hilos se pisaban el temporal
+            errors.append(e)
+
+    threads = [threading.Thread(target=put, args=(p,)) for p in payloads]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert local.get("misma.html") in payloads
+    assert [o.key for o in local.iter_objects()] == ["misma.html"]
@@ -0,0 +1,53 @@
+"""Warm-up: reintentos acotados en modo blocking."""
+
+import asyncio
+import pytest
+from app.services import warmup
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(warmup, "RETRY_BASE_DELAY_S", 0.01)
+    monkeypatch.setattr(warmup, "RETRY_MAX_DELAY_S", 0.01)
+    monkeypatch.setattr(warmup, "state", {"ready": False, "steps": {}})
+
+
+def test_step_gives_up_after_max_attempts():
+    calls = []
+
+    def db_down():
+        calls.append(1)
+        raise RuntimeError("connection refused")
+
+    with pytest.raises(warmup.WarmupFailed):
+        asyncio.run(warmup._run_step("database", db_down, max_attempts=3))
+    assert len(calls) == 3
+    assert warmup.state["steps"]["database"]["ok"] is False
+
+
+def test_blocking_warm_up_fails_instead_of_hanging(monkeypatch):
+    async def adk_ok():
+        return None
+
+    def db_down():
+        raise RuntimeError("connection refused")
+
+    monkeypatch.setattr(warmup, "_check_database", db_down)
+    monkeypatch.setattr(warmup, "_init_adk", adk_ok)
+    monkeypatch.setattr(warmup, "WARMUP_MAX_ATTEMPTS", 2)
+
+    with pytest.raises(warmup.WarmupFailed):
+        asyncio.run(asyncio.wait_for(warmup.warm_up(blocking=True), 5))
+    assert not warmup.is_ready()
+
+
+def test_step_retries_until_it_succeeds():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("not yet")
+
+    asyncio.run(warmup._run_step("database", flaky, max_attempts=5))
+    assert warmup.state["steps"]["database"]["ok"] is True